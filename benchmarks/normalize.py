@@ -0,0 +1,92 @@
+"""
+Benchmark normalizeJsonld against the N-Quads round trip it replaced.
+
+Previously normalizeJsonld serialized the URDNA2015 canonical dataset to
+N-Quads with pyld.jsonld.normalize and parsed the text back with from_rdf.
+It now converts the canonical dataset directly, see
+sonormal.normalize.canonicalDataset.
+
+Documents are graphs of Dataset nodes, each with a creator, an identifier
+and keywords. For each size the output of both methods is checked to be
+identical and the best of the runs is reported.
+
+Usage:
+    python -m benchmarks.normalize [-r RUNS] [SIZE ...]
+"""
+import time
+import json
+import click
+import pyld.jsonld
+import sonormal.normalize
+
+BASE = "https://example.net/"
+
+
+def datasetGraph(n):
+    """JSON-LD document with n Dataset nodes"""
+    graph = []
+    for i in range(n):
+        graph.append(
+            {
+                "@id": f"{BASE}dataset/{i}",
+                "@type": "Dataset",
+                "name": f"Dataset {i}",
+                "creator": {"@type": "Person", "name": f"Person {i % 17}"},
+                "identifier": {
+                    "@type": "PropertyValue",
+                    "propertyID": "https://registry.identifiers.org/registry/doi",
+                    "value": f"doi:10.5072/{i}",
+                },
+                "keywords": [f"k{i % 5}", f"k{i % 7}", "benchmark"],
+            }
+        )
+    return {"@context": {"@vocab": "http://schema.org/"}, "@graph": graph}
+
+
+def nquadsRoundTrip(jdoc, options={}):
+    """normalizeJsonld as it was, through N-Quads text"""
+    opts = {
+        "algorithm": "URDNA2015",
+        "base": BASE,
+        "format": sonormal.MEDIA_NQUADS,
+    }
+    opts.update(options)
+    _rdf = pyld.jsonld.normalize(jdoc, options=opts)
+    return pyld.jsonld.from_rdf(_rdf, options=opts)
+
+
+def best(func, doc, runs):
+    # Lowest elapsed seconds of runs calls, and the result
+    elapsed = None
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        res = func(doc)
+        dt = time.perf_counter() - t0
+        if elapsed is None or dt < elapsed:
+            elapsed = dt
+    return elapsed, res
+
+
+@click.command()
+@click.option("-r", "--runs", default=1, help="Runs of each method per size")
+@click.argument("sizes", nargs=-1, type=int)
+def main(runs, sizes):
+    """Time normalizeJsonld and the N-Quads round trip for each SIZE."""
+    if len(sizes) == 0:
+        sizes = (50, 200, 1000)
+    print(f"{'nodes':>6} {'n-quads':>10} {'direct':>10} {'speedup':>8}")
+    for n in sizes:
+        doc = datasetGraph(n)
+        t_old, expected = best(nquadsRoundTrip, doc, runs)
+        t_new, res = best(
+            lambda d: sonormal.normalize.normalizeJsonld(d, options={"base": BASE}),
+            doc,
+            runs,
+        )
+        if json.dumps(res) != json.dumps(expected):
+            raise click.ClickException(f"Output differs for {n} nodes")
+        print(f"{n:>6} {t_old:>9.2f}s {t_new:>9.2f}s {t_old / t_new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
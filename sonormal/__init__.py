@@ -5,10 +5,18 @@ import re
 import string
 import json
 import pyld.jsonld
+import pyld.context_resolver
 import urllib.parse as urllib_parse
 import diskcache
 import atexit
 import copy
+import contextlib
+import threading
+import collections
+import time
+import datetime
+import zlib
+import lzma
 from sonormal.config import settings
 
 __L = logging.getLogger("sonormal")
@@ -65,10 +73,91 @@ SO_IDENTIFIER = f"{SO_}identifier"
 SO_VALUE = f"{SO_}value"
 SO_URL = f"{SO_}url"
 SO_PROPERTY_ID = f"{SO_}propertyID"
+SOS_ = "https://schema.org/"
 
-SO_COMPACT_CONTEXT = {"@context": ["http://schema.org/", {"id": "id", "type": "type"}]}
+# schema.org properties given the @list container in the SOSO list context
+SOSO_LIST_PROPERTIES = ("creator", "identifier", "description")
 
-SO_DATASET_FRAME = {
+
+class _FrozenDict(dict):
+    """dict that can not be modified, copies are plain dicts"""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Shared JSON-LD object can not be modified, copy it first")
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __deepcopy__(self, memo):
+        return {k: copy.deepcopy(v, memo) for k, v in self.items()}
+
+
+class _FrozenList(list):
+    """list that can not be modified, copies are plain lists"""
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("Shared JSON-LD object can not be modified, copy it first")
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = remove = pop = clear = sort = reverse = _immutable
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(v, memo) for v in self]
+
+
+def freezeJson(obj):
+    """
+    Immutable copy of a JSON object, for frames and contexts that are shared.
+
+    The dicts and lists of the result raise TypeError when modified. They
+    are still dict and list instances, so can be passed to pyld as is, and
+    a copy.deepcopy of them is a plain mutable copy.
+
+    Args:
+        obj: JSON object
+
+    Returns:
+        the immutable copy
+    """
+    if isinstance(obj, dict):
+        return _FrozenDict((k, freezeJson(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return _FrozenList(freezeJson(v) for v in obj)
+    return obj
+
+
+def copyContext(doc):
+    """
+    Copy of a shared frame or context document to pass to pyld.
+
+    pyld puts the @context of a frame or context in its output, so the copy
+    has a plain mutable copy of the @context and documents returned to
+    callers do not include shared objects. Other members are shared.
+
+    Args:
+        doc: frame or context document, e.g. SO_DATASET_FRAME
+
+    Returns:
+        dict
+    """
+    res = dict(doc)
+    if "@context" in res:
+        res["@context"] = copy.deepcopy(res["@context"])
+    return res
+
+
+# Shared and immutable, pass to pyld through copyContext
+SO_COMPACT_CONTEXT = freezeJson(
+    {"@context": ["http://schema.org/", {"id": "id", "type": "type"}]}
+)
+
+SO_DATASET_FRAME = freezeJson({
     "@context": {
       "@vocab":"http://schema.org/",
       "distribution": {
@@ -79,7 +168,7 @@ SO_DATASET_FRAME = {
     "@type": "Dataset",
     "identifier": {},
     "creator": {}
-}
+})
 
 # regexp to match the typical location of the schema.org remote context
 SO_MATCH = re.compile(r"http(s)?\://schema.org(/)?")
@@ -87,6 +176,31 @@ SO_MATCH = re.compile(r"http(s)?\://schema.org(/)?")
 # Timeout for the document loader requests
 REQUEST_TIMEOUT = 30  # seconds
 
+# Max number of keep-alive connections held for each host
+HTTP_POOL_SIZE = settings.get("HTTP_POOL_SIZE", 10)
+
+# Sessions unused for this long are closed and recreated on next use
+HTTP_POOL_IDLE_TIMEOUT = settings.get("HTTP_POOL_IDLE_TIMEOUT", 60)  # seconds
+
+# Max number of hosts with an open session, least recently used are closed
+HTTP_POOL_MAX_HOSTS = settings.get("HTTP_POOL_MAX_HOSTS", 256)
+
+# HTML responses are read until this many bytes once a JSON-LD script has
+# been found
+HTML_STREAM_BUDGET = settings.get("HTML_STREAM_BUDGET", 512 * 1024)  # bytes
+
+# Stop reading HTML at </head> when it contained JSON-LD. JSON-LD scripts in
+# <body> of such pages are then not loaded. Neither this nor the budget
+# applies when the loader options set extractAllScripts or the URL has a
+# fragment, see streamTruncates
+HTML_STREAM_HEAD_ONLY = settings.get("HTML_STREAM_HEAD_ONLY", False)
+
+# Responses larger than this are not loaded
+DOCUMENT_MAX_BYTES = settings.get("DOCUMENT_MAX_BYTES", 32 * 1024 * 1024)  # bytes
+
+# Size of chunks read from streamed responses
+STREAM_CHUNK_SIZE = 64 * 1024  # bytes
+
 # Default content type when not provided in server response
 # pyld defaults to application/octet-stream, which makes sense
 # but means sloppy HTML responses are not handled i4n load_document()
@@ -106,13 +220,67 @@ os.makedirs(DOCUMENT_CACHE_PATH, exist_ok=True)
 
 DOCUMENT_CACHE_TIMEOUT = 300  # Cache object expiration in seconds
 
+# Stale cache entries are kept this long so they can be revalidated
+# with the server instead of being downloaded again.
+DOCUMENT_CACHE_RETENTION = settings.get(
+    "DOCUMENT_CACHE_RETENTION", 7 * 24 * 3600
+)  # seconds
+
+# Compression applied to cached document records, "zlib" or "lzma"
+DOCUMENT_CACHE_COMPRESSION = settings.get("DOCUMENT_CACHE_COMPRESSION", "zlib")
+
+# Response headers retained in cached document records
+DOCUMENT_CACHE_HEADERS = [
+    "content-type",
+    "content-length",
+    "content-location",
+    "date",
+    "last-modified",
+    "etag",
+    "expires",
+    "cache-control",
+    "location",
+    "link",
+]
+
+# Version of the cached document record format
+DOCUMENT_CACHE_RECORD_VERSION = 1
+_CACHE_RECORD_MAGIC = b"SONORMAL"
+_CACHE_CODECS = {
+    "zlib": (b"z", zlib.compress, zlib.decompress),
+    "lzma": (b"x", lzma.compress, lzma.decompress),
+}
+
+# Counts of document cache outcomes:
+#   hits: fresh entry returned from cache
+#   revalidated: stale entry confirmed unchanged by the server (304)
+#   fetched: document downloaded in full
+#   rendered: document rendered in a browser and cached
+DOCUMENT_CACHE_STATS = collections.Counter(hits=0, revalidated=0, fetched=0)
+
+# Max number of resolved contexts kept per schema.org context variant
+ACTIVE_CONTEXT_CACHE_SIZE = 100
+
 # Global cache for downloaded stuff, especially context documents
 DOCUMENT_CACHE = diskcache.Cache(DOCUMENT_CACHE_PATH)
 
 
+# Upper bound on the total size in bytes of parsed context documents held
+# in memory. Size is estimated from the size of the source file.
+CONTEXT_DOCUMENT_CACHE_MAX_BYTES = settings.get(
+    "CONTEXT_DOCUMENT_CACHE_MAX_BYTES", 32 * 1024 * 1024
+)
+
+# Process wide cache of parsed local context documents, keyed by
+# (path, mtime, size). Entries are shared, callers must not modify them.
+_CONTEXT_DOCUMENTS = collections.OrderedDict()
+_CONTEXT_DOCUMENTS_LOCK = threading.Lock()
+
+
 def __cleanup():
     global DOCUMENT_CACHE
     DOCUMENT_CACHE.close()
+    SESSION_POOL.close()
 
 
 atexit.register(__cleanup)
@@ -154,6 +322,9 @@ def prepareSchemaOrgLocalContexts(
         "sos": os.path.join(context_folder, SCHEMA_ORG_HTTPS_CONTEXT_FILE),
         "sol": os.path.join(context_folder, SCHEMA_ORG_HTTP_LIST_CONTEXT_FILE),
     }
+    if SO_CONTEXT.get(SCHEMA_ORG_CONTEXT_URLS[0]) != paths["so"]:
+        # Context files moved, previously processed contexts are stale
+        ACTIVE_CONTEXTS.clear()
     for url in SCHEMA_ORG_CONTEXT_URLS:
         SO_CONTEXT[url] = paths["so"]
         SOS_CONTEXT[url] = paths["sos"]
@@ -189,21 +360,64 @@ def prepareSchemaOrgLocalContexts(
         json.dump(sos_context, so_dest, indent=2)
 
     # Add @list to identifier, creator, and description
-    so_context["@context"]["creator"] = {"@id": "schema:creator", "@container": "@list"}
-    so_context["@context"]["identifier"] = {
-        "@id": "schema:identifier",
-        "@container": "@list",
-    }
-    so_context["@context"]["description"] = {
-        "@id": "schema:description",
-        "@container": "@list",
-    }
+    for term in SOSO_LIST_PROPERTIES:
+        so_context["@context"][term] = {"@id": f"schema:{term}", "@container": "@list"}
     with open(paths["sol"], "w") as so_dest:
         json.dump(so_context, so_dest, indent=2)
+    # Files were rewritten, don't serve previously parsed copies
+    clearContextDocumentCache()
+    ACTIVE_CONTEXTS.clear()
     SO_CONTEXTS_PREPARED = True
     return paths
 
 
+def loadContextDocument(path):
+    """
+    Return the parsed JSON of a local context document.
+
+    Parsed documents are held in a process wide LRU cache keyed by the
+    path, modification time, and size of the file so that a rewritten
+    file is loaded again. The total size of cached documents is bounded
+    by CONTEXT_DOCUMENT_CACHE_MAX_BYTES.
+
+    The returned structure is shared between callers and must be treated
+    as read-only.
+
+    Args:
+        path (string): path to the context document
+
+    Returns:
+        dict: the parsed context document
+    """
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _CONTEXT_DOCUMENTS_LOCK:
+        entry = _CONTEXT_DOCUMENTS.get(key, None)
+        if entry is not None:
+            _CONTEXT_DOCUMENTS.move_to_end(key)
+            return entry
+    with open(path, "r") as src:
+        doc = json.load(src)
+    with _CONTEXT_DOCUMENTS_LOCK:
+        # Drop stale versions of the same file
+        for k in [k for k in _CONTEXT_DOCUMENTS if k[0] == path and k != key]:
+            del _CONTEXT_DOCUMENTS[k]
+        _CONTEXT_DOCUMENTS[key] = doc
+        total = sum(k[2] for k in _CONTEXT_DOCUMENTS)
+        while total > CONTEXT_DOCUMENT_CACHE_MAX_BYTES and len(_CONTEXT_DOCUMENTS) > 1:
+            k, _ = _CONTEXT_DOCUMENTS.popitem(last=False)
+            total -= k[2]
+    return doc
+
+
+def clearContextDocumentCache():
+    """
+    Remove all parsed context documents from the in memory cache.
+    """
+    with _CONTEXT_DOCUMENTS_LOCK:
+        _CONTEXT_DOCUMENTS.clear()
+
+
 class ObjDict(dict):
     """
     Implements a dict that enables access to properties like an object.
@@ -233,7 +447,398 @@ class RequestsSessionTrack(requests.Session):
         return loc
 
 
-def requests_document_loader_history(secure=False, **kwargs):
+class SessionPool:
+    """
+    Shared keep-alive HTTP sessions, one per scheme and host.
+
+    Reusing a session keeps connections, TLS sessions, and resolved
+    addresses for later requests to the same host. Sessions are
+    RequestsSessionTrack instances so redirects are still logged.
+
+    Sessions unused for idle_timeout seconds are closed whenever a session
+    is requested, and at most max_hosts sessions are kept open, closing the
+    least recently used first. Sessions taken with borrow() are not closed
+    until they are returned.
+    """
+
+    def __init__(
+        self,
+        pool_size=HTTP_POOL_SIZE,
+        idle_timeout=HTTP_POOL_IDLE_TIMEOUT,
+        max_hosts=HTTP_POOL_MAX_HOSTS,
+    ):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.max_hosts = max_hosts
+        # Ordered from least to most recently used
+        self._sessions = collections.OrderedDict()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _key(self, url):
+        pieces = urllib_parse.urlparse(url)
+        return f"{pieces.scheme}://{pieces.netloc}".lower()
+
+    def _newSession(self):
+        sess = RequestsSessionTrack()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=4, pool_maxsize=self.pool_size
+        )
+        sess.mount("http://", adapter)
+        sess.mount("https://", adapter)
+        return sess
+
+    def _evict(self, now, keep=None):
+        # Close idle sessions, then the least recently used over max_hosts.
+        # Sessions in use by a borrower and the one for keep are left open.
+        L = logging.getLogger("sonormal")
+        n = len(self._sessions)
+        for key, entry in list(self._sessions.items()):
+            if entry["in_use"] > 0 or key == keep:
+                continue
+            if now - entry["last_used"] > self.idle_timeout:
+                L.debug("Closing idle session for %s", key)
+            elif n > max(self.max_hosts, 1):
+                L.debug("Closing least recently used session for %s", key)
+            else:
+                break
+            self._closeEntry(key, entry)
+            del self._sessions[key]
+            n -= 1
+
+    def _checkout(self, url, borrow):
+        key = self._key(url)
+        now = time.time()
+        with self._lock:
+            self._evict(now)
+            entry = self._sessions.get(key, None)
+            if entry is None:
+                entry = {"session": self._newSession(), "last_used": now, "in_use": 0}
+                self._sessions[key] = entry
+                stats = self._stats.setdefault(
+                    key, {"sessions": 0, "requests": 0, "connections": 0}
+                )
+                stats["sessions"] += 1
+            else:
+                self._sessions.move_to_end(key)
+            entry["last_used"] = now
+            if borrow:
+                entry["in_use"] += 1
+            self._evict(now, keep=key)
+            self._stats[key]["requests"] += 1
+            return key, entry
+
+    def session(self, url):
+        """
+        Get the session for the host of url.
+
+        The session may be closed by a later call if it is evicted, use
+        borrow() when the session is used across other pool calls.
+
+        Args:
+            url (string): URL about to be requested
+
+        Returns:
+            RequestsSessionTrack
+        """
+        return self._checkout(url, False)[1]["session"]
+
+    @contextlib.contextmanager
+    def borrow(self, url):
+        """
+        Context manager providing the session for the host of url.
+
+        The session is not closed by eviction until the block exits.
+
+        Args:
+            url (string): URL about to be requested
+
+        Yields:
+            RequestsSessionTrack
+        """
+        key, entry = self._checkout(url, True)
+        try:
+            yield entry["session"]
+        finally:
+            with self._lock:
+                entry["in_use"] -= 1
+                entry["last_used"] = time.time()
+                if self._sessions.get(key, None) is entry:
+                    self._sessions.move_to_end(key)
+                elif entry["in_use"] == 0:
+                    # Replaced while borrowed, e.g. after close()
+                    self._closeEntry(key, entry)
+
+    def _connections(self, session):
+        # number of connections opened by the urllib3 pools of session
+        n = 0
+        adapters = {id(a): a for a in session.adapters.values()}
+        for adapter in adapters.values():
+            pools = adapter.poolmanager.pools
+            for k in pools.keys():
+                pool = pools.get(k)
+                if pool is not None:
+                    n += pool.num_connections
+        return n
+
+    def _closeEntry(self, key, entry):
+        self._stats[key]["connections"] += self._connections(entry["session"])
+        entry["session"].close()
+
+    def stats(self):
+        """
+        Per host connection statistics.
+
+        "connections" is the number of connections opened for the host
+        session, "requests" the number of loader requests to the host.
+
+        Returns:
+            dict: {host: {"sessions":, "requests":, "connections":}}
+        """
+        with self._lock:
+            res = {}
+            for key, stats in self._stats.items():
+                row = dict(stats)
+                entry = self._sessions.get(key, None)
+                if entry is not None:
+                    row["connections"] += self._connections(entry["session"])
+                res[key] = row
+            return res
+
+    def close(self):
+        """Close all sessions"""
+        with self._lock:
+            for key, entry in self._sessions.items():
+                if entry["in_use"] == 0:
+                    self._closeEntry(key, entry)
+            self._sessions = collections.OrderedDict()
+
+
+# Shared sessions used by requests_document_loader_history
+SESSION_POOL = SessionPool()
+
+
+def parseLinkHeader(url, link_header, content_type, profile=None):
+    """
+    Find the linked context and JSON-LD alternate in a response Link header.
+
+    The alternate is only returned when the response is not JSON. When
+    several alternates are offered, the first with type application/ld+json
+    and a matching profile (if profile is provided) is used.
+
+    Args:
+        url: URL of the response, for resolving relative links
+        link_header: value of the Link header, may be None
+        content_type: content type of the response
+        profile: preferred JSON-LD profile
+
+    Returns:
+        tuple: (context URL or None, absolute alternate URL or None)
+    """
+    if not link_header:
+        return None, None
+    links = pyld.jsonld.parse_link_header(link_header)
+    context_url = None
+    linked_context = links.get(pyld.jsonld.LINK_HEADER_REL)
+    # only 1 related link header permitted when matching for context
+    if linked_context and content_type != "application/ld+json":
+        if isinstance(linked_context, list):
+            raise pyld.jsonld.JsonLdError(
+                "URL could not be dereferenced, "
+                "it has more than one "
+                "associated HTTP Link Header.",
+                "jsonld.LoadDocumentError",
+                {"url": url},
+                code="multiple context link headers",
+            )
+        context_url = linked_context["target"]
+    linked_alternate = links.get("alternate")
+    # Linked alternate may be a list....
+    # A. type == application/ld+json, no profile
+    # OR
+    # B. type == application/ld+json, profile == supplied profile
+    # if not JSON-LD, alternate may point there
+    the_linked_alternate = None
+    if linked_alternate:
+        if isinstance(linked_alternate, list):
+            for candidate in linked_alternate:
+                __L.debug("CANDIDATE Link: %s", candidate)
+                if candidate.get("type") == "application/ld+json":
+                    if profile is not None:
+                        if candidate.get("profile") == profile:
+                            the_linked_alternate = candidate
+                            break
+                    else:
+                        the_linked_alternate = candidate
+                        break
+        else:
+            the_linked_alternate = linked_alternate
+    if (
+        the_linked_alternate
+        and the_linked_alternate.get("type") == "application/ld+json"
+        and not re.match(r"^application\/(\w*\+)?json$", content_type)
+    ):
+        return context_url, pyld.jsonld.prepend_base(url, the_linked_alternate["target"])
+    return context_url, None
+
+
+_LD_SCRIPT_OPEN = re.compile(rb"<script[^>]*?application/ld\+json[^>]*>", re.I)
+_SCRIPT_CLOSE = re.compile(rb"</script\s*>", re.I)
+_HEAD_CLOSE = re.compile(rb"</head\s*>", re.I)
+
+
+class HtmlJsonldScanner:
+    """
+    Incrementally scans HTML to tell when the JSON-LD has been received.
+
+    Feed the body as it arrives. feed() returns True once the body has
+    reached budget bytes with at least one JSON-LD script complete and
+    none open, or with head_only, at the end of <head> if it contained a
+    JSON-LD script.
+    JSON-LD scripts after that point are not included, and end is then
+    the offset in body to truncate at.
+
+    Each part of the body is searched once, apart from an incomplete tag
+    at the end of what has been received.
+    """
+
+    def __init__(self, budget=None, head_only=False):
+        if budget is None:
+            budget = HTML_STREAM_BUDGET
+        self.budget = budget
+        self.head_only = head_only
+        self.body = bytearray()
+        self.found = 0
+        self.head_closed = False
+        self.end = None
+        # End of the last tag matched
+        self._pos = 0
+        # Where the next search starts, no tag of interest starts before
+        self._scan = 0
+        self._in_script = False
+
+    def _resume(self, start):
+        # Offset of an incomplete tag at the end of body, else the end
+        tag = self.body.rfind(b"<", start)
+        if tag >= 0 and self.body.find(b">", tag) < 0:
+            return tag
+        return len(self.body)
+
+    def feed(self, chunk):
+        self.body += chunk
+        body = self.body
+        while True:
+            start = max(self._pos, self._scan)
+            if self._in_script:
+                m = _SCRIPT_CLOSE.search(body, start)
+                if m is None:
+                    self._scan = self._resume(start)
+                    break
+                self._in_script = False
+                self.found += 1
+                self._pos = m.end()
+                continue
+            m_open = _LD_SCRIPT_OPEN.search(body, start)
+            m_head = None
+            if not self.head_closed:
+                m_head = _HEAD_CLOSE.search(body, start)
+            if m_head is not None and (m_open is None or m_head.start() < m_open.start()):
+                self.head_closed = True
+                self._pos = m_head.end()
+                if self.head_only and self.found > 0:
+                    self.end = self._pos
+                    return True
+                continue
+            if m_open is None:
+                self._scan = self._resume(start)
+                break
+            self._in_script = True
+            self._pos = m_open.end()
+        if self.found > 0 and not self._in_script:
+            if len(body) >= self.budget:
+                self.end = self._pos
+                return True
+        return False
+
+
+def _isHtml(content_type):
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    return media_type in (MEDIA_HTML, "application/xhtml+xml", MEDIA_XHTML)
+
+
+def readResponseBody(
+    response, content_type, max_bytes=None, budget=None, head_only=False, truncate=True
+):
+    """
+    Read the body of a streamed requests response.
+
+    With truncate, HTML is read only until the JSON-LD it contains has been
+    received, see HtmlJsonldScanner. The response is consumed, use the
+    returned body instead of its content.
+
+    Args:
+        response: requests response from a request with stream=True
+        content_type: content type of the response
+        max_bytes: upper bound on the body size, default DOCUMENT_MAX_BYTES
+        budget: see HtmlJsonldScanner, default HTML_STREAM_BUDGET
+        head_only: see HtmlJsonldScanner
+        truncate: False to read all of the body
+
+    Returns:
+        bytes: the body
+
+    Raises:
+        ValueError if the body is larger than max_bytes
+    """
+    if max_bytes is None:
+        max_bytes = DOCUMENT_MAX_BYTES
+    length = response.headers.get("content-length", None)
+    if length is not None and length.isdigit() and int(length) > max_bytes:
+        response.close()
+        raise ValueError(f"Response of {length} bytes exceeds {max_bytes} bytes")
+    scanner = HtmlJsonldScanner(budget=budget, head_only=head_only)
+    html = truncate and _isHtml(content_type)
+    complete = True
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        if html:
+            if scanner.feed(chunk):
+                complete = False
+                break
+        else:
+            scanner.body += chunk
+        if len(scanner.body) > max_bytes:
+            response.close()
+            raise ValueError(f"Response exceeds {max_bytes} bytes")
+    body = bytes(scanner.body)
+    if not complete:
+        __L.debug("Stopped reading %s after %s bytes", response.url, len(body))
+        # Truncate at a tag boundary, not within a multibyte character
+        body = body[: scanner.end]
+        # Discards the rest of the response and the connection
+        response.close()
+    return body
+
+
+def streamTruncates(url, options):
+    """
+    True if a HTML response for url can be read only until its JSON-LD.
+
+    Every script is needed with the extractAllScripts option, and a URL
+    fragment selects a script by id that may be anywhere in the page.
+    """
+    if options.get("extractAllScripts", False):
+        return False
+    return urllib_parse.urlparse(url).fragment == ""
+
+
+def requests_document_loader_history(
+    secure=False,
+    session_pool=None,
+    max_bytes=None,
+    stream_budget=None,
+    stream_head_only=None,
+    **kwargs,
+):
     """
     Create a Requests document loader.
 
@@ -242,11 +847,26 @@ def requests_document_loader_history(secure=False, **kwargs):
     * Link responses are examined for alternate locations
     * A profile if provided is compared with link profiles during comparison
 
+    * Sessions are shared per host through a SessionPool for connection reuse
+    * HTML is read only until the JSON-LD has been received, and bodies
+      larger than max_bytes are rejected, see readResponseBody. All of the
+      HTML is read when the extractAllScripts option is set or the URL has
+      a fragment selecting a script.
+
     Can be used to setup extra Requests args such as verify, cert, timeout,
     or others.
     :param secure: require all requests to use HTTPS (default: False).
+    :param session_pool: SessionPool providing sessions (default: SESSION_POOL).
+    :param max_bytes: max response size (default: DOCUMENT_MAX_BYTES).
+    :param stream_budget: HTML bytes read once JSON-LD is found (default: HTML_STREAM_BUDGET).
+    :param stream_head_only: stop reading HTML at </head> if it has JSON-LD
+      (default: HTML_STREAM_HEAD_ONLY).
     :param **kwargs: extra keyword args for Requests get() call.
     :return: the RemoteDocument loader function.
+
+    A HostScheduler in the "scheduler" loader option, as set by
+    sonormal.scheduler.politeDocumentLoader, is used for the request to a
+    Link header alternate.
     """
 
     def loader(url, options={}):
@@ -256,7 +876,6 @@ def requests_document_loader_history(secure=False, **kwargs):
         :return: the RemoteDocument.
         """
         __L.debug("Enter loader")
-        _sess = RequestsSessionTrack()
         try:
             # validate URL
             pieces = urllib_parse.urlparse(url)
@@ -286,78 +905,65 @@ def requests_document_loader_history(secure=False, **kwargs):
                 headers = {"Accept": DEFAULT_REQUEST_ACCEPT_HEADERS}
 
             __L.debug("Request headers: %s", headers)
-            response = _sess.get(url, headers=headers, **kwargs)
-
-            content_type = response.headers.get("content-type")
-            if not content_type:
-                content_type = DEFAULT_RESPONSE_CONTENT_TYPE
-            doc = {
-                "contentType": content_type,
-                "contextUrl": None,
-                "documentUrl": response.url,
-                "document": None,  # document is parsed later
-                "response": None,  # Include the response for history/performance review
-            }
-            link_header = response.headers.get("link")
-            if link_header:
-                linked_context = pyld.jsonld.parse_link_header(link_header).get(
-                    pyld.jsonld.LINK_HEADER_REL
+            with session_pool.borrow(url) as _sess:
+                response = _sess.get(url, headers=headers, stream=True, **kwargs)
+                if response.status_code == requests.codes.not_modified:
+                    # Conditional request, caller has the document already
+                    response.content
+                    return {
+                        "contentType": response.headers.get("content-type"),
+                        "contextUrl": None,
+                        "documentUrl": response.url,
+                        "document": None,
+                        "response": response,
+                    }
+
+                content_type = response.headers.get("content-type")
+                if not content_type:
+                    content_type = DEFAULT_RESPONSE_CONTENT_TYPE
+                doc = {
+                    "contentType": content_type,
+                    "contextUrl": None,
+                    "documentUrl": response.url,
+                    "document": None,  # document is parsed later
+                    "response": None,  # Include the response for history/performance review
+                }
+                context_url, alternate_url = parseLinkHeader(
+                    url,
+                    response.headers.get("link"),
+                    content_type,
+                    profile=options.get("profile", None),
                 )
-                # only 1 related link header permitted when matching for context
-                if linked_context and content_type != "application/ld+json":
-                    if isinstance(linked_context, list):
-                        raise pyld.jsonld.JsonLdError(
-                            "URL could not be dereferenced, "
-                            "it has more than one "
-                            "associated HTTP Link Header.",
-                            "jsonld.LoadDocumentError",
-                            {"url": url},
-                            code="multiple context link headers",
-                        )
-                    doc["contextUrl"] = linked_context["target"]
-                linked_alternate = pyld.jsonld.parse_link_header(link_header).get(
-                    "alternate"
-                )
-                # Linked alternate may be a list....
-                # A. type == application/ld+json, no profile
-                # OR
-                # B. type == application/ld+json, profile == supplied profile
-                # if not JSON-LD, alternate may point there
-                the_linked_alternate = None
-                if linked_alternate:
-                    _profile = options.get("profile", None)
-                    if isinstance(linked_alternate, list):
-                        for candidate in linked_alternate:
-                            __L.debug("CANDIDATE Link: %s", candidate)
-                            if candidate.get("type") == "application/ld+json":
-                                if _profile is not None:
-                                    if candidate.get("profile") == _profile:
-                                        the_linked_alternate = candidate
-                                        break
-                                else:
-                                    the_linked_alternate = candidate
-                                    break
-                    else:
-                        the_linked_alternate = linked_alternate
-                if (
-                    the_linked_alternate
-                    and the_linked_alternate.get("type") == "application/ld+json"
-                    and not re.match(r"^application\/(\w*\+)?json$", content_type)
-                ):
-                    __L.debug("Linked alternate: %s", the_linked_alternate["target"])
+                doc["contextUrl"] = context_url
+                if alternate_url is not None:
+                    __L.debug("Linked alternate: %s", alternate_url)
+                    response.close()
                     doc["contentType"] = "application/ld+json"
-                    doc["documentUrl"] = pyld.jsonld.prepend_base(
-                        url, the_linked_alternate["target"]
-                    )
+                    doc["documentUrl"] = alternate_url
                     # recurse into loader with the new URL
-                    return loader(doc["documentUrl"], options=options)
-            # parse the json response and return
-            # Do not parse JSON here. It needs to be done in load_document to handle the
-            # situation where JSON-LD needs to be extracted from a HTML response.
-            # doc['document'] = response.json()
-            doc["document"] = response.content.decode()
-            doc["response"] = response
-            return doc
+                    scheduler = options.get("scheduler", None)
+                    if scheduler is None:
+                        return loader(doc["documentUrl"], options=options)
+                    scheduler.acquire(doc["documentUrl"])
+                    try:
+                        return loader(doc["documentUrl"], options=options)
+                    finally:
+                        scheduler.release(doc["documentUrl"])
+                # parse the json response and return
+                # Do not parse JSON here. It needs to be done in load_document to handle the
+                # situation where JSON-LD needs to be extracted from a HTML response.
+                # doc['document'] = response.json()
+                body = readResponseBody(
+                    response,
+                    content_type,
+                    max_bytes=max_bytes,
+                    budget=stream_budget,
+                    head_only=stream_head_only,
+                    truncate=streamTruncates(url, options),
+                )
+                doc["document"] = body.decode()
+                doc["response"] = response
+                return doc
         except pyld.jsonld.JsonLdError as e:
             raise e
         except Exception as cause:
@@ -368,21 +974,217 @@ def requests_document_loader_history(secure=False, **kwargs):
                 cause=cause,
             )
 
+    if session_pool is None:
+        session_pool = SESSION_POOL
+    if stream_head_only is None:
+        stream_head_only = HTML_STREAM_HEAD_ONLY
     return loader
 
 
+def _responseStatus(res):
+    # HTTP status of the response included in a loader result, if any
+    response = res.get("response", None)
+    if response is None:
+        return None
+    return getattr(response, "status_code", None)
+
+
+def _responseValidators(res):
+    """
+    ETag and Last-Modified values of the response in a loader result.
+
+    Returns:
+        tuple: (etag, last_modified), None where not available
+    """
+    response = res.get("response", None)
+    if response is None:
+        return None, None
+    headers = {k.lower(): v for k, v in getattr(response, "headers", {}).items()}
+    return headers.get("etag", None), headers.get("last-modified", None)
+
+
+def _responseRecord(r):
+    # JSON-able summary of a requests response like object
+    elapsed = getattr(r, "elapsed", None)
+    if isinstance(elapsed, datetime.timedelta):
+        elapsed = elapsed.total_seconds()
+    headers = {}
+    for k, v in getattr(r, "headers", {}).items():
+        if k.lower() in DOCUMENT_CACHE_HEADERS:
+            headers[k.lower()] = v
+    return {
+        "url": getattr(r, "url", None),
+        "status_code": getattr(r, "status_code", None),
+        "elapsed": elapsed,
+        "headers": headers,
+    }
+
+
+def _responseFromRecord(rec):
+    return ObjDict(
+        {
+            "url": rec["url"],
+            "status_code": rec["status_code"],
+            "headers": requests.structures.CaseInsensitiveDict(rec["headers"]),
+            "elapsed": datetime.timedelta(seconds=rec["elapsed"] or 0),
+            "text": None,
+        }
+    )
+
+
+def encodeCacheEntry(entry, compression=None):
+    """
+    Serialize a document cache entry to a compact, compressed record.
+
+    The record holds the document, the essential response headers, and
+    the request and redirect history needed by responseSummary. It is
+    JSON compressed with zlib or lzma, so loading it never unpickles
+    arbitrary objects.
+
+    Args:
+        entry (dict): cache entry with doc, cached, etag, last_modified,
+            and optionally text, the response body to keep
+        compression (string): "zlib" or "lzma", default DOCUMENT_CACHE_COMPRESSION
+
+    Returns:
+        bytes
+    """
+    if compression is None:
+        compression = DOCUMENT_CACHE_COMPRESSION
+    codec, compress, _ = _CACHE_CODECS[compression]
+    doc = entry["doc"]
+    record = {
+        "v": DOCUMENT_CACHE_RECORD_VERSION,
+        "cached": entry["cached"],
+        "etag": entry["etag"],
+        "last_modified": entry["last_modified"],
+        "contentType": doc.get("contentType", None),
+        "contextUrl": doc.get("contextUrl", None),
+        "documentUrl": doc.get("documentUrl", None),
+        "document": doc.get("document", None),
+        "response": None,
+    }
+    if entry.get("text", None) is not None:
+        record["text"] = entry["text"]
+    response = doc.get("response", None)
+    if response is not None:
+        rec = _responseRecord(response)
+        request = getattr(response, "request", None)
+        rec["request"] = {
+            "url": getattr(request, "url", rec["url"]),
+            "headers": dict(getattr(request, "headers", {})),
+        }
+        rec["history"] = [_responseRecord(r) for r in getattr(response, "history", [])]
+        resources = getattr(response, "resources_loaded", None)
+        if resources is not None:
+            rec["resources_loaded"] = list(resources)
+        for k in ("requests_blocked", "requests_allowed"):
+            v = getattr(response, k, None)
+            if v is not None:
+                rec[k] = v
+        record["response"] = rec
+    data = json.dumps(record, separators=(",", ":")).encode("utf-8")
+    return _CACHE_RECORD_MAGIC + codec + compress(data)
+
+
+def decodeCacheEntry(data):
+    """
+    Load a document cache entry from a record made by encodeCacheEntry.
+
+    The response is restored as an ObjDict with the attributes used by
+    responseSummary.
+
+    Args:
+        data (bytes): the record
+
+    Returns:
+        dict: cache entry, or None if data is not a record of the current version
+    """
+    if not isinstance(data, bytes) or not data.startswith(_CACHE_RECORD_MAGIC):
+        return None
+    codec = data[len(_CACHE_RECORD_MAGIC) : len(_CACHE_RECORD_MAGIC) + 1]
+    for _codec, _, decompress in _CACHE_CODECS.values():
+        if _codec == codec:
+            break
+    else:
+        return None
+    record = json.loads(decompress(data[len(_CACHE_RECORD_MAGIC) + 1 :]))
+    if record.get("v") != DOCUMENT_CACHE_RECORD_VERSION:
+        return None
+    doc = {
+        "contentType": record["contentType"],
+        "contextUrl": record["contextUrl"],
+        "documentUrl": record["documentUrl"],
+        "document": record["document"],
+        "response": None,
+    }
+    rec = record["response"]
+    if rec is not None:
+        response = _responseFromRecord(rec)
+        response["request"] = ObjDict(rec["request"])
+        response["history"] = [_responseFromRecord(r) for r in rec["history"]]
+        for k in ("resources_loaded", "requests_blocked", "requests_allowed"):
+            if k in rec:
+                response[k] = rec[k]
+        response["text"] = record.get("text", None)
+        doc["response"] = response
+    return {
+        "doc": doc,
+        "cached": record["cached"],
+        "etag": record["etag"],
+        "last_modified": record["last_modified"],
+        "text": record.get("text", None),
+    }
+
+
+def _getDocumentCacheEntry(document_cache, url):
+    try:
+        entry = document_cache.get(url, None)
+        if isinstance(entry, bytes):
+            entry = decodeCacheEntry(entry)
+    except Exception as e:
+        __L.warning("Unable to read cache entry for %s", url)
+        return None
+    if not isinstance(entry, dict) or "cached" not in entry:
+        # Missing, or a loader result cached by an older version
+        return None
+    return entry
+
+
+def _setDocumentCacheEntry(document_cache, url, entry, expire=None):
+    if isinstance(document_cache, dict):
+        document_cache[url] = entry
+        return
+    if expire is None:
+        expire = DOCUMENT_CACHE_RETENTION
+    try:
+        document_cache.set(url, encodeCacheEntry(entry), expire=expire)
+    except Exception as e:
+        __L.warning("Unable to cache response from %s", url)
+
+
 def localRequestsDocumentLoader(
-    context_map={}, document_cache=None, fallback_loader=None
+    context_map={}, document_cache=None, fallback_loader=None, static_contexts=False
 ):
     """Return a pyld.jsonld document loader.
 
     The document loader intercepts requests to retrieve a remote context
     and replaces with a local copy of the document.
 
+    Documents are served from document_cache for DOCUMENT_CACHE_TIMEOUT
+    seconds. After that the entry is revalidated using the ETag and
+    Last-Modified values of the original response, and a 304 response
+    refreshes the entry without downloading the body again. Outcomes
+    are counted in DOCUMENT_CACHE_STATS.
+
     Args:
         context_map (dict): map of context URL to local document
         document_cache (dict like): cache for documents, can be dict or DiskCache
         fallback_loader: loader to use if not local or in cache
+        static_contexts (bool): tag documents from context_map as static so
+            pyld keeps their processed form in the context resolver cache.
+            Only safe with a context resolver cache dedicated to context_map,
+            see ActiveContextRegistry.
 
     Returns:
         dict:
@@ -390,10 +1192,14 @@ def localRequestsDocumentLoader(
 
     def localRequestsDocumentLoaderImpl(url, options={}):
         # is a cached copy available?
+        entry = None
         if not document_cache is None:
-            if url in document_cache:
-                __L.debug("Cache hit: %s", url)
-                return document_cache[url]
+            entry = _getDocumentCacheEntry(document_cache, url)
+            if entry is not None:
+                if time.time() - entry["cached"] < DOCUMENT_CACHE_TIMEOUT:
+                    __L.debug("Cache hit: %s", url)
+                    DOCUMENT_CACHE_STATS["hits"] += 1
+                    return dict(entry["doc"])
         # does URL match something in the context_map?
         doc = context_map.get(url, None)
         if not doc is None:
@@ -401,20 +1207,42 @@ def localRequestsDocumentLoader(
                 "contextUrl": None,
                 "documentUrl": "https://schema.org/docs/jsonldcontext.jsonld",
                 "contentType": "application/ld+json",
-                "document": json.load(open(doc, "r")),
+                "document": loadContextDocument(doc),
             }
+            if static_contexts:
+                res["tag"] = "static"
             return res
         # No mapping available, fall back to using the fallback_loader
-        res = fallback_loader(url, options)
+        # A stale entry with validators is revalidated with a conditional request
+        _options = options
+        if entry is not None and (entry["etag"] or entry["last_modified"]):
+            headers = dict(
+                options.get("headers") or {"Accept": DEFAULT_REQUEST_ACCEPT_HEADERS}
+            )
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+            _options = dict(options)
+            _options["headers"] = headers
+        res = fallback_loader(url, _options)
+        if entry is not None and _responseStatus(res) == 304:
+            __L.debug("Cache revalidated: %s", url)
+            DOCUMENT_CACHE_STATS["revalidated"] += 1
+            entry["cached"] = time.time()
+            _setDocumentCacheEntry(document_cache, url, entry)
+            return dict(entry["doc"])
+        DOCUMENT_CACHE_STATS["fetched"] += 1
         if not document_cache is None:
             # cache the response for later reuse
-            if isinstance(document_cache, dict):
-                document_cache[url] = res
-            else:
-                try:
-                    document_cache.set(url, res, expire=DOCUMENT_CACHE_TIMEOUT)
-                except Exception as e:
-                    __L.warning("Unable to cache response from %s", url)
+            etag, last_modified = _responseValidators(res)
+            entry = {
+                "doc": res,
+                "cached": time.time(),
+                "etag": etag,
+                "last_modified": last_modified,
+            }
+            _setDocumentCacheEntry(document_cache, url, entry)
         return res
 
     # if no fallback is provided, create a default one using the pyld requests loader
@@ -423,12 +1251,247 @@ def localRequestsDocumentLoader(
     return localRequestsDocumentLoaderImpl
 
 
+class _ResolvedContextCache(collections.OrderedDict):
+    """
+    Bounded LRU used as the pyld shared resolved context cache.
+
+    Counts lookups that found an entry (hits) and insertions of new
+    entries (misses).
+    """
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self:
+                return default
+            self.move_to_end(key)
+            self.hits += 1
+            return super().__getitem__(key)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if key not in self:
+                self.misses += 1
+            super().__setitem__(key, value)
+            self.move_to_end(key)
+            while len(self) > self.maxsize:
+                self.popitem(last=False)
+
+
+class ActiveContextRegistry:
+    """
+    Processed schema.org contexts shared across pyld operations.
+
+    pyld only keeps a processed remote context for the duration of a single
+    expand, compact, or frame call, so every call re-processes the thousands
+    of term definitions in the schema.org context. The registry holds a
+    resolved context cache per schema.org context variant ("so", "sos",
+    "sol") and a document loader that marks the local context documents as
+    static, so pyld reuses the processed active context on later calls.
+
+    Caches are separate per variant because each variant maps the same
+    schema.org URLs to a different context document.
+    """
+
+    def __init__(self, context_maps, maxsize=ACTIVE_CONTEXT_CACHE_SIZE):
+        self.context_maps = context_maps
+        self.maxsize = maxsize
+        self._loaders = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def _variant(self, variant):
+        with self._lock:
+            if variant not in self._loaders:
+                self._loaders[variant] = localRequestsDocumentLoader(
+                    context_map=self.context_maps[variant], static_contexts=True
+                )
+                self._caches[variant] = _ResolvedContextCache(self.maxsize)
+            return self._loaders[variant], self._caches[variant]
+
+    def documentLoader(self, variant):
+        """Document loader for the context variant"""
+        return self._variant(variant)[0]
+
+    def options(self, variant, options={}):
+        """
+        pyld options using the shared processed contexts of variant.
+
+        The context resolver is only injected when the document loader is
+        the registry loader, a documentLoader supplied in options is
+        respected as is.
+
+        Args:
+            variant (string): one of "so", "sos", "sol"
+            options (dict): pyld options to merge
+
+        Returns:
+            dict: options for pyld expand, compact, frame, etc.
+        """
+        loader, cache = self._variant(variant)
+        opts = {"documentLoader": loader}
+        opts.update(options)
+        if opts["documentLoader"] is loader:
+            opts["contextResolver"] = pyld.context_resolver.ContextResolver(
+                cache, loader
+            )
+        return opts
+
+    def stats(self):
+        """
+        Hit and miss counts for each variant
+
+        Returns:
+            dict: {variant: {"hits":, "misses":, "size":}}
+        """
+        with self._lock:
+            return {
+                k: {"hits": c.hits, "misses": c.misses, "size": len(c)}
+                for k, c in self._caches.items()
+            }
+
+    def clear(self):
+        """Drop all processed contexts and reset counters"""
+        with self._lock:
+            self._caches = {}
+            self._loaders = {}
+
+
+# Processed schema.org contexts shared by the normalization methods
+ACTIVE_CONTEXTS = ActiveContextRegistry(
+    {"so": SO_CONTEXT, "sos": SOS_CONTEXT, "sol": SOL_CONTEXT}
+)
+
+
+def _addSchemaOrgNamespace(value, namespaces):
+    if value.startswith("https://schema.org"):
+        namespaces.add(SOS_)
+    elif value.startswith("http://schema.org"):
+        namespaces.add(SO_)
+
+
+def _contextNamespaces(ctx, namespaces, schema_org_contexts):
+    # Adds the schema.org namespaces referenced by a raw @context to
+    # namespaces. Returns False if the context references a remote context
+    # that is not a known schema.org context.
+    if isinstance(ctx, list):
+        return all(_contextNamespaces(c, namespaces, schema_org_contexts) for c in ctx)
+    if isinstance(ctx, str):
+        if schema_org_contexts and ctx in SCHEMA_ORG_CONTEXT_URLS:
+            # mapped to the local http://schema.org/ context
+            namespaces.add(SO_)
+            return True
+        return False
+    if not isinstance(ctx, dict):
+        return True
+    for k, v in ctx.items():
+        _addSchemaOrgNamespace(k, namespaces)
+        if k in ("@context", "@import") or isinstance(v, dict):
+            # scoped or imported context, or a term definition
+            if not _contextNamespaces(v, namespaces, schema_org_contexts):
+                return False
+        elif isinstance(v, str):
+            _addSchemaOrgNamespace(v, namespaces)
+        elif isinstance(v, list):
+            for item in v:
+                if isinstance(item, str):
+                    _addSchemaOrgNamespace(item, namespaces)
+    return True
+
+
+def _documentNamespaces(element, namespaces, schema_org_contexts):
+    # Adds the schema.org namespaces referenced by the raw document to
+    # namespaces, any string counts. Returns False if a context could not
+    # be checked.
+    known = True
+    if isinstance(element, list):
+        for item in element:
+            known = _documentNamespaces(item, namespaces, schema_org_contexts) and known
+    elif isinstance(element, dict):
+        for k, v in element.items():
+            if k == "@context":
+                known = _contextNamespaces(v, namespaces, schema_org_contexts) and known
+                continue
+            _addSchemaOrgNamespace(k, namespaces)
+            known = _documentNamespaces(v, namespaces, schema_org_contexts) and known
+    elif isinstance(element, str):
+        _addSchemaOrgNamespace(element, namespaces)
+    return known
+
+
+def expandedSchemaOrgNamespaces(exp_doc):
+    """
+    The schema.org namespaces of the IRIs of an expanded JSON-LD document.
+
+    Every property, @type and @id IRI is checked, literal values are not.
+
+    Args:
+        exp_doc: expanded JSON-LD document
+
+    Returns:
+        set: SO_ and or SOS_
+    """
+    namespaces = set()
+    stack = [exp_doc]
+    while len(stack) > 0:
+        element = stack.pop()
+        if isinstance(element, list):
+            stack.extend(element)
+            continue
+        if not isinstance(element, dict):
+            continue
+        for k, v in element.items():
+            if k in ("@id", "@type"):
+                for iri in v if isinstance(v, list) else [v]:
+                    if isinstance(iri, str):
+                        _addSchemaOrgNamespace(iri, namespaces)
+            elif k == "@value":
+                continue
+            else:
+                _addSchemaOrgNamespace(k, namespaces)
+                stack.append(v)
+    return namespaces
+
+
+def schemaOrgNamespaces(doc, options={}):
+    """
+    The schema.org namespaces used by a JSON-LD document.
+
+    The raw document is scanned first. When its contexts are inline or are
+    the schema.org context, and no https://schema.org/ string appears in
+    the contexts or the document, the document is not expanded. Otherwise
+    the IRIs of the expanded document are checked.
+
+    Args:
+        doc: JSON-LD document
+        options: pyld.jsonld.expand options
+
+    Returns:
+        set, expanded: SO_ and or SOS_, and the expanded document or None
+            if the document was not expanded
+    """
+    namespaces = set()
+    # A documentLoader in options may load anything for the schema.org URLs
+    schema_org_contexts = options.get("documentLoader", None) is None
+    if _documentNamespaces(doc, namespaces, schema_org_contexts) and SOS_ not in namespaces:
+        return namespaces, None
+    opts = ACTIVE_CONTEXTS.options("so", options)
+    expanded = pyld.jsonld.expand(doc, opts)
+    return expandedSchemaOrgNamespaces(expanded), expanded
+
+
 def isHttpsSchemaOrg(exp_doc) -> bool:
     """True if exp_doc is using https://schema.org/ namespace
 
-    Returns the first match of the use of https://schema.org or
-    http://schema.org on a key found by recursing through the
-    object.
+    True when any property, @type or @id IRI of the document is in the
+    https://schema.org/ namespace, also when http://schema.org/ is used as
+    well.
 
     Args:
         exp_doc: expanded JSON-LD document
@@ -436,47 +1499,37 @@ def isHttpsSchemaOrg(exp_doc) -> bool:
     Returns:
         bool: True is document is using `https://schema.org` namespace
     """
-    for i, v in enumerate(exp_doc):
-        if isinstance(v, dict):
-            return isHttpsSchemaOrg(exp_doc[i])
-        if isinstance(v, str):
-            if v.startswith("https://schema.org"):
-                return True
-            elif v.startswith("http://schema.org"):
-                return False
-    return False
+    return SOS_ in expandedSchemaOrgNamespaces(exp_doc)
 
 
-def switchToHttpSchemaOrg(doc, options={}):
+def switchToHttpSchemaOrg(doc, options={}, expanded=None):
     """Convert SO JSONLD namespace from https://schema.org/ to http://schema.org/
 
     The document is expanded and compacted with only schema.org properties
-    compacted. Properties in other namespaces remain expanded.
+    compacted. Properties in other namespaces remain expanded, including
+    http://schema.org/ in a document that also uses https://schema.org/.
+
+    The namespace is detected with schemaOrgNamespaces, so the document is
+    expanded once, also when the raw document does not tell the namespace.
 
     Args:
         doc: schema.org JSON-LD document
+        options: pyld.jsonld.expand options
+        expanded: doc already expanded with options and the local
+            schema.org context, doc is not expanded again if provided
 
     Returns:
         document: JSON-LD document using http://schema.org/ namespace
     """
-    # First expand the document
     # options may include a default base for the document
-    opts = {
-        "documentLoader": localRequestsDocumentLoader(context_map=SO_CONTEXT),
-    }
-    opts.update(options)
-    expanded = pyld.jsonld.expand(doc, opts)
-
-    # Determine which context to apply
-    is_https = isHttpsSchemaOrg(expanded)
-    context_map = SO_CONTEXT
-    if is_https:
-        context_map = SOS_CONTEXT
-    opts = {
-        "documentLoader": localRequestsDocumentLoader(context_map=context_map),
-    }
-
+    if expanded is None:
+        namespaces, expanded = schemaOrgNamespaces(doc, options=options)
+        if expanded is None:
+            expanded = pyld.jsonld.expand(doc, ACTIVE_CONTEXTS.options("so", options))
+    else:
+        namespaces = expandedSchemaOrgNamespaces(expanded)
     # Compact the schema.org elements of the document
+    opts = ACTIVE_CONTEXTS.options("sos" if SOS_ in namespaces else "so")
     context = {"@context": "https://schema.org/"}
     return pyld.jsonld.compact(expanded, context, opts)
 
@@ -484,37 +1537,86 @@ def switchToHttpSchemaOrg(doc, options={}):
 def addSchemaOrgListContainer(doc):
     """Expand document with context including @list container for creator and identifier
 
+    The @list containers only apply to terms of the schema.org context
+    referenced by the document, sosoNormalize handles any document.
+
     Args:
         doc: Schema.org document using http://schema.org/ namespace
 
     Returns:
         document: Expanded JSON-LD
     """
-    options = {
-        "documentLoader": localRequestsDocumentLoader(context_map=SOL_CONTEXT),
-    }
+    options = ACTIVE_CONTEXTS.options("sol")
     expanded = pyld.jsonld.expand(doc, options)
     return expanded
 
 
-def sosoNormalize(doc, options={}):
+def _sosoIRI(iri, ns):
+    # IRI in the ns schema.org namespace moved to http://schema.org/
+    if ns != SO_ and isinstance(iri, str) and iri.startswith(ns) and len(iri) > len(ns):
+        return SO_ + iri[len(ns):]
+    return iri
+
+
+def _sosoExpanded(element, ns, list_properties):
+    # element of an expanded document as it is after compacting with the
+    # ns schema.org context and expanding with the SOSO list context
+    if isinstance(element, list):
+        return [_sosoExpanded(item, ns, list_properties) for item in element]
+    if not isinstance(element, dict):
+        return element
+    result = {}
+    for k, v in element.items():
+        if k == "@id":
+            result[k] = _sosoIRI(v, ns)
+        elif k == "@type":
+            if isinstance(v, list):
+                result[k] = [_sosoIRI(t, ns) for t in v]
+            else:
+                result[k] = _sosoIRI(v, ns)
+        elif k == "@reverse":
+            result[k] = {
+                _sosoIRI(p, ns): _sosoExpanded(pv, ns, list_properties)
+                for p, pv in v.items()
+            }
+        elif k in ("@list", "@set", "@graph", "@included"):
+            result[k] = _sosoExpanded(v, ns, list_properties)
+        elif k.startswith("@"):
+            result[k] = v
+        else:
+            values = _sosoExpanded(v, ns, list_properties)
+            if k in list_properties and not (len(values) == 1 and "@list" in values[0]):
+                values = [{"@list": values}]
+            result.setdefault(_sosoIRI(k, ns), []).extend(values)
+    return result
+
+
+def sosoNormalize(doc, options={}, expanded=None):
     """
     Return JSONLD document expanded and using SOSO recommendations.
 
-    The JSON-LD is set to use a remote reference to the schema.org context
-    and expanded using a modified version of the schema.org context to
-    set the @container for certain elements to be @list.
+    The result is the same as expanding with the SOSO list context the
+    document from switchToHttpSchemaOrg, which sets the @container of
+    certain elements to @list, in a single expansion. The https://schema.org/
+    IRIs of the expanded document are rewritten to http://schema.org/ and
+    the values of the list properties are put in a @list, without
+    compacting and expanding again.
 
     Args:
         doc: JSONLD
         options: pyld.jsonld.expand options
+        expanded: doc already expanded with options and the local
+            schema.org context, doc is not expanded again if provided
 
     Returns:
         expanded JSONLD with http://schema.org/ and @list for certain elements
     """
-    newdoc = switchToHttpSchemaOrg(doc, options=options)
-    sosodoc = addSchemaOrgListContainer(newdoc)
-    return sosodoc
+    if expanded is None:
+        opts = ACTIVE_CONTEXTS.options("so", options)
+        expanded = pyld.jsonld.expand(doc, opts)
+    ns = SOS_ if isHttpsSchemaOrg(expanded) else SO_
+    list_properties = {f"{ns}{term}" for term in SOSO_LIST_PROPERTIES}
+    return _sosoExpanded(expanded, ns, list_properties)
 
 
 def sosoDatasetFrame(expanded, options={}):
@@ -527,10 +1629,6 @@ def sosoDatasetFrame(expanded, options={}):
     Returns:
 
     """
-    frame_doc = copy.deepcopy(SO_DATASET_FRAME)
-    opts = {
-        "documentLoader": localRequestsDocumentLoader(context_map=SOL_CONTEXT),
-    }
-    opts.update(options)
-    fdoc = pyld.jsonld.frame(expanded, frame_doc, options=opts)
+    opts = ACTIVE_CONTEXTS.options("sol", options)
+    fdoc = pyld.jsonld.frame(expanded, copyContext(SO_DATASET_FRAME), options=opts)
     return fdoc
@@ -6,21 +6,25 @@ import sys
 import os
 import logging
 import logging.config
-import copy
 import json
 import click
 import shortuuid
 import requests
 import pyld.jsonld
-import c14n
 import html
 import sonormal
 import sonormal.utils
+import sonormal.artifacts
+import sonormal.document
+import sonormal.extract
 import sonormal.getjsonld
 import sonormal.normalize
 import sonormal.checksums
+import sonormal.scheduler
+import sonormal.stream
 import urllib.parse
 import webbrowser
+import time
 
 logging_config = {
     "version": 1,
@@ -139,7 +143,7 @@ def _getDocument(
                 "base": doc["documentUrl"],
                 "extractAllScripts": True,
             }
-            return pyld.jsonld.load_html(_src, doc["documentUrl"], profile, options)
+            return sonormal.extract.loadHtml(_src, doc["documentUrl"], profile, options)
         except Exception as e:
             L.error("Unable to load JSON-LD")
             L.error(e)
@@ -258,24 +262,22 @@ def getJsonld(ctx, expand, sohttp, soso, canonicalize, source=None):
     if not ctx.obj["base"] is None:
         L.info("Overriding base of %s with %s", doc["documentUrl"], ctx.obj["base"])
         options["base"] = ctx.obj["base"]
+    jdoc = sonormal.document.Document(doc["document"], options=options)
     if soso:
-        so_doc = sonormal.sosoNormalize(doc["document"], options=options)
-        doc["document"] = so_doc
+        jdoc = sonormal.document.Document(jdoc.soso, options=options)
     # Don't output whitespace at the end of the document when being
     # piped since it will alter checksums.
     _pend = ""
     if sys.stdout.isatty():
         _pend = "\n"
     elif sohttp:
-        so_doc = sonormal.switchToHttpSchemaOrg(doc["document"], options=options)
-        doc["document"] = so_doc
+        jdoc = sonormal.document.Document(jdoc.http, options=options)
     if expand:
-        doc["document"] = pyld.jsonld.expand(doc["document"], options=options)
+        jdoc = sonormal.document.Document(jdoc.expanded, options=options)
     if canonicalize:
-        c_doc = c14n.canonicalize(doc["document"])
-        print(c_doc.decode("utf-8"), end=_pend)
+        print(jdoc.canonical_bytes.decode("utf-8"), end=_pend)
     else:
-        print(json.dumps(doc["document"], indent=2, sort_keys=True), end=_pend)
+        print(json.dumps(jdoc.document, indent=2, sort_keys=True), end=_pend)
 
 
 @main.command("nquads", short_help="Transform JSON-LD to N-Quads")
@@ -331,8 +333,8 @@ def canonicalizeJsonld(ctx, source=None):
     if not ctx.obj["base"] is None:
         L.info("Overriding base of %s with %s", doc["documentUrl"], ctx.obj["base"])
         options["base"] = ctx.obj["base"]
-    ndoc = sonormal.normalize.normalizeJsonld(doc["document"], options=options)
-    cdoc = sonormal.normalize.canonicalizeJson(ndoc)
+    jdoc = sonormal.document.Document(doc["document"], options=options)
+    cdoc = sonormal.normalize.canonicalizeJson(jdoc.normalized)
     _pend = ""
     if sys.stdout.isatty():
         _pend = "\n"
@@ -370,7 +372,7 @@ def frameJsonld(ctx, source=None, frame=None):
         if frame_doc is None:
             L.warning("Could not load frame document %s", frame)
     if frame_doc is None:
-        frame_doc = oc = copy.deepcopy(sonormal.SO_DATASET_FRAME)
+        frame_doc = sonormal.copyContext(sonormal.SO_DATASET_FRAME)
         L.warning("Defaulting to SO Dataset frame")
     cdoc = pyld.jsonld.frame(doc["document"], frame=frame_doc, options=options)
     print(json.dumps(cdoc, indent=2, sort_keys=True))
@@ -411,11 +413,10 @@ def datasetIdentifiers(ctx, source=None, checksums=False):
     if not ctx.obj["base"] is None:
         L.info("Overriding base of %s with %s", doc["documentUrl"], ctx.obj["base"])
         options["base"] = ctx.obj["base"]
-    ndoc = sonormal.normalize.normalizeJsonld(doc["document"], options=options)
-    cdoc = sonormal.normalize.frameSODataset(ndoc)
-    ids = sonormal.normalize.getDatasetsIdentifiers(cdoc)
+    jdoc = sonormal.document.Document(doc["document"], options=options)
+    ids = jdoc.identifiers
     if checksums:
-        ids[0]["checksums"], _ = sonormal.checksums.jsonChecksums(ndoc)
+        ids[0]["checksums"], _ = sonormal.checksums.jsonChecksums(jdoc.normalized)
     print(json.dumps(ids, indent=2, sort_keys=True))
 
 
@@ -490,14 +491,24 @@ def jsonldPlayground(ctx, open_browser, source=None):
 
 @main.command("info")
 @click.argument("source", required=False)
+@click.option(
+    "-a",
+    "--algorithm",
+    "algorithms",
+    multiple=True,
+    type=click.Choice(sonormal.checksums.HASH_ALGORITHMS),
+    default=sonormal.checksums.CHECKSUM_ALGORITHMS,
+    help="Checksum algorithm, repeat for several",
+)
 @click.pass_context
-def jsonldInfo(ctx, source=None):
+def jsonldInfo(ctx, source=None, algorithms=sonormal.checksums.CHECKSUM_ALGORITHMS):
     """
     Compute information about the JSON-LD
 
     Args:
         ctx:
         source:
+        algorithms: checksums to compute for the canonical form
 
     Returns:
         dict
@@ -513,25 +524,290 @@ def jsonldInfo(ctx, source=None):
     if doc["document"] is None:
         L.error("No document loaded from %s", input)
         return
-    # Checksum on original form
-    original_checksums, doc_bytes = sonormal.checksums.jsonChecksums(
-        doc["document"], canonicalize=False
-    )
-    # Checksums on canonical form
-    checksums, doc_bytes = sonormal.checksums.jsonChecksums(
-        doc["document"], canonicalize=True
-    )
-    _framed = sonormal.normalize.frameSODataset(doc["document"])
-    identifiers = sonormal.normalize.getDatasetsIdentifiers(_framed)
+    jdoc = sonormal.document.Document(doc["document"])
     info = {
-        "size": len(doc_bytes),
-        "source_md5": original_checksums["md5"],
-        "checksums": checksums,
-        "identifiers": identifiers,
+        "size": len(jdoc.canonical_bytes),
+        "source_md5": jdoc.hashes(("md5",), source=True)["md5"],
+        "checksums": jdoc.hashes(algorithms),
+        "identifiers": jdoc.source_identifiers,
     }
     print(json.dumps(info, indent=2, sort_keys=True))
 
 
+GRAPH_OUTPUTS = ["json", "expanded", "canon", "nquads", "identifiers"]
+
+
+def _graphNodeResults(docs, output_format, options, workers=1):
+    """
+    Output for the JSON-LD document of each @graph node, in order.
+
+    Normalization for the canon and nquads formats is spread over workers
+    processes.
+
+    Returns:
+        iterator of str: one JSON line, or the N-Quads of the node. None
+            when there is no output for the node, an Exception if it failed.
+    """
+    if output_format in ("json", "expanded", "identifiers"):
+        opts = sonormal.ACTIVE_CONTEXTS.options("so", options)
+        for doc in docs:
+            try:
+                if output_format == "identifiers":
+                    ids = sonormal.normalize.extractDatasetsIdentifiers(doc, options=options)
+                    yield json.dumps(ids, sort_keys=True) if len(ids) > 0 else None
+                    continue
+                if output_format == "expanded":
+                    doc = pyld.jsonld.expand(doc, options=opts)
+                yield json.dumps(doc, sort_keys=True)
+            except Exception as e:
+                yield e
+        return
+    for res in sonormal.normalize.normalizeMany(
+        docs, options=options, output=output_format, workers=workers
+    ):
+        yield res
+
+
+@main.command("graph", short_help="Process each node of a large @graph")
+@click.option(
+    "-f",
+    "--format",
+    "output_format",
+    type=click.Choice(GRAPH_OUTPUTS),
+    default="json",
+    help="Output for each node",
+)
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    help="Processes for normalizing nodes, 0 for the number of CPUs",
+)
+@click.argument("source", required=False)
+@click.pass_context
+def graphJsonld(ctx, output_format, workers, source=None):
+    """Process each top level node of the @graph in SOURCE on its own.
+
+    A file or stdin is parsed incrementally, so memory use is bounded by
+    the largest node rather than the whole document. Each node is output
+    with the @context of the document as soon as it is read: one JSON
+    line per node, or N-Quads for the nquads format. Dataset identifiers
+    are only output for nodes that are a Dataset.
+
+    Nodes are processed independently, references to other top level
+    nodes by @id are not followed. The canon and nquads formats can
+    normalize nodes in parallel with --workers, output is in the same
+    order and identical to a single process.
+    """
+    L = getLogger()
+    documentUrl = sonormal.DEFAULT_BASE
+    if not sys.stdin.isatty():
+        docs = sonormal.stream.GraphReader(sys.stdin).documents()
+    elif source is not None and source[:4].lower() == "http":
+        doc = _getDocument(
+            source,
+            render=ctx.obj.get("render", True),
+            profile=ctx.obj.get("profile", None),
+            requestProfile=ctx.obj.get("request_profile", None),
+            documentLoader=ctx.obj.get("documentLoader", None),
+            timeout=ctx.obj.get("timeout", DEFAULT_TIMEOUT),
+        )
+        if doc["document"] is None:
+            L.error("No document loaded from %s", source)
+            return
+        documentUrl = doc["documentUrl"]
+        docs = sonormal.stream.splitGraph(doc["document"])
+    elif source is not None and os.path.exists(os.path.expanduser(source)):
+        src = open(os.path.expanduser(source), "r")
+        ctx.call_on_close(src.close)
+        docs = sonormal.stream.GraphReader(src).documents()
+    else:
+        L.error("Unable to open source: %s", source)
+        return
+    options = {"base": documentUrl}
+    if not ctx.obj["base"] is None:
+        L.info("Overriding base of %s with %s", documentUrl, ctx.obj["base"])
+        options["base"] = ctx.obj["base"]
+    n = 0
+    n_errors = 0
+    for res in _graphNodeResults(docs, output_format, options, workers=workers or None):
+        n += 1
+        if isinstance(res, Exception):
+            L.error("Processing node %s failed: %s", n, res)
+            n_errors += 1
+            continue
+        if res is None:
+            continue
+        sys.stdout.write(res)
+        if output_format != "nquads":
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+    L.info("Processed %s nodes, %s errors", n, n_errors)
+
+
+def _harvestRecord(
+    url,
+    render=False,
+    profile=None,
+    requestProfile=None,
+    documentLoader=None,
+    timeout=DEFAULT_TIMEOUT,
+    base=None,
+    show_response=False,
+    scheduler=None,
+):
+    """
+    Retrieve and process the JSON-LD from url for the harvest command.
+
+    Returns:
+        dict: url, documentUrl, document, identifiers, checksums, timings, error
+    """
+    L = getLogger()
+    rec = {
+        "url": url,
+        "documentUrl": None,
+        "document": None,
+        "identifiers": None,
+        "checksums": None,
+        "timings": {},
+        "error": None,
+    }
+    t0 = time.time()
+    try:
+        doc = sonormal.getjsonld.downloadJson(
+            url,
+            headers={},
+            try_jsrender=render,
+            profile=profile,
+            requestProfile=requestProfile,
+            documentLoader=documentLoader,
+            loader_timeout=timeout,
+            scheduler=scheduler,
+        )
+        t1 = time.time()
+        rec["timings"]["download"] = t1 - t0
+        if "ERROR" in doc:
+            rec["error"] = doc["ERROR"]
+            return rec
+        rec["documentUrl"] = doc.get("documentUrl", None)
+        rec["document"] = doc.get("document", None)
+        if show_response and doc.get("response", None) is not None:
+            rec["response"] = sonormal.getjsonld.responseSummary(doc["response"])
+        if rec["document"] is None:
+            rec["error"] = "No document loaded"
+            return rec
+        options = {"base": rec["documentUrl"]}
+        if base is not None:
+            options["base"] = base
+        jdoc = sonormal.document.Document(rec["document"], options=options)
+        rec["checksums"] = jdoc.checksums
+        rec["size"] = len(jdoc.canonical_bytes)
+        t2 = time.time()
+        rec["timings"]["checksums"] = t2 - t1
+        rec["identifiers"] = jdoc.identifiers
+        rec["timings"]["identifiers"] = time.time() - t2
+    except Exception as e:
+        L.error("Harvest of %s failed", url)
+        L.debug(e)
+        rec["error"] = str(e)
+    finally:
+        rec["timings"]["total"] = time.time() - t0
+    return rec
+
+
+@main.command("harvest", short_help="Retrieve JSON-LD from a list of URLs")
+@click.option(
+    "-i",
+    "--input",
+    "url_list",
+    type=click.File("r"),
+    default="-",
+    help="File with one URL per line (default stdin)",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="JSONL output file (default stdout)",
+)
+@click.option("-w", "--workers", default=4, help="Number of concurrent workers")
+@click.option(
+    "--host-concurrency",
+    default=sonormal.scheduler.HOST_MAX_CONCURRENCY,
+    help="Max concurrent requests per host",
+)
+@click.option(
+    "--host-rps",
+    default=sonormal.scheduler.HOST_REQUESTS_PER_SECOND,
+    help="Max requests per second per host",
+)
+@click.option("--ignore-robots", is_flag=True, help="Ignore robots.txt Crawl-delay")
+@click.pass_context
+def harvestJsonld(ctx, url_list, output, workers, host_concurrency, host_rps, ignore_robots):
+    """Retrieve and process JSON-LD from many URLs concurrently.
+
+    URLs are read one per line, blank lines and lines starting with "#"
+    are ignored. One JSON record per URL is written as it completes, with
+    the document, Dataset identifiers, checksums of the canonical form,
+    timings in seconds, and any error.
+
+    Requests are limited per host by concurrency, requests per second,
+    robots.txt Crawl-delay, and Retry-After responses. Work is interleaved
+    across hosts.
+    """
+    L = getLogger()
+    urls = []
+    for line in url_list:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            urls.append(line)
+    L.info("Harvesting %s URLs with %s workers", len(urls), workers)
+    scheduler = sonormal.scheduler.HostScheduler(
+        max_concurrency=host_concurrency,
+        requests_per_second=host_rps,
+        use_robots=not ignore_robots,
+    )
+    documentLoader = sonormal.localRequestsDocumentLoader(
+        context_map=sonormal.SO_CONTEXT,
+        document_cache=sonormal.DOCUMENT_CACHE,
+        fallback_loader=sonormal.scheduler.politeDocumentLoader(
+            sonormal.requests_document_loader_history(), scheduler
+        ),
+    )
+
+    def _harvest(url):
+        return _harvestRecord(
+            url,
+            render=ctx.obj.get("render", False),
+            profile=ctx.obj.get("profile", None),
+            requestProfile=ctx.obj.get("request_profile", None),
+            documentLoader=documentLoader,
+            timeout=ctx.obj.get("timeout", DEFAULT_TIMEOUT),
+            base=ctx.obj.get("base", None),
+            show_response=ctx.obj.get("show_response", False),
+            scheduler=scheduler,
+        )
+
+    t0 = time.time()
+    n_errors = 0
+    for rec in scheduler.map(_harvest, urls, workers=workers):
+        if rec["error"] is not None:
+            n_errors += 1
+        output.write(json.dumps(rec, sort_keys=True))
+        output.write("\n")
+        output.flush()
+    L.info(
+        "Harvested %s URLs, %s errors, in %.2f seconds",
+        len(urls),
+        n_errors,
+        time.time() - t0,
+    )
+    L.info("Document cache: %s", dict(sonormal.DOCUMENT_CACHE_STATS))
+    L.info("Artifact cache: %s", dict(sonormal.artifacts.ARTIFACT_CACHE.stats))
+    L.info("Hosts: %s", json.dumps(scheduler.stats(), indent=2))
+
+
 @main.command("publish")
 @click.option("--dryrun", is_flag=True, help="Dry run, just show sysmeta and object")
 @click.option("--jwt", envvar="SO_JWT", default=None, help="JWT for authenticating (SO_JWT)")
@@ -593,19 +869,16 @@ def jsonldPublish(ctx, dryrun, jwt, mnode, nodeid, submitter, rholder, ignore_se
     if doc["document"] is None:
         L.error("No document loaded from %s", input)
         return
+    jdoc = sonormal.document.Document(doc["document"])
     # System metadata checksum on original form
-    original_checksums, doc_bytes = sonormal.checksums.jsonChecksums(
-        doc["document"], canonicalize=False
-    )
+    original_checksums = jdoc.hashes(("md5",), source=True)
     # Checksums on canonical form
-    checksums, doc_bytes = sonormal.checksums.jsonChecksums(
-        doc["document"], canonicalize=True
-    )
+    checksums = jdoc.hashes(("sha256",))
+    doc_bytes = jdoc.canonical_bytes
 
-    # get identifiers from a document framed as SO Dataset
-    iddoc = sonormal.switchToHttpSchemaOrg(doc["document"])
-    _framed = sonormal.normalize.frameSODataset(iddoc)
-    identifiers = sonormal.normalize.getDatasetsIdentifiers(_framed)
+    # get identifiers from a document framed as SO Dataset, framing the
+    # http namespace form directly keeps the order of identifiers
+    identifiers = jdoc.http_identifiers
     seriesId = ""
     if len(identifiers) > 0:
         ids = identifiers[0]
@@ -0,0 +1,277 @@
+"""
+Persistent cache of forms derived from JSON-LD documents.
+
+Expansion, URDNA2015 normalization and framing are expensive and are
+repeated for the same document by every so canon, identifiers and info
+run, and whenever a harvest revisits an unchanged page. ArtifactCache
+keeps the results on disk, keyed by the sha256 of the canonical JSON of
+the input together with the operation, its options and the version of
+the local schema.org contexts, so an unchanged document costs a hash and
+a lookup.
+
+Results depend on the document loader used to retrieve contexts. Results
+computed with a documentLoader or contextResolver in the options are only
+cached when the caller identifies the loader with loader_id, which is then
+part of the key. Other remote contexts referenced by a document can change
+without the document changing, so results for such documents expire after
+ARTIFACT_REMOTE_CONTEXT_TIMEOUT.
+"""
+import os
+import json
+import atexit
+import hashlib
+import logging
+import threading
+import collections
+import diskcache
+import pyld.jsonld
+import c14n
+import sonormal
+import sonormal.normalize
+from sonormal.config import settings
+
+# Path to the artifact cache
+ARTIFACT_CACHE_PATH = settings.get(
+    "ARTIFACT_CACHE_PATH", os.path.expanduser("~/.local/share/sonormal/artifacts")
+)
+
+# Size limit of the artifact cache, least recently used entries are evicted
+ARTIFACT_CACHE_SIZE = settings.get("ARTIFACT_CACHE_SIZE", 1024 * 1024 * 1024)  # bytes
+
+# Included in every key, change when the form of cached results changes
+ARTIFACT_CACHE_VERSION = 1
+
+# Results for documents with remote contexts other than schema.org expire
+# after this long, as the contexts may change
+ARTIFACT_REMOTE_CONTEXT_TIMEOUT = settings.get(
+    "ARTIFACT_REMOTE_CONTEXT_TIMEOUT", 24 * 3600
+)  # seconds
+
+# Options that affect the result but can not be serialized for the key, the
+# caller identifies them with loader_id
+_LOADER_OPTIONS = ("documentLoader", "contextResolver")
+
+
+def remoteContexts(jdoc):
+    """
+    URLs of the remote contexts of jdoc, other than the schema.org context.
+
+    Returns:
+        set of str
+    """
+    res = set()
+    stack = [jdoc]
+    while len(stack) > 0:
+        obj = stack.pop()
+        if isinstance(obj, list):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            for k, v in obj.items():
+                if k == "@context":
+                    for c in v if isinstance(v, list) else [v]:
+                        if isinstance(c, str) and c not in sonormal.SCHEMA_ORG_CONTEXT_URLS:
+                            res.add(c)
+                elif isinstance(v, (dict, list)):
+                    stack.append(v)
+    return res
+
+
+def contextVersion():
+    """
+    Version of the local schema.org context documents.
+
+    Changes when the context files are prepared again or moved.
+
+    Returns:
+        str: hex digest of the paths, sizes and modification times
+    """
+    h = hashlib.sha256()
+    paths = set()
+    for context_map in (sonormal.SO_CONTEXT, sonormal.SOS_CONTEXT, sonormal.SOL_CONTEXT):
+        paths.update(context_map.values())
+    for path in sorted(paths):
+        try:
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+        except OSError:
+            h.update(f"{path}:missing\n".encode())
+    return h.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Content addressed cache of results derived from JSON-LD documents.
+
+    Results are stored in a diskcache.Cache limited to size_limit bytes,
+    evicting the least recently used. Outcomes are counted in stats:
+        hits: result returned from the cache
+        misses: result computed and stored
+        uncacheable: result computed without caching, the input could not
+            be canonicalized or the options have an unidentified loader
+    """
+
+    def __init__(self, path=ARTIFACT_CACHE_PATH, size_limit=ARTIFACT_CACHE_SIZE):
+        self.path = path
+        self.size_limit = size_limit
+        self.stats = collections.Counter(hits=0, misses=0)
+        self._cache = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        """The diskcache.Cache, opened on first use"""
+        with self._lock:
+            if self._cache is None:
+                os.makedirs(self.path, exist_ok=True)
+                self._cache = diskcache.Cache(
+                    self.path,
+                    size_limit=self.size_limit,
+                    eviction_policy="least-recently-used",
+                )
+            return self._cache
+
+    def key(self, kind, jdoc, options={}, digest=None, loader_id=None):
+        """
+        Key for the result of operation kind on jdoc with options.
+
+        Args:
+            digest (str): sha256 hex digest of the canonical JSON of jdoc,
+                computed if not provided
+            loader_id (str): identifies the documentLoader and
+                contextResolver in options
+
+        Raises:
+            ValueError if jdoc can not be canonicalized, or options have a
+            documentLoader or contextResolver and no loader_id
+        """
+        loaders = [k for k in _LOADER_OPTIONS if k in options]
+        if len(loaders) > 0 and loader_id is None:
+            raise ValueError(f"No loader_id for {', '.join(loaders)}")
+        if digest is None:
+            try:
+                digest = hashlib.sha256(c14n.canonicalize(jdoc)).hexdigest()
+            except Exception as e:
+                raise ValueError(f"Unable to canonicalize input: {e}")
+        h = hashlib.sha256(digest.encode())
+        opts = {k: v for k, v in options.items() if k not in _LOADER_OPTIONS}
+        h.update(b"\n")
+        h.update(json.dumps(opts, sort_keys=True, default=repr).encode())
+        if len(loaders) > 0:
+            h.update(f"\nloader:{loader_id}".encode())
+        h.update(f"\n{contextVersion()}\n{ARTIFACT_CACHE_VERSION}".encode())
+        return f"{kind}:{h.hexdigest()}"
+
+    def get(self, kind, jdoc, options, compute, digest=None, loader_id=None):
+        """
+        The result of compute(jdoc, options), from the cache if available.
+
+        Args:
+            kind (str): name of the operation, part of the key
+            jdoc: JSON-LD document
+            options (dict): options for compute, part of the key
+            compute: callable producing the result
+            digest (str): sha256 hex digest of the canonical JSON of jdoc
+            loader_id (str): identifies the documentLoader and
+                contextResolver in options, results computed with them are
+                not cached without it
+
+        Returns:
+            the result
+        """
+        try:
+            key = self.key(kind, jdoc, options, digest=digest, loader_id=loader_id)
+        except ValueError as e:
+            L = logging.getLogger("sonormal.artifacts")
+            L.debug("Not caching %s: %s", kind, e)
+            self.stats["uncacheable"] += 1
+            return compute(jdoc, options)
+        try:
+            result = self.cache.get(key, default=None)
+        except Exception as e:
+            L = logging.getLogger("sonormal.artifacts")
+            L.warning("Unable to read artifact cache: %s", e)
+            result = None
+        if result is not None:
+            self.stats["hits"] += 1
+            return result
+        self.stats["misses"] += 1
+        result = compute(jdoc, options)
+        expire = None
+        if len(remoteContexts(jdoc)) > 0:
+            expire = ARTIFACT_REMOTE_CONTEXT_TIMEOUT
+        try:
+            self.cache.set(key, result, expire=expire)
+        except Exception as e:
+            L = logging.getLogger("sonormal.artifacts")
+            L.warning("Unable to save to artifact cache: %s", e)
+        return result
+
+    def clear(self):
+        """Remove all entries"""
+        self.cache.clear()
+
+    def close(self):
+        """Close the cache, it is opened again on next use"""
+        with self._lock:
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+
+
+# Artifact cache shared by the process
+ARTIFACT_CACHE = ArtifactCache()
+atexit.register(ARTIFACT_CACHE.close)
+
+
+def expanded(jdoc, options={}, cache=None, digest=None, loader_id=None):
+    """pyld.jsonld.expand(jdoc) with the local schema.org context, cached"""
+    cache = ARTIFACT_CACHE if cache is None else cache
+    return cache.get(
+        "expanded",
+        jdoc,
+        options,
+        lambda d, o: pyld.jsonld.expand(
+            d, options=sonormal.ACTIVE_CONTEXTS.options("so", o)
+        ),
+        digest=digest,
+        loader_id=loader_id,
+    )
+
+
+def normalized(jdoc, options={}, cache=None, digest=None, loader_id=None):
+    """sonormal.normalize.normalizeJsonld(jdoc), cached"""
+    cache = ARTIFACT_CACHE if cache is None else cache
+    return cache.get(
+        "normalized",
+        jdoc,
+        options,
+        lambda d, o: sonormal.normalize.normalizeJsonld(d, options=o),
+        digest=digest,
+        loader_id=loader_id,
+    )
+
+
+def nquads(jdoc, options={}, cache=None, digest=None, loader_id=None):
+    """sonormal.normalize.jsonldToNquads(jdoc), cached"""
+    cache = ARTIFACT_CACHE if cache is None else cache
+    return cache.get(
+        "nquads",
+        jdoc,
+        options,
+        lambda d, o: sonormal.normalize.jsonldToNquads(d, options=o),
+        digest=digest,
+        loader_id=loader_id,
+    )
+
+
+def framed(jdoc, options={}, cache=None, digest=None, loader_id=None):
+    """sonormal.normalize.frameSODataset(jdoc) with the default frame, cached"""
+    cache = ARTIFACT_CACHE if cache is None else cache
+    return cache.get(
+        "framed",
+        jdoc,
+        options,
+        lambda d, o: sonormal.normalize.frameSODataset(d, options=o),
+        digest=digest,
+        loader_id=loader_id,
+    )
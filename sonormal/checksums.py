@@ -1,38 +1,101 @@
 import logging
 import hashlib
 import json
+import concurrent.futures
 # c14n is provided with pyld
 import c14n
+from sonormal.config import settings
 
 HASH_BLOCK_SIZE = 65536
 
+# Hash algorithms that can be computed, names as in hashlib
+HASH_ALGORITHMS = ("sha256", "sha1", "md5", "sha512", "blake2b")
 
-def computeChecksumsBytes(b, sha256=True, sha1=True, md5=True):
+# Algorithms computed by default
+CHECKSUM_ALGORITHMS = ("sha256", "sha1", "md5")
+
+# Buffers of at least this size are hashed with a thread per algorithm,
+# hashlib releases the GIL while hashing
+HASH_THREAD_MIN_SIZE = settings.get("HASH_THREAD_MIN_SIZE", 4 * 1024 * 1024)  # bytes
+
+
+def _hashers(algorithms):
+    for algorithm in algorithms:
+        if algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+    return {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+
+def computeHashes(b, algorithms=CHECKSUM_ALGORITHMS):
+    """
+    Hex digests of bytes for each of algorithms.
+
+    The hashers are fed from a single pass over blocks of a memoryview of
+    b. Buffers of HASH_THREAD_MIN_SIZE or more are instead hashed with a
+    thread per algorithm.
+
+    Args:
+        b: bytes or other buffer
+        algorithms: names from HASH_ALGORITHMS
+
+    Returns:
+        dict: algorithm to hex digest
+
+    Raises:
+        ValueError for an unsupported algorithm
+    """
+    hashers = _hashers(algorithms)
+    view = memoryview(b).cast("B")
+    if len(hashers) > 1 and len(view) >= HASH_THREAD_MIN_SIZE:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(hashers)) as pool:
+            for _ in pool.map(lambda h: h.update(view), hashers.values()):
+                pass
+    else:
+        for start in range(0, len(view), HASH_BLOCK_SIZE):
+            block = view[start : start + HASH_BLOCK_SIZE]
+            for h in hashers.values():
+                h.update(block)
+    return {algorithm: h.hexdigest() for algorithm, h in hashers.items()}
+
+
+def computeChecksumsBytes(b, sha256=True, sha1=True, md5=True, algorithms=None):
     """
     Computes hashes for the provided Bytes
 
     Args:
         b: bytes
+        algorithms: names from HASH_ALGORITHMS, replaces sha256, sha1, md5
 
     Returns:
         dict: Dict of calculated hash hex digests
     """
-    hashes = {"sha256": None, "sha1": None, "md5": None}
-    if sha256:
-        hashes["sha256"] = hashlib.sha256(b).hexdigest()
-    if sha1:
-        hashes["sha1"] = hashlib.sha1(b).hexdigest()
-    if md5:
-        hashes["md5"] = hashlib.md5(b).hexdigest()
+    if algorithms is None:
+        hashes = {"sha256": None, "sha1": None, "md5": None}
+        algorithms = [k for k, v in (("sha256", sha256), ("sha1", sha1), ("md5", md5)) if v]
+    else:
+        hashes = {}
+    hashes.update(computeHashes(b, algorithms))
     return hashes, b
 
 
-def computeChecksumsString(s, sha256=True, sha1=True, md5=True, encoding="UTF-8"):
+def computeChecksumsString(s, sha256=True, sha1=True, md5=True, encoding="UTF-8", algorithms=None):
     b = s.encode(encoding)
-    return computeChecksumsBytes(b, sha256=sha256, sha1=sha1, md5=md5)
+    return computeChecksumsBytes(b, sha256=sha256, sha1=sha1, md5=md5, algorithms=algorithms)
 
 
-def jsonChecksums(doc, canonicalize=True):
+def jsonBytes(doc, canonicalize=True):
+    """
+    The serialized JSON that jsonChecksums computes hashes of.
+
+    Returns:
+        bytes
+    """
+    if canonicalize:
+        return c14n.canonicalize(doc)
+    return json.dumps(doc, indent=2, sort_keys=True).encode("utf-8")
+
+
+def jsonChecksums(doc, canonicalize=True, algorithms=None):
     """
     Compute checksums for a JSON object.
 
@@ -45,57 +108,43 @@ def jsonChecksums(doc, canonicalize=True):
     Args:
         doc: The JSON structure
         canonicalize(bool): Apply c14n canonicalization to the JSON
+        algorithms: names from HASH_ALGORITHMS, default sha256, sha1 and md5
 
     Returns:
         dict of hashes, bytes
 
     """
-    if canonicalize:
-        b = c14n.canonicalize(doc)
-    else:
-        b = json.dumps(doc, indent=2, sort_keys=True).encode("utf-8")
-    return computeChecksumsBytes(b)
+    return computeChecksumsBytes(jsonBytes(doc, canonicalize=canonicalize), algorithms=algorithms)
 
 
-def computeChecksumsFLO(flo, sha256=True, sha1=True, md5=True):
+def computeChecksumsFLO(flo, sha256=True, sha1=True, md5=True, algorithms=None):
     """
     Computes hashes for object in file stream.
 
     Args:
         flo: file like object open for reading
+        algorithms: names from HASH_ALGORITHMS, replaces sha256, sha1, md5
 
     Returns:
         dict of md5, sha1, sha256 hashes.
 
     """
-    hashes = {"sha256": None, "sha1": None, "md5": None}
-    hsha256 = None
-    hsha1 = None
-    hmd5 = None
-    if sha256:
-        hsha256 = hashlib.sha256()
-    if sha1:
-        hsha1 = hashlib.sha1()
-    if md5:
-        hmd5 = hashlib.md5()
+    if algorithms is None:
+        hashes = {"sha256": None, "sha1": None, "md5": None}
+        algorithms = [k for k, v in (("sha256", sha256), ("sha1", sha1), ("md5", md5)) if v]
+    else:
+        hashes = {}
+    hashers = _hashers(algorithms)
     fbuf = flo.read(HASH_BLOCK_SIZE)
     while len(fbuf) > 0:
-        if sha256:
-            hsha256.update(fbuf)
-        if sha1:
-            hsha1.update(fbuf)
-        if md5:
-            hmd5.update(fbuf)
+        for h in hashers.values():
+            h.update(fbuf)
         fbuf = flo.read(HASH_BLOCK_SIZE)
-    if sha256:
-        hashes["sha256"] = hsha256.hexdigest()
-    if sha1:
-        hashes["sha1"] = hsha1.hexdigest()
-    if md5:
-        hashes["md5"] = hmd5.hexdigest()
+    for algorithm, h in hashers.items():
+        hashes[algorithm] = h.hexdigest()
     return hashes
 
 
-def computeChecksumsFile(fname, sha256=True, sha1=True, md5=True):
+def computeChecksumsFile(fname, sha256=True, sha1=True, md5=True, algorithms=None):
     with open(fname, "rb") as flo:
-        return computeChecksumsFLO(flo, sha256=sha256, sha1=sha1, md5=md5)
+        return computeChecksumsFLO(flo, sha256=sha256, sha1=sha1, md5=md5, algorithms=algorithms)
@@ -0,0 +1,178 @@
+"""
+A JSON-LD document with its derived forms computed on demand.
+
+Commands that output several things about a document, such as checksums
+and Dataset identifiers, need the same intermediate forms: the canonical
+JSON, the normalized form, the framed form. Document computes each form
+the first time it is used and keeps it, so no form is derived twice. The
+expensive forms also go through the persistent artifact cache.
+"""
+import functools
+import sonormal
+import sonormal.artifacts
+import sonormal.checksums
+import sonormal.normalize
+
+
+class Document:
+    """
+    JSON-LD document with lazily computed, memoized derived forms.
+
+    Derived forms are shared, callers must not modify them.
+
+    Args:
+        document: the JSON-LD
+        options (dict): pyld options such as base, used for expansion,
+            namespace switching and normalization
+        cache (ArtifactCache): persistent cache of the expensive forms,
+            default sonormal.artifacts.ARTIFACT_CACHE
+        loader_id (str): identifies a documentLoader or contextResolver in
+            options for the artifact cache, forms computed with them are not
+            cached without it
+    """
+
+    def __init__(self, document, options={}, cache=None, loader_id=None):
+        self.document = document
+        self.options = options
+        self.cache = cache
+        self.loader_id = loader_id
+        self._hashes = {"canonical": {}, "source": {}}
+
+    @functools.cached_property
+    def canonical_bytes(self):
+        """The document in JSON canonical form (RFC 8785), UTF-8 encoded"""
+        return sonormal.checksums.jsonBytes(self.document)
+
+    @functools.cached_property
+    def source_bytes(self):
+        """The document as indented JSON with sorted keys, UTF-8 encoded"""
+        return sonormal.checksums.jsonBytes(self.document, canonicalize=False)
+
+    def hashes(self, algorithms=sonormal.checksums.CHECKSUM_ALGORITHMS, source=False):
+        """
+        Hex digests of canonical_bytes, or of source_bytes if source.
+
+        Each digest is computed once, algorithms not computed before are
+        computed together in one pass over the bytes.
+
+        Args:
+            algorithms: names from sonormal.checksums.HASH_ALGORITHMS
+            source (bool): hash source_bytes instead of canonical_bytes
+
+        Returns:
+            dict: algorithm to hex digest
+        """
+        form = "source" if source else "canonical"
+        hashes = self._hashes[form]
+        missing = [a for a in algorithms if a not in hashes]
+        if len(missing) > 0:
+            b = self.source_bytes if source else self.canonical_bytes
+            hashes.update(sonormal.checksums.computeHashes(b, missing))
+        return {a: hashes[a] for a in algorithms}
+
+    @functools.cached_property
+    def checksums(self):
+        """sha256, sha1 and md5 hex digests of canonical_bytes"""
+        return self.hashes()
+
+    @functools.cached_property
+    def source_checksums(self):
+        """sha256, sha1 and md5 hex digests of source_bytes"""
+        return self.hashes(source=True)
+
+    @property
+    def digest(self):
+        """sha256 hex digest of canonical_bytes, the artifact cache key"""
+        return self.hashes(("sha256",))["sha256"]
+
+    @functools.cached_property
+    def expanded(self):
+        """The document expanded with the local schema.org context"""
+        return sonormal.artifacts.expanded(
+            self.document,
+            self.options,
+            cache=self.cache,
+            digest=self.digest,
+            loader_id=self.loader_id,
+        )
+
+    @functools.cached_property
+    def http(self):
+        """The document using the http://schema.org/ namespace"""
+        return sonormal.switchToHttpSchemaOrg(
+            self.document, options=self.options, expanded=self.expanded
+        )
+
+    @functools.cached_property
+    def soso(self):
+        """The http namespace document expanded with SOSO @list containers"""
+        return sonormal.sosoNormalize(
+            self.document, options=self.options, expanded=self.expanded
+        )
+
+    @functools.cached_property
+    def normalized(self):
+        """The URDNA2015 normalized document"""
+        return sonormal.artifacts.normalized(
+            self.document,
+            self.options,
+            cache=self.cache,
+            digest=self.digest,
+            loader_id=self.loader_id,
+        )
+
+    @functools.cached_property
+    def framed(self):
+        """The normalized document framed as schema.org Dataset"""
+        return sonormal.artifacts.framed(self.normalized, cache=self.cache)
+
+    @functools.cached_property
+    def source_framed(self):
+        """
+        The document framed as schema.org Dataset, as used by so info.
+
+        Not normalized, so values keep their document order and native types.
+        """
+        return sonormal.artifacts.framed(
+            self.document,
+            self.options,
+            cache=self.cache,
+            digest=self.digest,
+            loader_id=self.loader_id,
+        )
+
+    @functools.cached_property
+    def source_identifiers(self):
+        """Identifiers of each Dataset in source_framed, in document order"""
+        return sonormal.normalize.getDatasetsIdentifiers(self.source_framed)
+
+    @functools.cached_property
+    def http_framed(self):
+        """
+        The http namespace document framed as schema.org Dataset.
+
+        Not normalized, so values keep their document order and native types.
+        """
+        return sonormal.artifacts.framed(
+            self.http, self.options, cache=self.cache, loader_id=self.loader_id
+        )
+
+    @functools.cached_property
+    def http_identifiers(self):
+        """Identifiers of each Dataset in http_framed, in document order"""
+        return sonormal.normalize.getDatasetsIdentifiers(self.http_framed)
+
+    @functools.cached_property
+    def identifiers(self):
+        """
+        Identifiers of each Dataset in the document, without normalizing.
+
+        Reuses the expanded document, so is not kept in the artifact cache,
+        whose keys need the canonical JSON.
+        """
+        # expanded resolves relative IRIs against the base in options only,
+        # extractDatasetsIdentifiers defaults it to sonormal.DEFAULT_BASE
+        expanded = self.expanded if "base" in self.options else None
+        return sonormal.normalize.extractDatasetsIdentifiers(
+            self.document, options=self.options, expanded=expanded
+        )
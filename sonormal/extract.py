@@ -0,0 +1,413 @@
+"""
+Extraction of JSON-LD script elements from HTML.
+
+pyld.jsonld.load_html builds a full lxml DOM to find a handful of script
+elements. The scanner here follows the HTML tokenizer rules that decide
+where script elements are (comments, raw text elements, quoted attribute
+values, the escaped states within script content) and only looks at the
+tags that matter, so extraction runs in a single linear pass with no
+tree.
+
+loadHtml and loadDocument are drop-in replacements for the pyld.jsonld
+functions of the same name, and give the same results as load_html with
+the lxml HTML parser.
+"""
+import re
+import json
+import html
+import urllib.parse
+import pyld.jsonld
+import sonormal
+
+# Elements with raw text content, which can not contain script elements
+_RAW_TEXT = ("style", "textarea", "title", "iframe", "noembed", "noframes", "xmp")
+
+# Start tags that do not end the document head
+_HEAD_TAGS = (
+    "html",
+    "head",
+    "base",
+    "link",
+    "meta",
+    "title",
+    "style",
+    "script",
+    "noscript",
+    "frameset",
+    "frame",
+)
+
+_WS = "\t\n\f\r "
+_ATTRS = (
+    r"(?:[\t\n\f\r /]+"
+    r"|[^\t\n\f\r />][^\t\n\f\r /=>]*"
+    r"(?:[\t\n\f\r ]*=[\t\n\f\r ]*"
+    r"(?:\"[^\"]*(?:\"|\Z)|'[^']*(?:'|\Z)|[^\t\n\f\r >\"'][^\t\n\f\r >]*|(?=>)))?"
+    r")*"
+)
+_TAG_END = r"(?:>|\Z)"
+_COMMENT = r"<!--(?:>|->|.*?(?:--!?>|\Z))"
+_BOGUS = r"<(?:![^>]*|\?[^>]*|/[^A-Za-z>][^>]*)(?:>|\Z)"
+_TAG_NAME = r"[A-Za-z][^\t\n\f\r />]*"
+
+# One token: text, comment, bogus comment, or a start or end tag
+_TOKEN = re.compile(
+    rf"(?P<text>[^<]+)|{_COMMENT}|{_BOGUS}|</>"
+    rf"|<(?P<end>/)?(?P<name>{_TAG_NAME})(?P<attrs>{_ATTRS})(?P<close>{_TAG_END})"
+    r"|(?P<lt><)",
+    re.S,
+)
+
+_TAG_START = re.compile(r"</?[A-Za-z]")
+
+def _anyCase(name):
+    # re.IGNORECASE makes the candidate search several times slower
+    return "".join(f"[{c}{c.upper()}]" for c in name)
+
+
+_SPECIAL = "|".join(_anyCase(name) for name in ("script", "plaintext") + _RAW_TEXT)
+
+# Next positions where the tokenizer has to look closely: a comment or
+# bogus comment, a start tag of script, plaintext or a raw text element, a
+# tag reaching a "<" before its end, or a quoted attribute value with "<" or
+# ">" in it. Those are the only ways text and tags can hide or reveal a
+# script element, so everything up to there can be skipped.
+_CANDIDATE_TAG = re.compile(
+    rf"<(?:[!?]|/[^A-Za-z>]|(?:{_SPECIAL})(?=[\t\n\f\r />]|\Z)|/?[A-Za-z][^<>]*<)"
+)
+_CANDIDATE_VALUE = re.compile(r"=[\t\n\f\r ]*(?:\"[^\"<>]*[<>]|'[^'<>]*[<>])")
+
+_ATTR = re.compile(
+    r"([^\t\n\f\r />][^\t\n\f\r /=>]*)"
+    r"(?:[\t\n\f\r ]*=[\t\n\f\r ]*"
+    r"(?:\"([^\"]*)\"|'([^']*)'|([^\t\n\f\r >\"'][^\t\n\f\r >]*)))?"
+)
+
+# Rest of an end tag, which can have attributes with ">" in quoted values
+_END_TAG_REST = re.compile(_ATTRS + _TAG_END)
+
+_END_DELIM = r"(?=[\t\n\f\r />])"
+_SCRIPT_DATA = re.compile(rf"<!--|</script{_END_DELIM}", re.I)
+_SCRIPT_ESCAPED = re.compile(rf"-->|</script{_END_DELIM}|<script{_END_DELIM}", re.I)
+_SCRIPT_DOUBLE_ESCAPED = re.compile(rf"-->|</script{_END_DELIM}", re.I)
+_RAW_END = {
+    name: re.compile(rf"</{name}{_END_DELIM}", re.I) for name in _RAW_TEXT
+}
+
+
+def _parseAttrs(src):
+    attrs = {}
+    for m in _ATTR.finditer(src):
+        name = m.group(1).lower()
+        if name in attrs:
+            # First occurrence wins
+            continue
+        value = m.group(2)
+        if value is None:
+            value = m.group(3)
+        if value is None:
+            value = m.group(4)
+        if value is None:
+            value = ""
+        elif "&" in value:
+            value = html.unescape(value)
+        attrs[name] = value.replace("\x00", "�")
+    return attrs
+
+
+def _selfClosing(attrs_src):
+    # True if a start tag ends with "/>", not counting a "/" ending an
+    # unquoted attribute value
+    if not attrs_src.endswith("/"):
+        return False
+    last = None
+    for last in _ATTR.finditer(attrs_src):
+        pass
+    return last is None or last.end() < len(attrs_src)
+
+
+def _scriptEnd(src, pos):
+    # Offsets of the end of content and of the end tag of a script element
+    # with content starting at pos. Implements the script data, escaped and
+    # double escaped tokenizer states.
+    state = _SCRIPT_DATA
+    while True:
+        m = state.search(src, pos)
+        if m is None:
+            return len(src), len(src)
+        token = m.group(0).lower()
+        if state is _SCRIPT_DATA:
+            if token == "<!--":
+                state = _SCRIPT_ESCAPED
+                # The dashes of <!-- also count towards -->
+                pos = m.end() - 2
+                continue
+        elif state is _SCRIPT_ESCAPED:
+            if token == "-->":
+                state = _SCRIPT_DATA
+                pos = m.end()
+                continue
+            if token == "<script":
+                state = _SCRIPT_DOUBLE_ESCAPED
+                pos = m.end()
+                continue
+        else:
+            state = _SCRIPT_DATA if token == "-->" else _SCRIPT_ESCAPED
+            pos = m.end()
+            continue
+        # </script
+        return m.start(), _END_TAG_REST.match(src, m.end()).end()
+
+
+def _scriptText(text):
+    if text == "":
+        return None
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if "\x00" in text:
+        text = text.replace("\x00", "�")
+    return text
+
+
+def scanHtml(src):
+    """
+    Find the script elements and the document base of an HTML document.
+
+    Args:
+        src (str): the HTML
+
+    Returns:
+        tuple: (list of (attributes dict, text) for each script element,
+            list of href values of base elements in the document head)
+    """
+    scripts = []
+    bases = []
+    # Head state: 0 = before or in head, 1 = after </head>, 2 = in body
+    head = 0
+    head_open = False
+    noscript = 0
+    pos = 0
+    n = len(src)
+    # Positions of the next candidates in the body
+    tag_at = value_at = -1
+    while pos < n:
+        if head == 2:
+            if tag_at < pos:
+                c = _CANDIDATE_TAG.search(src, pos)
+                tag_at = n if c is None else c.start()
+            if value_at < pos:
+                c = _CANDIDATE_VALUE.search(src, pos)
+                value_at = n if c is None else c.start()
+            if tag_at < value_at:
+                pos = tag_at
+            elif value_at == n:
+                break
+            else:
+                # Tokenize the tag the value is in, if it is in one
+                t = src.rfind("<", 0, value_at)
+                if (
+                    t < 0
+                    or src.find(">", t, value_at) >= 0
+                    or not _TAG_START.match(src, t)
+                ):
+                    pos = value_at + 1
+                    continue
+                pos = t
+        m = _TOKEN.match(src, pos)
+        pos = m.end()
+        if m.group("text") is not None:
+            if head != 2 and m.group("text").strip(_WS):
+                head = 2
+            continue
+        name = m.group("name")
+        if name is None:
+            if m.group("lt") is not None and head != 2:
+                head = 2
+            continue
+        if m.group("close") == "":
+            # Tag not terminated before the end of the document is dropped
+            break
+        name = name.lower()
+        if m.group("end"):
+            if head != 2:
+                if name == "head" and head_open and head == 0:
+                    head = 1
+                elif name == "noscript" and noscript > 0:
+                    noscript -= 1
+            continue
+        if head != 2:
+            if name == "head":
+                head = 0
+                head_open = True
+            elif name == "noscript":
+                if head_open:
+                    noscript += 1
+                else:
+                    head = 2
+            elif name not in _HEAD_TAGS:
+                head = 2
+            elif name not in ("html", "frameset", "frame"):
+                head_open = True
+        attrs_src = m.group("attrs")
+        if name == "base" and head == 0 and noscript == 0:
+            attrs = _parseAttrs(attrs_src)
+            if "href" in attrs:
+                bases.append(attrs["href"])
+        elif name == "script":
+            attrs = _parseAttrs(attrs_src)
+            if _selfClosing(attrs_src):
+                scripts.append((attrs, None))
+                continue
+            end, pos = _scriptEnd(src, pos)
+            scripts.append((attrs, _scriptText(src[m.end() : end])))
+        elif name in _RAW_END:
+            if _selfClosing(attrs_src):
+                continue
+            e = _RAW_END[name].search(src, pos)
+            if e is None:
+                break
+            pos = _END_TAG_REST.match(src, e.end()).end()
+        elif name == "plaintext":
+            break
+    return scripts, bases
+
+
+def _jsonScript(content):
+    try:
+        return json.loads(content)
+    except Exception as cause:
+        raise pyld.jsonld.JsonLdError(
+            "Invalid JSON syntax.",
+            "jsonld.SyntaxError",
+            {"content": content},
+            code="invalid script element",
+            cause=cause,
+        )
+
+
+def loadHtml(input, url, profile, options):
+    """
+    Load one or more JSON-LD script elements from an HTML source.
+
+    Same as pyld.jsonld.load_html. The document base is returned through
+    options["base"].
+
+    Args:
+        input (str): the HTML
+        url: URL of the document
+        profile: prefer script elements with this JSON-LD profile
+        options: extractAllScripts True to extract all JSON-LD script
+            elements, otherwise just the first
+
+    Returns:
+        the extracted JSON
+    """
+    scripts, bases = scanHtml(input)
+    if bases:
+        effective_base = options.get("base", url)
+        html_base = bases
+        if effective_base:
+            html_base = pyld.jsonld.prepend_base(effective_base, bases[0])
+        options["base"] = html_base
+
+    fragment = urllib.parse.urlsplit(url).fragment if url else ""
+    if fragment:
+        for attrs, text in scripts:
+            if attrs.get("id") == fragment:
+                break
+        else:
+            raise pyld.jsonld.JsonLdError(
+                "No script tag found for id.",
+                "jsonld.LoadDocumentError",
+                {"id": fragment},
+                code="loading document failed",
+            )
+        _type = attrs.get("type", None)
+        if _type is None or not _type.startswith(sonormal.MEDIA_JSONLD):
+            raise pyld.jsonld.JsonLdError(
+                "Wrong type for script tag.",
+                "jsonld.LoadDocumentError",
+                {"type": [] if _type is None else [_type]},
+                code="loading document failed",
+            )
+        return _jsonScript(text)
+
+    elements = []
+    if profile:
+        prefix = f"{sonormal.MEDIA_JSONLD};profile={profile}"
+        elements = [t for a, t in scripts if a.get("type", "").startswith(prefix)]
+    if not elements:
+        elements = [
+            t for a, t in scripts if a.get("type", "").startswith(sonormal.MEDIA_JSONLD)
+        ]
+    if options.get("extractAllScripts"):
+        result = []
+        for text in elements:
+            js = _jsonScript(text)
+            if isinstance(js, list):
+                result.extend(js)
+            else:
+                result.append(js)
+        return result
+    if elements:
+        return _jsonScript(elements[0])
+    raise pyld.jsonld.JsonLdError(
+        "No script tag found.",
+        "jsonld.LoadDocumentError",
+        {"type": sonormal.MEDIA_JSONLD},
+        code="loading document failed",
+    )
+
+
+def loadDocument(url, options, base=None, profile=None, requestProfile=None):
+    """
+    Retrieve a document with options["documentLoader"] and parse it.
+
+    Same as pyld.jsonld.load_document, using loadHtml to extract JSON-LD
+    from HTML. HTML is recognized by media type, ignoring parameters such
+    as charset.
+
+    Returns:
+        dict: the remote document
+    """
+    if "headers" not in options:
+        accept = "application/ld+json, application/json;q=0.5"
+        accept += ", text/html;q=0.8, application/xhtml+xml;q=0.8"
+        if requestProfile:
+            accept = f"application/ld+json;profile={requestProfile}, {accept}"
+        options["headers"] = {"Accept": accept}
+    remote_doc = options["documentLoader"](url, options)
+    if base:
+        remote_doc["documentUrl"] = base
+    if remote_doc["document"] is None:
+        raise pyld.jsonld.JsonLdError(
+            "No remote document found at the given URL.",
+            "jsonld.NullRemoteDocument",
+            code="loading document failed",
+        )
+    if isinstance(remote_doc["document"], str):
+        try:
+            if sonormal._isHtml(remote_doc["contentType"]):
+                html_options = options.copy()
+                remote_doc["document"] = loadHtml(
+                    remote_doc["document"],
+                    remote_doc["documentUrl"],
+                    profile,
+                    html_options,
+                )
+                if "base" in html_options:
+                    remote_doc["documentUrl"] = html_options["base"]
+                    options["base"] = html_options["base"]
+            else:
+                remote_doc["document"] = json.loads(remote_doc["document"])
+        except pyld.jsonld.JsonLdError as cause:
+            raise cause
+        except Exception as cause:
+            raise pyld.jsonld.JsonLdError(
+                "Could not retrieve a JSON-LD document from the URL.",
+                "jsonld.LoadDocumentError",
+                {"remoteDoc": remote_doc},
+                code="loading document failed",
+                cause=cause,
+            )
+    return remote_doc
@@ -1,21 +1,119 @@
 """
 Retrieve JSON-LD from a URL.
 """
+import os
 import time
 import logging
 import datetime
 import json
 import requests
 import asyncio
+import aiohttp
+import atexit
+import threading
+import contextlib
+import urllib.parse
 import pyld.jsonld
 import pyppeteer
 import sonormal
 import sonormal.utils
+import sonormal.extract
+import sonormal.strategy
+from sonormal.config import settings
 
 # Wait upto this long for a browser to render a page
 BROWSER_RENDER_TIMEOUT = 30000  # msec
 REQUEST_TIMEOUT = 10 # sec
 
+# JSON-LD is considered complete when unchanged for this long
+RENDER_QUIET_PERIOD = 500  # msec
+
+# Rendering stops when no JSON-LD is present and the network has been idle this long
+RENDER_NETWORK_IDLE = 500  # msec
+
+# Rendered documents are served from DOCUMENT_CACHE for this long
+RENDER_CACHE_TIMEOUT = settings.get("RENDER_CACHE_TIMEOUT", 3600)  # seconds
+
+# Keep the rendered HTML with cached rendered documents
+RENDER_CACHE_HTML = settings.get("RENDER_CACHE_HTML", False)
+
+# Max number of requests in flight from downloadJsonAsync when sharing a semaphore
+ASYNC_MAX_CONCURRENCY = settings.get("ASYNC_MAX_CONCURRENCY", 100)
+
+# Max number of Link header alternates followed for a single request
+MAX_LINK_ALTERNATES = 5
+
+# Browser side watcher for JSON-LD script elements. Resolves with the number
+# of JSON-LD scripts once they have not changed for quietMs, or at timeoutMs.
+_JSONLD_WATCHER_JS = """(quietMs, timeoutMs) => new Promise((resolve) => {
+    const sel = 'script[type^="application/ld+json"]';
+    const signature = () => {
+        const scripts = document.querySelectorAll(sel);
+        let n = 0;
+        scripts.forEach((s) => { n += (s.textContent || "").length; });
+        return scripts.length + ":" + n;
+    };
+    let last = signature();
+    let quiet = null;
+    let done = false;
+    const finish = () => {
+        if (done) { return; }
+        done = true;
+        observer.disconnect();
+        clearTimeout(quiet);
+        resolve(document.querySelectorAll(sel).length);
+    };
+    const arm = () => {
+        clearTimeout(quiet);
+        quiet = setTimeout(() => {
+            const current = signature();
+            if (current === last) { finish(); } else { last = current; arm(); }
+        }, quietMs);
+    };
+    const observer = new MutationObserver(() => {
+        const current = signature();
+        if (current !== last) {
+            last = current;
+            arm();
+        }
+    });
+    observer.observe(document, {childList: true, subtree: true, characterData: true});
+    if (document.querySelector(sel)) { arm(); }
+    setTimeout(finish, timeoutMs);
+})"""
+
+# Resource types not loaded when rendering a page with interception enabled
+RENDER_BLOCKED_RESOURCE_TYPES = settings.get(
+    "RENDER_BLOCKED_RESOURCE_TYPES",
+    ["image", "media", "font", "stylesheet", "texttrack", "eventsource", "websocket", "manifest"],
+)
+
+# Requests to these domains and their subdomains are not made when rendering
+RENDER_BLOCKED_DOMAINS = settings.get(
+    "RENDER_BLOCKED_DOMAINS",
+    [
+        "google-analytics.com",
+        "googletagmanager.com",
+        "doubleclick.net",
+        "googlesyndication.com",
+        "facebook.net",
+        "hotjar.com",
+        "newrelic.com",
+        "nr-data.net",
+        "addthis.com",
+        "sharethis.com",
+    ],
+)
+
+# Number of headless browsers kept for rendering pages
+BROWSER_POOL_SIZE = settings.get("BROWSER_POOL_SIZE", 2)
+
+# A browser is replaced after rendering this many pages
+BROWSER_MAX_PAGES = settings.get("BROWSER_MAX_PAGES", 50)
+
+# A browser is replaced when its processes use more than this memory
+BROWSER_MAX_RSS = settings.get("BROWSER_MAX_RSS", 1024 * 1024 * 1024)  # bytes
+
 __L = logging.getLogger("sonormal.getjsonld")
 
 
@@ -77,6 +175,11 @@ def responseSummary(resp):
         rs["resources_loaded"] = resp.resources_loaded
     except AttributeError as e:
         pass
+    try:
+        rs["requests_blocked"] = resp.requests_blocked
+        rs["requests_allowed"] = resp.requests_allowed
+    except AttributeError as e:
+        pass
     rs["request"]["url"] = resp.request.url
     rs["request"]["headers"] = {}
     for k in resp.request.headers:
@@ -87,6 +190,297 @@ def responseSummary(resp):
     return rs
 
 
+def _processTreeRss(pid):
+    """
+    Resident memory in bytes of a process and its descendants.
+
+    Uses /proc, returns None where that is not available.
+    """
+    total = 0
+    pids = [pid]
+    try:
+        while len(pids) > 0:
+            _pid = pids.pop()
+            with open(f"/proc/{_pid}/status", "r") as src:
+                for line in src:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            task_folder = f"/proc/{_pid}/task"
+            for tid in os.listdir(task_folder):
+                with open(os.path.join(task_folder, tid, "children"), "r") as src:
+                    pids += [int(c) for c in src.read().split()]
+    except (OSError, ValueError):
+        if total == 0:
+            return None
+    return total
+
+
+class BrowserPool:
+    """
+    Long lived headless browsers for rendering pages.
+
+    Browsers run on a single background event loop and are shared across
+    calls, each page is opened in a fresh incognito context. A browser is
+    closed and replaced after rendering max_pages pages or when its
+    processes use more than max_rss bytes, which keeps the longevity of
+    fresh browsers without paying startup cost on every page.
+
+    Use run() to execute a coroutine that uses the pool from synchronous
+    code, or runAsync() from a coroutine on another event loop.
+    """
+
+    def __init__(
+        self, size=BROWSER_POOL_SIZE, max_pages=BROWSER_MAX_PAGES, max_rss=BROWSER_MAX_RSS
+    ):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._idle = []
+        self._semaphore = None
+        self._stats = {"launched": 0, "recycled": 0, "pages": 0}
+
+    def _start(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self.loop.run_forever, name="sonormal-browsers", daemon=True
+                )
+                self._thread.start()
+        return self.loop
+
+    def run(self, coro):
+        """Run coro on the pool event loop and wait for the result"""
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    async def runAsync(self, coro):
+        """Await coro running on the pool event loop from another loop"""
+        loop = self._start()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    async def _acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+        await self._semaphore.acquire()
+        try:
+            while len(self._idle) > 0:
+                entry = self._idle.pop()
+                if entry["browser"].process is None or entry["browser"].process.poll() is None:
+                    return entry
+            browser = await pyppeteer.launch(
+                handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False
+            )
+            self._stats["launched"] += 1
+            return {"browser": browser, "pages": 0}
+        except Exception:
+            self._semaphore.release()
+            raise
+
+    async def _release(self, entry, failed=False):
+        try:
+            entry["pages"] += 1
+            self._stats["pages"] += 1
+            process = entry["browser"].process
+            recycle = failed or entry["pages"] >= self.max_pages
+            if process is not None and process.poll() is not None:
+                recycle = True
+            if not recycle and self.max_rss and process is not None:
+                rss = _processTreeRss(process.pid)
+                recycle = rss is not None and rss > self.max_rss
+            if recycle:
+                L = logging.getLogger("sonormal.getjsonld")
+                L.debug("Recycling browser after %s pages", entry["pages"])
+                self._stats["recycled"] += 1
+                await self._closeBrowser(entry)
+            else:
+                self._idle.append(entry)
+        finally:
+            self._semaphore.release()
+
+    async def _closeBrowser(self, entry):
+        try:
+            await entry["browser"].close()
+        except Exception as e:
+            L = logging.getLogger("sonormal.getjsonld")
+            L.warning("Error closing browser: %s", e)
+
+    @contextlib.asynccontextmanager
+    async def page(self):
+        """
+        Async context manager providing a page in a new incognito context.
+
+        Must be used on the pool event loop.
+        """
+        entry = await self._acquire()
+        failed = False
+        context = None
+        try:
+            context = await entry["browser"].createIncognitoBrowserContext()
+            page = await context.newPage()
+            yield page
+        finally:
+            if context is None:
+                failed = True
+            else:
+                try:
+                    await context.close()
+                except Exception:
+                    failed = True
+            await self._release(entry, failed=failed)
+
+    def stats(self):
+        """Counts of browsers launched and recycled and pages rendered"""
+        res = dict(self._stats)
+        res["idle"] = len(self._idle)
+        return res
+
+    async def _closeAll(self):
+        while len(self._idle) > 0:
+            await self._closeBrowser(self._idle.pop())
+
+    def close(self):
+        """Close idle browsers and stop the event loop"""
+        with self._lock:
+            loop = self.loop
+            thread = self._thread
+            self.loop = None
+            self._thread = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._closeAll(), loop).result(timeout=10)
+        except Exception as e:
+            L = logging.getLogger("sonormal.getjsonld")
+            L.warning("Error closing browser pool: %s", e)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=10)
+        if not loop.is_running():
+            loop.close()
+        self._semaphore = None
+
+
+# Browsers shared by downloadJson
+BROWSER_POOL = BrowserPool()
+atexit.register(BROWSER_POOL.close)
+
+
+@contextlib.asynccontextmanager
+async def _browserPage(browser_pool=None):
+    # A page from the pool, or from a browser launched for this page only
+    if browser_pool is not None:
+        async with browser_pool.page() as page:
+            yield page
+        return
+    browser = await pyppeteer.launch(
+        handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False
+    )
+    try:
+        yield await browser.newPage()
+    finally:
+        await browser.close()
+
+
+def isBlockedRequest(url, resource_type, block_resources, block_domains):
+    """
+    True if a request made while rendering should be aborted.
+
+    Args:
+        url: URL of the request
+        resource_type: browser resource type, e.g. "image", "script"
+        block_resources: resource types to block
+        block_domains: domains to block, including their subdomains
+
+    Returns:
+        bool
+    """
+    if resource_type in block_resources:
+        return True
+    host = urllib.parse.urlparse(url).hostname
+    if host is None:
+        return False
+    host = host.lower()
+    for domain in block_domains:
+        if host == domain or host.endswith(f".{domain}"):
+            return True
+    return False
+
+
+async def _waitForNetworkIdle(page, inflight, idle_ms):
+    # Resolves once no requests have been in flight for idle_ms
+    idle_since = None
+    while True:
+        await asyncio.sleep(0.05)
+        now = time.time()
+        if inflight["n"] > 0:
+            idle_since = None
+            continue
+        if idle_since is None:
+            idle_since = max(inflight["last"], now)
+        if (now - idle_since) * 1000.0 >= idle_ms:
+            return
+
+
+async def waitForJsonld(
+    page,
+    inflight,
+    timeout=BROWSER_RENDER_TIMEOUT,
+    quiet_ms=RENDER_QUIET_PERIOD,
+    idle_ms=RENDER_NETWORK_IDLE,
+):
+    """
+    Wait until the JSON-LD of a rendered page is complete.
+
+    Completes when the JSON-LD scripts in the page have been unchanged for
+    quiet_ms, or when there is no JSON-LD and the network has been idle
+    for idle_ms, or after timeout.
+
+    Args:
+        page: pyppeteer page
+        inflight: dict with "n", the number of requests in flight, and
+            "last", the time the last request finished, kept up to date by
+            page event handlers
+        timeout: msec, upper bound on the wait
+
+    Returns:
+        int: number of JSON-LD scripts in the page, None if unknown
+    """
+    watcher = asyncio.ensure_future(
+        page.evaluate(_JSONLD_WATCHER_JS, quiet_ms, timeout)
+    )
+    idle = asyncio.ensure_future(_waitForNetworkIdle(page, inflight, idle_ms))
+    pending = {watcher, idle}
+    try:
+        t_end = time.time() + timeout / 1000.0
+        while watcher in pending:
+            remaining = t_end - time.time()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            if idle in done:
+                n = await page.evaluate(
+                    """() => document.querySelectorAll('script[type^="application/ld+json"]').length"""
+                )
+                if n == 0:
+                    __L.debug("Network idle and no JSON-LD present")
+                    return 0
+                # JSON-LD present, let the watcher decide when it is complete
+        if watcher in pending:
+            __L.warning("Timeout waiting for JSON-LD")
+            return None
+        return watcher.result()
+    finally:
+        for task in (watcher, idle):
+            if not task.done():
+                task.cancel()
+
+
 # TODO: set request headers in rendered request
 async def downloadJsonRendered(
     url,
@@ -94,19 +488,60 @@ async def downloadJsonRendered(
     profile=None,
     requestProfile=None,
     browser_timeout=BROWSER_RENDER_TIMEOUT,
+    browser_pool=None,
+    intercept=True,
+    block_resources=None,
+    block_domains=None,
+    wait_xpath=False,
 ):
+    """
+    Render url in a headless browser and extract the JSON-LD.
+
+    With intercept, requests for resource types in block_resources or to
+    domains in block_domains are aborted, since only the DOM is needed to
+    find the JSON-LD. Counts of blocked and allowed requests are included
+    in the response.
+
+    Args:
+        url: URL to retrieve
+        headers: extra request headers
+        browser_timeout: msec to wait for a JSON-LD script to appear
+        browser_pool: BrowserPool to take the page from. If None, a browser
+            is launched and closed for this page. The coroutine must run
+            on the pool event loop, see BrowserPool.run().
+        intercept: abort requests for blocked resources and domains
+        block_resources: default RENDER_BLOCKED_RESOURCE_TYPES
+        block_domains: default RENDER_BLOCKED_DOMAINS
+        wait_xpath: wait for the first JSON-LD script with waitForXPath
+            instead of waitForJsonld
+
+    Returns:
+        dict: remote document, with a response like object under "response"
+    """
     __L.debug("Loading and rendering %s", url)
     # TODO: Handle response link headers. This should not be necessary here unless
     # using this method as the primary mechanism for making the request, which is
     # not advisable because of the overhead. Only fallback to this after trying with
     # the non-rendered approach, and that should catch any link headers in the response.
 
-    # TODO: Should really be a single browser or pool of them rather than recreating
-    # Actually, this is the preferred mode for doing this stuff:
-    # 1. Only launch a browser when needed
-    # 2. Get rid of it when done, fresh per request is better for longevity
+    # Browsers are only launched when needed. With a BrowserPool they are
+    # reused for many pages and replaced periodically for longevity.
+
+    if block_resources is None:
+        block_resources = RENDER_BLOCKED_RESOURCE_TYPES
+    if block_domains is None:
+        block_domains = RENDER_BLOCKED_DOMAINS
 
     timers = {}
+    request_counts = {"blocked": 0, "allowed": 0}
+    inflight = {"n": 0, "last": time.time()}
+
+    def requestStarted(request, **kwargs):
+        inflight["n"] += 1
+
+    def requestEnded(request, **kwargs):
+        inflight["n"] -= 1
+        inflight["last"] = time.time()
 
     def startRequest(request, **kwargs):
         nonlocal timers
@@ -114,6 +549,18 @@ async def downloadJsonRendered(
         __L.debug(str(request.url))
         __L.debug(str(request.headers))
 
+    def interceptRequest(request, **kwargs):
+        if isBlockedRequest(
+            request.url, request.resourceType, block_resources, block_domains
+        ):
+            request_counts["blocked"] += 1
+            __L.debug("Blocked %s %s", request.resourceType, request.url)
+            asyncio.ensure_future(request.abort())
+            return
+        request_counts["allowed"] += 1
+        startRequest(request)
+        asyncio.ensure_future(request.continue_())
+
     def responseDone(response, **kwargs):
         __L.debug("RESPONSE URL= %s", response.url)
         __L.debug("RESPONSE HEADERS: %s", str(response.headers))
@@ -130,9 +577,6 @@ async def downloadJsonRendered(
         "response": None,  # Include the response for history/performance review
     }
 
-    browser = await pyppeteer.launch(
-        handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False
-    )
     response = sonormal.ObjDict(
         {
             "url": url,
@@ -150,77 +594,164 @@ async def downloadJsonRendered(
         }
     )
     try:
-        page = await browser.newPage()
-        if requestProfile is not None:
-            accept = headers.get("Accept", sonormal.DEFAULT_REQUEST_ACCEPT_HEADERS)
-            headers[
-                "Accept"
-            ] = f"application/ld+json;profile={requestProfile}, {accept}"
-
-        await page.setExtraHTTPHeaders(headers)
-        page.on("request", startRequest)
-        page.on("response", responseDone)
-        __L.debug("PAGE GOTO")
-        _response = await page.goto(url)
-
-        # await page.waitForSelector('#Metadata')
-        # Give the page 5 seconds for a jsonld to appear
-        try:
-            __L.debug("PAGE WAIT XPATH")
-            await page.waitForXPath(
-                f'//script[@type="{sonormal.MEDIA_JSONLD}"]',
-                timeout=browser_timeout,
+        async with _browserPage(browser_pool) as page:
+            if requestProfile is not None:
+                accept = headers.get("Accept", sonormal.DEFAULT_REQUEST_ACCEPT_HEADERS)
+                headers[
+                    "Accept"
+                ] = f"application/ld+json;profile={requestProfile}, {accept}"
+
+            await page.setExtraHTTPHeaders(headers)
+            if intercept:
+                await page.setRequestInterception(True)
+                page.on("request", interceptRequest)
+            else:
+                page.on("request", startRequest)
+            page.on("response", responseDone)
+            page.on("request", requestStarted)
+            page.on("requestfinished", requestEnded)
+            page.on("requestfailed", requestEnded)
+            __L.debug("PAGE GOTO")
+            _response = await page.goto(url)
+
+            try:
+                if wait_xpath:
+                    __L.debug("PAGE WAIT XPATH")
+                    await page.waitForXPath(
+                        f'//script[@type="{sonormal.MEDIA_JSONLD}"]',
+                        timeout=browser_timeout,
+                    )
+                else:
+                    __L.debug("PAGE WAIT JSONLD")
+                    n_scripts = await waitForJsonld(
+                        page, inflight, timeout=browser_timeout
+                    )
+                    __L.debug("JSON-LD scripts: %s", n_scripts)
+            except Exception as e:
+                __L.error(e)
+            __L.debug("PAGE WAIT CONTENT")
+            content = await page.content()
+            __L.debug("PAGE LOADED")
+
+            # Gather metadata about the request and responses
+            response.request.headers = _response.request.headers
+            response["url"] = _response.url
+            response["status_code"] = _response.status
+            response["headers"] = _response.headers
+            doc["contentType"] = response["headers"].get(
+                "content-type", sonormal.DEFAULT_RESPONSE_CONTENT_TYPE
             )
-        except Exception as e:
-            __L.error(e)
-        __L.debug("PAGE WAIT CONTENT")
-        content = await page.content()
-        __L.debug("PAGE LOADED")
-
-        # Gather metadata about the request and responses
-        response.request.headers = _response.request.headers
-        response["url"] = _response.url
-        response["status_code"] = _response.status
-        response["headers"] = _response.headers
-        doc["contentType"] = response["headers"].get(
-            "content-type", sonormal.DEFAULT_RESPONSE_CONTENT_TYPE
-        )
-        doc["documentUrl"] = response.url
+            doc["documentUrl"] = response.url
 
-        for _history in _response.request.redirectChain:
-            h = sonormal.ObjDict(
-                {
-                    "url": _history.response.url,
-                    "status_code": _history.response.status,
-                    "headers": _history.response.headers,
-                    "text": None,
-                }
+            for _history in _response.request.redirectChain:
+                h = sonormal.ObjDict(
+                    {
+                        "url": _history.response.url,
+                        "status_code": _history.response.status,
+                        "headers": _history.response.headers,
+                        "text": None,
+                    }
+                )
+                h.elapsed = datetime.timedelta(seconds=timers.get(h["url"], 3))
+                response["history"].append(h)
+
+            response["elapsed"] = datetime.timedelta(seconds=timers.get(_response.url, 3))
+            response["resources_loaded"] = list(timers.keys())
+            if intercept:
+                response["requests_blocked"] = request_counts["blocked"]
+                response["requests_allowed"] = request_counts["allowed"]
+
+            # Extract the JSON-LD from the page
+            response["text"] = content
+            __L.debug("JLD position: %s", content.find("ld+json"))
+            jsonld = sonormal.extract.loadHtml(
+                content,
+                doc["documentUrl"],
+                profile=profile,
+                options={"extractAllScripts": True},
             )
-            h.elapsed = datetime.timedelta(seconds=timers.get(h["url"], 3))
-            response["history"].append(h)
-
-        response["elapsed"] = datetime.timedelta(seconds=timers.get(_response.url, 3))
-        response["resources_loaded"] = list(timers.keys())
-
-        # Extract the JSON-LD from the page
-        response["text"] = content
-        __L.debug("JLD position: %s", content.find("ld+json"))
-        jsonld = pyld.jsonld.load_html(
-            content,
-            doc["documentUrl"],
-            profile=profile,
-            options={"extractAllScripts": True, "json_parse_strict": json_parse_strict},
-        )
-        doc["document"] = jsonld
-        doc["response"] = response
+            doc["document"] = jsonld
+            doc["response"] = response
     except Exception as e:
         __L.error(e)
     finally:
-        await browser.close()
         __L.debug("Exit downloadJsonRendered")
     return doc
 
 
+def renderCacheKey(url, profile=None, requestProfile=None):
+    """Key of the rendered document for url in the document cache"""
+    key = f"rendered:{url}"
+    if profile is not None:
+        key += f" profile={profile}"
+    if requestProfile is not None:
+        key += f" requestProfile={requestProfile}"
+    return key
+
+
+async def downloadJsonRenderedCached(
+    url,
+    headers={},
+    profile=None,
+    requestProfile=None,
+    browser_timeout=BROWSER_RENDER_TIMEOUT,
+    browser_pool=None,
+    document_cache=None,
+    cache_timeout=None,
+    cache_html=None,
+):
+    """
+    downloadJsonRendered with results kept in a document cache.
+
+    Rendered documents containing JSON-LD are cached under renderCacheKey()
+    with the response information, so responseSummary works on a cache hit.
+
+    Args:
+        document_cache: dict or diskcache.Cache, default sonormal.DOCUMENT_CACHE
+        cache_timeout: seconds a cached render is used, default RENDER_CACHE_TIMEOUT
+        cache_html: also cache the rendered HTML, default RENDER_CACHE_HTML
+
+    Returns:
+        dict: remote document
+    """
+    if document_cache is None:
+        document_cache = sonormal.DOCUMENT_CACHE
+    if cache_timeout is None:
+        cache_timeout = RENDER_CACHE_TIMEOUT
+    if cache_html is None:
+        cache_html = RENDER_CACHE_HTML
+    key = renderCacheKey(url, profile=profile, requestProfile=requestProfile)
+    entry = sonormal._getDocumentCacheEntry(document_cache, key)
+    if entry is not None and time.time() - entry["cached"] < cache_timeout:
+        __L.debug("Rendered cache hit: %s", url)
+        sonormal.DOCUMENT_CACHE_STATS["hits"] += 1
+        return dict(entry["doc"])
+    doc = await downloadJsonRendered(
+        url,
+        headers=headers,
+        profile=profile,
+        requestProfile=requestProfile,
+        browser_timeout=browser_timeout,
+        browser_pool=browser_pool,
+    )
+    if _hasJsonld(doc):
+        sonormal.DOCUMENT_CACHE_STATS["rendered"] += 1
+        entry = {
+            "doc": doc,
+            "cached": time.time(),
+            "etag": None,
+            "last_modified": None,
+        }
+        if cache_html and doc.get("response", None) is not None:
+            entry["text"] = doc["response"].get("text", None)
+        sonormal._setDocumentCacheEntry(document_cache, key, entry, expire=cache_timeout)
+    return doc
+
+
+def _hasJsonld(response_doc):
+    return len(response_doc.get("document", None) or []) > 0
+
+
 def downloadJson(
     url,
     headers={},
@@ -228,8 +759,31 @@ def downloadJson(
     requestProfile=None,
     try_jsrender=True,
     documentLoader=None,
-    loader_timeout=REQUEST_TIMEOUT
+    loader_timeout=REQUEST_TIMEOUT,
+    strategies=sonormal.strategy.FETCH_STRATEGIES,
+    scheduler=None,
 ):
+    """
+    Retrieve JSON-LD from url, rendering the page if necessary.
+
+    The page source is tried first, and the page is rendered with
+    BROWSER_POOL if it contains no JSON-LD. The method that worked is
+    recorded per host in strategies, so hosts that need rendering are
+    rendered directly until the next probe.
+
+    Args:
+        url: URL to retrieve from
+        headers: Optional headers to use in request
+        try_jsrender: Use the pyppeteer page renderer if needed
+        documentLoader: loader for the plain request
+        loader_timeout: seconds for the request
+        strategies: FetchStrategies, None to always probe without recording
+        scheduler: HostScheduler rendering the page is scheduled with, for
+            the plain request use a loader from politeDocumentLoader
+
+    Returns:
+        dict: remote document, or {"ERROR": message} on timeout
+    """
     __L.debug(
         "downloadJson: %s %s %s %s %s",
         url,
@@ -238,7 +792,42 @@ def downloadJson(
         try_jsrender,
         documentLoader,
     )
+    headers = dict(headers)
+    strategy = None
+    if strategies is not None:
+        strategy = strategies.get(url)
+    probe = strategies is None or strategies.needsProbe(strategy)
+    if strategy is not None and strategy.get("accept"):
+        headers.setdefault("Accept", strategy["accept"])
     headers.setdefault("Accept", sonormal.DEFAULT_REQUEST_ACCEPT_HEADERS)
+
+    def render():
+        if scheduler is not None:
+            scheduler.acquire(url)
+        try:
+            return BROWSER_POOL.run(
+                downloadJsonRenderedCached(
+                    url,
+                    headers=dict(headers),
+                    profile=profile,
+                    requestProfile=requestProfile,
+                    browser_timeout=loader_timeout*1000,
+                    browser_pool=BROWSER_POOL,
+                )
+            )
+        finally:
+            if scheduler is not None:
+                scheduler.release(url)
+
+    rendered_doc = None
+    if try_jsrender and not probe and strategy["method"] == sonormal.strategy.METHOD_RENDER:
+        __L.debug("Rendering %s per fetch strategy", url)
+        rendered_doc = render()
+        if _hasJsonld(rendered_doc):
+            strategies.record(url, sonormal.strategy.METHOD_RENDER, probed=False)
+            return rendered_doc
+        # Strategy did not work this time, try the page source
+        strategies.forget(url)
     try:
         options = {
             "headers": headers,
@@ -248,12 +837,20 @@ def downloadJson(
         }
         if documentLoader is not None:
             options["documentLoader"] = documentLoader
-        response_doc = pyld.jsonld.load_document(
+        response_doc = sonormal.extract.loadDocument(
             url, options, profile=profile, requestProfile=requestProfile
         )
         __L.debug("response_doc: %s", response_doc)
         if len(response_doc.get("document", [])) < 1:
             raise ValueError("Empty jsonld list.")
+        if strategies is not None:
+            strategies.record(
+                url,
+                sonormal.strategy.METHOD_PLAIN,
+                accept=headers.get("Accept"),
+                alternate=sonormal.strategy.usedLinkAlternate(url, response_doc),
+                probed=probe,
+            )
         return response_doc
     except requests.Timeout as e:
         __L.error("Request to %s timed out", url)
@@ -262,14 +859,144 @@ def downloadJson(
         __L.warning("No JSON-LD in plain source %s", url)
         if not try_jsrender:
             raise (e)
+        if rendered_doc is not None:
+            # Already rendered per the fetch strategy
+            return rendered_doc
         # Empty array?
         # try loading and rendering the page
-        response_doc = asyncio.run(
-            downloadJsonRendered(
-                url, headers=headers, profile=profile, requestProfile=requestProfile, browser_timeout=loader_timeout*1000
+        response_doc = render()
+        if strategies is not None and _hasJsonld(response_doc):
+            strategies.record(url, sonormal.strategy.METHOD_RENDER)
+    return response_doc
+
+
+def _aiohttpResponse(resp, text, request_headers, elapsed):
+    # requests like response from an aiohttp response
+    def _response(r, body, dt):
+        return sonormal.ObjDict(
+            {
+                "url": str(r.url),
+                "status_code": r.status,
+                "headers": requests.structures.CaseInsensitiveDict(r.headers),
+                "text": body,
+                "elapsed": dt,
+                "history": [],
+            }
+        )
+
+    response = _response(resp, text, elapsed)
+    for h in resp.history:
+        response["history"].append(_response(h, None, datetime.timedelta()))
+    response["request"] = sonormal.ObjDict(
+        {
+            "url": str(resp.request_info.real_url),
+            "headers": dict(request_headers),
+        }
+    )
+    return response
+
+
+async def _readAiohttpBody(resp, content_type, head_only=False, truncate=True):
+    # Async counterpart of sonormal.readResponseBody
+    max_bytes = sonormal.DOCUMENT_MAX_BYTES
+    if resp.content_length is not None and resp.content_length > max_bytes:
+        raise ValueError(f"Response of {resp.content_length} bytes exceeds {max_bytes} bytes")
+    scanner = sonormal.HtmlJsonldScanner(head_only=head_only)
+    html = truncate and sonormal._isHtml(content_type)
+    async for chunk in resp.content.iter_chunked(sonormal.STREAM_CHUNK_SIZE):
+        if html:
+            if scanner.feed(chunk):
+                __L.debug("Stopped reading %s after %s bytes", resp.url, len(scanner.body))
+                return bytes(scanner.body[: scanner.end])
+        else:
+            scanner.body += chunk
+        if len(scanner.body) > max_bytes:
+            raise ValueError(f"Response exceeds {max_bytes} bytes")
+    return bytes(scanner.body)
+
+
+async def aiohttpDocumentLoader(session, url, options={}, timeout=REQUEST_TIMEOUT):
+    """
+    Retrieve a remote document with aiohttp.
+
+    Async counterpart of sonormal.requests_document_loader_history, including
+    following a Link header alternate to JSON-LD and reading HTML only until
+    the JSON-LD has been received.
+
+    Args:
+        session: aiohttp.ClientSession
+        url: URL to retrieve
+        options: pyld style options, "headers", "profile" and
+            "extractAllScripts" are used
+        timeout: seconds for the request
+
+    Returns:
+        dict: the RemoteDocument with the unparsed document and a requests
+            like response under "response"
+    """
+    for _ in range(MAX_LINK_ALTERNATES + 1):
+        pieces = urllib.parse.urlparse(url)
+        if not all([pieces.scheme, pieces.netloc]) or pieces.scheme not in [
+            "http",
+            "https",
+        ]:
+            raise pyld.jsonld.JsonLdError(
+                'URL could not be dereferenced; only "http" and "https" '
+                "URLs are supported.",
+                "jsonld.InvalidUrl",
+                {"url": url},
+                code="loading document failed",
+            )
+        headers = options.get("headers")
+        if headers is None:
+            headers = {"Accept": sonormal.DEFAULT_REQUEST_ACCEPT_HEADERS}
+        t0 = time.time()
+        try:
+            async with session.get(
+                url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as resp:
+                body = await _readAiohttpBody(
+                    resp,
+                    resp.headers.get("content-type"),
+                    head_only=sonormal.HTML_STREAM_HEAD_ONLY,
+                    truncate=sonormal.streamTruncates(url, options),
+                )
+                text = body.decode(resp.charset or "utf-8", errors="replace")
+        except (aiohttp.ClientError, ValueError) as cause:
+            raise pyld.jsonld.JsonLdError(
+                "Could not retrieve a JSON-LD document from the URL.",
+                "jsonld.LoadDocumentError",
+                code="loading document failed",
+                cause=cause,
             )
+        response = _aiohttpResponse(
+            resp, text, headers, datetime.timedelta(seconds=time.time() - t0)
         )
-    return response_doc
+        content_type = resp.headers.get("content-type")
+        if not content_type:
+            content_type = sonormal.DEFAULT_RESPONSE_CONTENT_TYPE
+        context_url, alternate_url = sonormal.parseLinkHeader(
+            url,
+            resp.headers.get("link"),
+            content_type,
+            profile=options.get("profile", None),
+        )
+        if alternate_url is None:
+            return {
+                "contentType": content_type,
+                "contextUrl": context_url,
+                "documentUrl": response.url,
+                "document": text,
+                "response": response,
+            }
+        __L.debug("Linked alternate: %s", alternate_url)
+        url = alternate_url
+    raise pyld.jsonld.JsonLdError(
+        "URL could not be dereferenced, too many Link header alternates.",
+        "jsonld.LoadDocumentError",
+        {"url": url},
+        code="loading document failed",
+    )
 
 
 async def downloadJsonAsync(
@@ -278,43 +1005,135 @@ async def downloadJsonAsync(
     profile=None,
     requestProfile=None,
     try_jsrender=True,
+    session=None,
+    semaphore=None,
+    loader_timeout=REQUEST_TIMEOUT,
     json_parse_strict=True,
 ):
     """
-    Not really async, just running without creating an event loop.
+    Retrieve JSON-LD from url without blocking the event loop.
+
+    The async counterpart of downloadJson. The document is retrieved with
+    aiohttp, JSON-LD is extracted from HTML responses, and if none is found
+    the page is rendered with BROWSER_POOL.
+
     Args:
         url: URL to retrieve from
         headers: Optional headers to use in request
         try_jsrender: Use the pyppeteer page renderer if needed
+        session: aiohttp.ClientSession to use, a session is created for
+            this call if None
+        semaphore: asyncio.Semaphore limiting the number of requests in flight
+        loader_timeout: seconds for the request
+        json_parse_strict: deprecated, passed in the loader options as
+            before but not used by pyld
 
     Returns:
-        json-ld document, requests response (or similar)
+        dict: remote document, or {"ERROR": message} on timeout
     """
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await downloadJsonAsync(
+                url,
+                headers=headers,
+                profile=profile,
+                requestProfile=requestProfile,
+                try_jsrender=try_jsrender,
+                session=session,
+                semaphore=semaphore,
+                loader_timeout=loader_timeout,
+                json_parse_strict=json_parse_strict,
+            )
+    headers = dict(headers)
     headers.setdefault("Accept", sonormal.DEFAULT_REQUEST_ACCEPT_HEADERS)
+    if semaphore is None:
+        semaphore = contextlib.nullcontext()
     try:
+        async with semaphore:
+            remote_doc = await aiohttpDocumentLoader(
+                session,
+                url,
+                options={
+                    "headers": headers,
+                    "profile": profile,
+                    "extractAllScripts": True,
+                    "json_parse_strict": json_parse_strict,
+                },
+                timeout=loader_timeout,
+            )
+        # Parse or extract the JSON-LD from the retrieved document
         options = {
             "headers": headers,
-            "documentLoader": pyld.jsonld.get_document_loader(),
+            "documentLoader": lambda _url, _options: remote_doc,
+            "extractAllScripts": True,
             "json_parse_strict": json_parse_strict,
         }
-        response_doc = pyld.jsonld.load_document(
+        response_doc = sonormal.extract.loadDocument(
             url, options, profile=profile, requestProfile=requestProfile
         )
+        if len(response_doc.get("document", [])) < 1:
+            raise ValueError("Empty jsonld list.")
         return response_doc
-    except requests.Timeout as e:
+    except asyncio.TimeoutError as e:
         __L.error("Request to %s timed out", url)
-        return {"ERROR": str(e)}, []
-    except pyld.jsonld.JsonLdError as e:
+        return {"ERROR": str(e)}
+    except (ValueError, pyld.jsonld.JsonLdError) as e:
         __L.warning("No JSON-LD in plain source %s", url)
         if not try_jsrender:
             raise (e)
-        # Empty array?
         # try loading and rendering the page
-        response_doc = await downloadJsonRendered(
-            url,
-            headers=headers,
-            profile=profile,
-            requestProfile=requestProfile,
-            json_parse_strict=json_parse_strict,
+        response_doc = await BROWSER_POOL.runAsync(
+            downloadJsonRenderedCached(
+                url,
+                headers=headers,
+                profile=profile,
+                requestProfile=requestProfile,
+                browser_timeout=loader_timeout * 1000,
+                browser_pool=BROWSER_POOL,
+            )
         )
     return response_doc
+
+
+async def downloadJsonMany(
+    urls,
+    headers={},
+    profile=None,
+    requestProfile=None,
+    try_jsrender=True,
+    max_concurrency=ASYNC_MAX_CONCURRENCY,
+    loader_timeout=REQUEST_TIMEOUT,
+):
+    """
+    Retrieve JSON-LD from many URLs concurrently.
+
+    Requests share a connection pool and at most max_concurrency are in
+    flight at once. Rendering is further limited by the size of BROWSER_POOL.
+
+    Args:
+        urls: list of URLs
+        max_concurrency: max number of requests in flight
+
+    Returns:
+        list: for each url, the remote document, {"ERROR": message} on
+            timeout, or the exception raised
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrency, limit_per_host=sonormal.HTTP_POOL_SIZE
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [
+            downloadJsonAsync(
+                url,
+                headers=headers,
+                profile=profile,
+                requestProfile=requestProfile,
+                try_jsrender=try_jsrender,
+                session=session,
+                semaphore=semaphore,
+                loader_timeout=loader_timeout,
+            )
+            for url in urls
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
@@ -3,13 +3,18 @@ Normalize JSON-LD and methods for normalized form operations.
 
 """
 
+import os
+import re
 import logging
 import copy
+import collections
+import multiprocessing
 import requests
 import json
 import sonormal
 import pyld.jsonld
 import c14n
+from sonormal.config import settings
 
 __L = logging.getLogger("sonormal")
 
@@ -123,31 +128,315 @@ def getDatasetsIdentifiers(jdoc, prefer_str=False):
     return ids
 
 
+def _isNode(value):
+    return isinstance(value, dict) and not (
+        "@value" in value or "@list" in value or "@set" in value
+    )
+
+
+def _indexNodes(element, index, nodes):
+    # Collect the node objects of an expanded document, merging the
+    # properties of nodes with the same @id as in the node map used for
+    # framing. Nodes without @id are complete where they appear.
+    if isinstance(element, list):
+        for item in element:
+            _indexNodes(item, index, nodes)
+        return
+    if not isinstance(element, dict):
+        return
+    if "@list" in element or "@set" in element:
+        _indexNodes(element.get("@list", element.get("@set")), index, nodes)
+        return
+    if "@value" in element:
+        return
+    _id = element.get("@id", None)
+    if _id is None:
+        node = element
+        nodes.append(node)
+    else:
+        node = index.get(_id, None)
+        if node is None:
+            node = {"@id": _id}
+            index[_id] = node
+            nodes.append(node)
+    for k, v in element.items():
+        if k == "@graph":
+            _indexNodes(v, index, nodes)
+        elif k == "@reverse":
+            for p, rvalues in v.items():
+                for rvalue in rvalues:
+                    _indexNodes(rvalue, index, nodes)
+                    if _id is not None and rvalue.get("@id", None) is not None:
+                        rnode = index[rvalue["@id"]]
+                        rnode.setdefault(p, []).append({"@id": _id})
+        elif not k.startswith("@") or k == "@type":
+            if node is not element:
+                node.setdefault(k, []).extend(v)
+            _indexNodes(v, index, nodes)
+
+
+def _literalTerm(value):
+    # The RDF literal of a value object as in pyld.jsonld.to_rdf, a native
+    # value becomes its canonical lexical form
+    v = value["@value"]
+    datatype = value.get("@type", None)
+    if isinstance(v, bool):
+        v = "true" if v else "false"
+        datatype = datatype or pyld.jsonld.XSD_BOOLEAN
+    elif isinstance(v, float) or (datatype == pyld.jsonld.XSD_DOUBLE and not isinstance(v, str)):
+        v = re.sub(r"(\d)0*E\+?0*(\d)", r"\1E\2", "%1.15E" % v)
+        datatype = datatype or pyld.jsonld.XSD_DOUBLE
+    elif isinstance(v, int):
+        v = str(v)
+        datatype = datatype or pyld.jsonld.XSD_INTEGER
+    term = {"type": "literal", "value": v, "datatype": datatype or pyld.jsonld.XSD_STRING}
+    if "@language" in value:
+        term["datatype"] = pyld.jsonld.RDF_LANGSTRING
+        term["language"] = value["@language"]
+    return term
+
+
+def _termKey(term):
+    return pyld.jsonld.JsonLdProcessor.to_nquad(
+        {"subject": {"type": "IRI", "value": ""}, "predicate": {"type": "IRI", "value": ""}, "object": term}
+    )
+
+
+class _BlankNodeOrder(Exception):
+    # The result depends on the canonical labels of blank nodes
+    pass
+
+
+def _isBlank(value):
+    return "@list" in value or (
+        _isNode(value) and value.get("@id", "_:").startswith("_:")
+    )
+
+
+def _reaches(value):
+    # True if a node with @id is reached from value, framing embeds it where
+    # it is first reached
+    if isinstance(value, list):
+        return any(_reaches(v) for v in value)
+    if not isinstance(value, dict):
+        return False
+    return "@id" in value or any(_reaches(v) for v in value.values())
+
+
+def _checkEmbedOrder(values):
+    # Blank node values are in document order, not canonical order. Which
+    # of them embeds a node first is not known when two reach nodes.
+    if sum(1 for v in values if _isBlank(v) and _reaches(v)) > 1:
+        raise _BlankNodeOrder()
+
+
+def _checkLabels(values):
+    # Blank node labels are reported by _getValueOrURI and _getURLs
+    if any(_isBlank(v) for v in values):
+        raise _BlankNodeOrder()
+
+
+def _values(node, prop, index):
+    # Values of prop as in the normalized form: value objects as string
+    # literals, duplicates dropped and values in N-Quads order. Blank nodes
+    # sort last, in document order, their canonical order is not known,
+    # callers check where that matters. Node references are resolved
+    # through index.
+    values = {}
+    for value in node.get(prop, []):
+        if "@list" in value:
+            items = [_listItem(item, index) for item in value["@list"]]
+            values[("_:", len(values))] = {"@list": items}
+        elif "@value" in value:
+            if value.get("@type", None) == "@json":
+                continue
+            term = _literalTerm(value)
+            key = (_termKey(term), 0)
+            item = {"@value": term["value"]}
+            if "language" in term:
+                item["@language"] = term["language"]
+            values.setdefault(key, item)
+        else:
+            _id = value.get("@id", None)
+            if _id is None or _id.startswith("_:"):
+                key = ("_:", _id if _id is not None else len(values))
+            else:
+                key = (_termKey({"type": "IRI", "value": _id}), 0)
+            values.setdefault(key, index.get(_id, value) if _id is not None else value)
+    blank = [k for k in values if k[0] == "_:"]
+    ordered = sorted(k for k in values if k[0] != "_:")
+    return [values[k] for k in ordered + blank]
+
+
+def _listItem(item, index):
+    if "@value" in item:
+        return {"@value": _literalTerm(item)["value"]}
+    _id = item.get("@id", None)
+    return index.get(_id, item) if _id is not None else item
+
+
+def _embed(value, index, embedded):
+    # Marks the nodes framing embeds with value, visiting properties in the
+    # order of framing. With @embed @once a node is embedded where it is
+    # first reached, False when value is a reference to a node embedded
+    # before, including an enclosing node, framed as a bare {"@id"}
+    if not _isNode(value):
+        return True
+    # A node without @id is a single object of the expanded document
+    key = value.get("@id", id(value))
+    if key in embedded:
+        return False
+    embedded.add(key)
+    for prop in sorted(value.keys()):
+        if prop.startswith("@"):
+            continue
+        values = _values(value, prop, index)
+        _checkEmbedOrder(values)
+        for item in values:
+            for v in item["@list"] if "@list" in item else [item]:
+                _embed(v, index, embedded)
+    return True
+
+
+def _framedIdentifier(value, index, embedded):
+    if not _isNode(value):
+        return value
+    if not _embed(value, index, embedded):
+        return {"@id": value.get("@id", None)}
+    return _identifierView(value, index)
+
+
+def _datasetView(node, index):
+    # The properties of a Dataset node read by _getDatasetIdentifiers, as
+    # they appear in the normalized and framed document
+    view = {"@type": node.get("@type", [])}
+    _id = node.get("@id", None)
+    if _id is not None and not _id.startswith("_:"):
+        view["@id"] = _id
+    embedded = {id(node) if _id is None else _id}
+    for prop in sorted(node.keys()):
+        if prop.startswith("@"):
+            continue
+        values = _values(node, prop, index)
+        if prop in (sonormal.SO_URL, sonormal.SO_VALUE):
+            _checkLabels(values)
+        _checkEmbedOrder(values)
+        if prop != sonormal.SO_IDENTIFIER:
+            for value in values:
+                for v in value["@list"] if "@list" in value else [value]:
+                    _embed(v, index, embedded)
+            view[prop] = values
+            continue
+        # Identifiers are reported in the order of their values
+        if sum(1 for v in values if _isBlank(v)) > 1:
+            raise _BlankNodeOrder()
+        idents = []
+        for ident in values:
+            if "@list" in ident:
+                ident = {
+                    "@list": [
+                        _framedIdentifier(item, index, embedded) for item in ident["@list"]
+                    ]
+                }
+            idents.append(_framedIdentifier(ident, index, embedded))
+        view[prop] = idents
+    return view
+
+
+def _identifierView(ident, index):
+    urls = _values(ident, sonormal.SO_URL, index)
+    _checkLabels(urls)
+    return {
+        sonormal.SO_VALUE: _values(ident, sonormal.SO_VALUE, index),
+        sonormal.SO_URL: urls,
+    }
+
+
+def extractDatasetsIdentifiers(jdoc, options={}, prefer_str=False, expanded=None):
+    """
+    Extract the identifiers of each schema.org Dataset in a JSON-LD document.
+
+    The result of getDatasetsIdentifiers(frameSODataset(normalizeJsonld(jdoc))),
+    without normalizing or framing where possible. The expanded document is
+    indexed by node @id and identifier and url references are followed
+    through the index. As when framing with @embed @once, a node reached
+    again below a Dataset, including the Dataset itself, is a bare reference
+    and adds no values.
+
+    The canonical labels of blank nodes are not computed. When the result
+    depends on them, because a Dataset is a blank node, a blank node label
+    would be reported, or the canonical order of blank node values decides
+    the order of identifiers or where a node is embedded, the document is
+    normalized and framed instead.
+
+    Args:
+        jdoc: JSON-LD document
+        options (dict): pyld options, base defaults to sonormal.DEFAULT_BASE
+        prefer_str: as for getDatasetsIdentifiers
+        expanded: jdoc already expanded with options, if available
+
+    Returns:
+        list of dict with @id, url and identifier
+    """
+    opts = {"base": sonormal.DEFAULT_BASE}
+    opts.update(options)
+    if expanded is None:
+        expanded = pyld.jsonld.expand(
+            jdoc, options=sonormal.ACTIVE_CONTEXTS.options("so", opts)
+        )
+    index = {}
+    nodes = []
+    _indexNodes(expanded, index, nodes)
+    datasets = [n for n in nodes if sonormal.SO_DATASET in n.get("@type", [])]
+    try:
+        if any(_isBlank(n) for n in datasets):
+            raise _BlankNodeOrder()
+        # Framing outputs the matching nodes in order of @id
+        datasets.sort(key=lambda n: n["@id"])
+        ids = []
+        for node in datasets:
+            _ids = _getDatasetIdentifiers(_datasetView(node, index), prefer_str=prefer_str)
+            ids.append(_ids)
+        return ids
+    except _BlankNodeOrder:
+        __L.debug("Blank nodes decide the identifiers, normalizing")
+    ndoc = normalizeJsonld(expanded, options=opts)
+    return getDatasetsIdentifiers(frameSODataset(ndoc), prefer_str=prefer_str)
+
+
+# Context entries forcing the @list container, copied into the results of
+# forceSODatasetLists
+_FORCED_LIST_CONTEXTS = sonormal.freezeJson(
+    [{"creator": {"@container": "@list"}}, {"identifier": {"@container": "@list"}}]
+)
+
+
 def _forceSODatasetLists(jdoc):
-    _forced = ["creator", "identifier"]
-    modified = copy.deepcopy(jdoc)
-    ctx = modified.get("@context", None)
-    if isinstance(ctx, list):
-        for _f in _forced:
-            ctx.append({_f:{"@container":"@list"}})
-        #ctx.append({"creator": {"@container": "@list"}})
-        modified["@context"] = ctx
-        return modified
+    # Copy on write, only the top level and its @context are new objects,
+    # other members are shared with jdoc
+    ctx = jdoc.get("@context", None)
     if isinstance(ctx, str):
         ctx = [ctx, ]
-        for _f in _forced:
-            ctx.append({_f:{"@container":"@list"}})
-
-        modified["@context"] = ctx
+    if isinstance(ctx, list):
+        modified = dict(jdoc)
+        modified["@context"] = ctx + copy.deepcopy(_FORCED_LIST_CONTEXTS)
         return modified
     if isinstance(ctx, dict):
-        for k in _forced:
-            ctx[k] = {"@container": "@list"}
-        modified["@context"] = ctx
-    return modified
+        modified = dict(jdoc)
+        modified["@context"] = dict(ctx)
+        for forced in copy.deepcopy(_FORCED_LIST_CONTEXTS):
+            modified["@context"].update(forced)
+        return modified
+    return dict(jdoc)
 
 
 def forceSODatasetLists(jdoc):
+    """
+    Set the @list container for creator and identifier in the @context.
+
+    The results share all members other than @context with jdoc, only
+    their @context can be modified in place.
+    """
     if isinstance(jdoc, dict):
         return _forceSODatasetLists(jdoc)
     docs = []
@@ -159,7 +448,8 @@ def forceSODatasetLists(jdoc):
 def frameSODataset(jdoc, frame_doc=None, options={}):
     __L.debug("Framing")
     if frame_doc is None:
-        frame_doc = copy.deepcopy(sonormal.SO_DATASET_FRAME)
+        frame_doc = sonormal.copyContext(sonormal.SO_DATASET_FRAME)
+    options = sonormal.ACTIVE_CONTEXTS.options("so", options)
     try:
         fdoc = pyld.jsonld.frame(jdoc, frame_doc, options=options)
         __L.debug("fdoc OK")
@@ -173,17 +463,80 @@ def frameSODataset(jdoc, frame_doc=None, options={}):
 def compactSODataset(jdoc, options={}, context=None):
     opts = {"base": sonormal.DEFAULT_BASE}
     opts.update(options)
+    opts = sonormal.ACTIVE_CONTEXTS.options("so", opts)
     if context is None:
-        context = copy.deepcopy(sonormal.SO_COMPACT_CONTEXT)
+        context = sonormal.copyContext(sonormal.SO_COMPACT_CONTEXT)
         #Assume @base was set in the context, if provided
         if options.get("base", None) is not None:
-            context["@context"].append({"@base":options["base"]})
+            context["@context"].append({"@base": options["base"]})
     return pyld.jsonld.compact(jdoc, context, options=opts)
 
 
+def _canonicalTriple(quad):
+    # The triple of quad as parsed from its N-Quad by pyld.jsonld.parse_nquads
+    triple = {
+        "subject": {"type": quad["subject"]["type"], "value": quad["subject"]["value"]},
+        "predicate": {"type": "IRI", "value": quad["predicate"]["value"]},
+    }
+    obj = quad["object"]
+    if obj["type"] != "literal":
+        triple["object"] = {"type": obj["type"], "value": obj["value"]}
+        return triple
+    triple["object"] = {"type": "literal", "datatype": obj["datatype"]}
+    if obj["datatype"] == pyld.jsonld.RDF_LANGSTRING:
+        # A language string without language is written as a plain literal
+        if obj.get("language"):
+            triple["object"]["language"] = obj["language"]
+        else:
+            triple["object"]["datatype"] = pyld.jsonld.XSD_STRING
+    triple["object"]["value"] = obj["value"]
+    return triple
+
+
+def canonicalDataset(jdoc, options={}):
+    """
+    The URDNA2015 canonical RDF dataset of a JSON-LD document.
+
+    Same as parsing the N-Quads output of pyld.jsonld.normalize, without
+    serializing the quads to text and parsing them again. Duplicate quads
+    are dropped and the triples of each graph are in N-Quads order.
+
+    Returns:
+        dict: graph name, "@default" for the default graph, to list of triples
+    """
+    opts = {"base": sonormal.DEFAULT_BASE}
+    opts.update(options)
+    opts.pop("format", None)
+    opts["algorithm"] = "URDNA2015"
+    opts["produceGeneralizedRdf"] = False
+    try:
+        dataset = pyld.jsonld.to_rdf(jdoc, options=opts)
+    except pyld.jsonld.JsonLdError as cause:
+        raise pyld.jsonld.JsonLdError(
+            "Could not convert input to RDF dataset before normalization.",
+            "jsonld.NormalizeError",
+            cause=cause,
+        )
+    canon = pyld.jsonld.URDNA2015()
+    # Replaces blank node identifiers of the quads with canonical ones
+    canon.main(dataset, {"format": sonormal.MEDIA_NQUADS})
+    quads = {}
+    for quad in canon.quads:
+        quads.setdefault(pyld.jsonld.JsonLdProcessor.to_nquad(quad), quad)
+    result = {}
+    for nquad in sorted(quads):
+        quad = quads[nquad]
+        name = quad["name"]["value"] if "name" in quad else "@default"
+        result.setdefault(name, []).append(_canonicalTriple(quad))
+    return result
+
+
 def normalizeJsonld(jdoc, options={}):
     """
     Normalize a JSON-LD document structure.
+
+    The URDNA2015 canonical dataset is converted to JSON-LD directly, see
+    canonicalDataset.
     """
     opts = {
         "algorithm": "URDNA2015",
@@ -191,7 +544,11 @@ def normalizeJsonld(jdoc, options={}):
         "format": sonormal.MEDIA_NQUADS,
     }
     opts.update(options)
-    _rdf = pyld.jsonld.normalize(jdoc, options=opts)
+    if opts["algorithm"] != "URDNA2015":
+        _rdf = pyld.jsonld.normalize(jdoc, options=opts)
+        return pyld.jsonld.from_rdf(_rdf, options=opts)
+    _rdf = canonicalDataset(jdoc, options=opts)
+    opts.pop("format", None)
     return pyld.jsonld.from_rdf(_rdf, options=opts)
 
 
@@ -211,3 +568,115 @@ def jsonldToNquads(jdoc, options={}):
 def canonicalizeJson(jdoc):
     b = c14n.canonicalize(jdoc)
     return b.decode()
+
+
+# Worker processes for normalizeMany, None for the number of CPUs
+NORMALIZE_WORKERS = settings.get("NORMALIZE_WORKERS", None)
+
+# Documents normalized by a worker process before it is replaced, to bound
+# the memory a long running worker can accumulate
+NORMALIZE_WORKER_MAX_TASKS = settings.get("NORMALIZE_WORKER_MAX_TASKS", 200)
+
+# Workers are spawned rather than forked, forking copies the open document
+# cache database connection and the threads of the parent
+NORMALIZE_START_METHOD = settings.get("NORMALIZE_START_METHOD", "spawn")
+
+# Outputs of normalizeMany
+NORMALIZE_OUTPUTS = ("json", "canon", "nquads")
+
+# True once the process has prepared the contexts for normalizeMany
+_WORKER_PREPARED = False
+
+
+def _initNormalizeWorker():
+    # Prepare the schema.org contexts and the shared active contexts once per
+    # worker, processed contexts are then reused for every document. Errors
+    # are logged, raising here would make the pool restart the worker forever.
+    global _WORKER_PREPARED
+    try:
+        sonormal.prepareSchemaOrgLocalContexts()
+    except Exception as e:
+        __L.error("Unable to prepare schema.org contexts: %s", e)
+    sonormal.ACTIVE_CONTEXTS.documentLoader("so")
+    _WORKER_PREPARED = True
+
+
+def _normalizeTask(task):
+    jdoc, options, output = task
+    opts = sonormal.ACTIVE_CONTEXTS.options("so", options)
+    try:
+        if output == "nquads":
+            return jsonldToNquads(jdoc, options=opts)
+        ndoc = normalizeJsonld(jdoc, options=opts)
+        if output == "canon":
+            return canonicalizeJson(ndoc)
+        return ndoc
+    except Exception as e:
+        # pyld exceptions can not be pickled to return them from a worker
+        __L.debug("Normalization failed: %s", e)
+        return ValueError(f"{type(e).__name__}: {e}")
+
+
+def normalizeMany(
+    jdocs,
+    options={},
+    output="json",
+    workers=NORMALIZE_WORKERS,
+    max_tasks=NORMALIZE_WORKER_MAX_TASKS,
+):
+    """
+    Normalize many JSON-LD documents with URDNA2015 in a pool of processes.
+
+    Results are yielded in the order of jdocs as they become available.
+    Only a few documents per worker are in flight at a time, so jdocs can
+    be a generator over a large input such as
+    sonormal.stream.GraphReader.documents().
+
+    Each worker prepares the schema.org contexts once and normalizes with
+    the shared processed contexts of sonormal.ACTIVE_CONTEXTS, so the
+    schema.org context is processed once per worker rather than per
+    document. A documentLoader or contextResolver in options can not be
+    passed to the workers and is ignored. Workers are replaced after
+    max_tasks documents.
+
+    Args:
+        jdocs: iterable of JSON-LD documents
+        options (dict): pyld options, as for normalizeJsonld
+        output (string): "json" for the normalizeJsonld result, "canon" for
+            its canonical JSON string, "nquads" for the jsonldToNquads result
+        workers (int): number of processes, None for the number of CPUs.
+            1 normalizes in this process.
+        max_tasks (int): documents normalized by a worker before it is replaced
+
+    Returns:
+        iterator of results, with a ValueError instance describing the failure
+        for documents that could not be normalized
+    """
+    if output not in NORMALIZE_OUTPUTS:
+        raise ValueError(f"Unknown output {output}, expected one of {NORMALIZE_OUTPUTS}")
+    opts = {
+        k: v
+        for k, v in options.items()
+        if k not in ("documentLoader", "contextResolver")
+    }
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        if not _WORKER_PREPARED:
+            _initNormalizeWorker()
+        for jdoc in jdocs:
+            yield _normalizeTask((jdoc, opts, output))
+        return
+    mp = multiprocessing.get_context(NORMALIZE_START_METHOD)
+    with mp.Pool(
+        processes=workers,
+        initializer=_initNormalizeWorker,
+        maxtasksperchild=max_tasks,
+    ) as pool:
+        pending = collections.deque()
+        for jdoc in jdocs:
+            pending.append(pool.apply_async(_normalizeTask, ((jdoc, opts, output),)))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
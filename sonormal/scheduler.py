@@ -0,0 +1,444 @@
+"""
+Per-host politeness for concurrent retrieval.
+
+The HostScheduler limits the number of concurrent requests and the rate of
+requests to each host, honours Retry-After responses and robots.txt
+Crawl-delay, and hands out work across hosts so that a slow host does not
+hold up the rest of a harvest.
+"""
+import time
+import logging
+import threading
+import collections
+import email.utils
+import urllib.parse
+import urllib.robotparser
+import requests
+import sonormal
+from sonormal.config import settings
+
+# Max number of concurrent requests to a single host
+HOST_MAX_CONCURRENCY = settings.get("HOST_MAX_CONCURRENCY", 2)
+
+# Max number of requests per second to a single host
+HOST_REQUESTS_PER_SECOND = settings.get("HOST_REQUESTS_PER_SECOND", 2.0)
+
+# How long to keep a robots.txt before fetching again
+ROBOTS_CACHE_TIMEOUT = settings.get("ROBOTS_CACHE_TIMEOUT", 24 * 3600)  # seconds
+
+# Timeout for retrieving robots.txt
+ROBOTS_REQUEST_TIMEOUT = 10  # seconds
+
+# Upper bound on a server requested Retry-After delay
+MAX_RETRY_AFTER = 300  # seconds
+
+# Response status codes where Retry-After is honoured
+RETRY_STATUS_CODES = (429, 503)
+
+
+def hostKey(url):
+    """scheme://host[:port] of url, used to group requests by host"""
+    pieces = urllib.parse.urlparse(url)
+    return f"{pieces.scheme}://{pieces.netloc}".lower()
+
+
+def parseRetryAfter(value, now=None):
+    """
+    Seconds to wait from a Retry-After header value.
+
+    Args:
+        value (string): delay in seconds or a HTTP date
+        now (float): current time, default time.time()
+
+    Returns:
+        float: seconds to wait, None if value can not be parsed
+    """
+    if value is None:
+        return None
+    if now is None:
+        now = time.time()
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt is None:
+        return None
+    return max(0.0, dt.timestamp() - now)
+
+
+class _HostState:
+    def __init__(self):
+        self.active = 0
+        self.waiting = 0
+        self.pending = collections.deque()
+        self.next_allowed = 0.0
+        self.blocked_until = 0.0
+        self.requests = 0
+        self.retry_after = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.robots = None
+        self.robots_time = 0.0
+        self.robots_lock = threading.Lock()
+
+
+class HostScheduler:
+    """
+    Enforces per-host concurrency and request rate limits.
+
+    Requests are spaced at least 1/requests_per_second apart for each host,
+    or the robots.txt Crawl-delay when that is longer. A 429 or 503
+    response with Retry-After blocks the host for the requested time.
+
+    acquire() and release() are reentrant for a thread, so a worker holding
+    a host slot from map() can make further requests to the same host. A
+    thread acquiring a slot for another host, such as a loader retrieving a
+    remote context, gives up the slots it holds until it releases the new
+    one, so two threads waiting on each other's hosts can not deadlock.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=HOST_MAX_CONCURRENCY,
+        requests_per_second=HOST_REQUESTS_PER_SECOND,
+        use_robots=True,
+        user_agent="*",
+    ):
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+        self.use_robots = use_robots
+        self.user_agent = user_agent
+        self._hosts = {}
+        self._rotation = collections.deque()
+        self._n_pending = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    def _host(self, key):
+        hs = self._hosts.get(key, None)
+        if hs is None:
+            hs = _HostState()
+            self._hosts[key] = hs
+        return hs
+
+    def _held(self):
+        if not hasattr(self._local, "held"):
+            self._local.held = collections.Counter()
+        return self._local.held
+
+    def _suspended(self):
+        # Stack of (key, slots held when key was acquired) for the thread
+        if not hasattr(self._local, "suspended"):
+            self._local.suspended = []
+        return self._local.suspended
+
+    def _suspend(self, key, held):
+        # Give up the slots held by the thread while it acquires key
+        slots = dict(held)
+        for k in slots:
+            self._hosts[k].active -= 1
+        held.clear()
+        self._suspended().append((key, slots))
+        self._cond.notify_all()
+
+    def _resume(self, key, held):
+        # Take back the slots given up when key was acquired, the thread
+        # holds no slots while waiting for them
+        suspended = self._suspended()
+        if len(suspended) == 0 or suspended[-1][0] != key:
+            return
+        _, slots = suspended.pop()
+        while any(self._hosts[k].active >= self.max_concurrency for k in slots):
+            self._cond.wait()
+        for k, n in slots.items():
+            self._hosts[k].active += 1
+            held[k] = n
+
+    def crawlDelay(self, key):
+        """
+        Crawl-delay from the robots.txt of a host, None if not set.
+
+        robots.txt is retrieved once per ROBOTS_CACHE_TIMEOUT for each host.
+        """
+        if not self.use_robots:
+            return None
+        with self._cond:
+            hs = self._host(key)
+        with hs.robots_lock:
+            if hs.robots is None or time.time() - hs.robots_time > ROBOTS_CACHE_TIMEOUT:
+                hs.robots = self._loadRobots(key)
+                hs.robots_time = time.time()
+        try:
+            return hs.robots.crawl_delay(self.user_agent)
+        except Exception:
+            return None
+
+    def _loadRobots(self, key):
+        L = logging.getLogger("sonormal.scheduler")
+        robots = urllib.robotparser.RobotFileParser()
+        url = f"{key}/robots.txt"
+        try:
+            with sonormal.SESSION_POOL.borrow(url) as sess:
+                response = sess.get(url, timeout=ROBOTS_REQUEST_TIMEOUT)
+                if response.status_code == requests.codes.OK:
+                    robots.parse(response.text.splitlines())
+                else:
+                    robots.parse([])
+        except Exception as e:
+            L.warning("Unable to retrieve %s: %s", url, e)
+            robots.parse([])
+        return robots
+
+    def _interval(self, key):
+        interval = 0.0
+        if self.requests_per_second:
+            interval = 1.0 / self.requests_per_second
+        delay = self.crawlDelay(key)
+        if delay is not None:
+            interval = max(interval, float(delay))
+        return interval
+
+    def acquire(self, url):
+        """
+        Block until a request to the host of url is permitted.
+
+        Returns:
+            float: seconds waited
+        """
+        key = hostKey(url)
+        interval = self._interval(key)
+        held = self._held()
+        t0 = time.time()
+        with self._cond:
+            hs = self._host(key)
+            if held[key] == 0 and len(held) > 0:
+                self._suspend(key, held)
+            hs.waiting += 1
+            while True:
+                now = time.time()
+                ready_at = max(hs.next_allowed, hs.blocked_until)
+                has_slot = held[key] > 0 or hs.active < self.max_concurrency
+                if has_slot and now >= ready_at:
+                    break
+                timeout = None
+                if now < ready_at:
+                    timeout = ready_at - now
+                self._cond.wait(timeout=timeout)
+            hs.waiting -= 1
+            if held[key] == 0:
+                hs.active += 1
+            held[key] += 1
+            hs.next_allowed = now + interval
+            hs.requests += 1
+            waited = now - t0
+            hs.total_wait += waited
+            hs.max_wait = max(hs.max_wait, waited)
+        return waited
+
+    def release(self, url):
+        """Release a slot obtained with acquire()"""
+        key = hostKey(url)
+        held = self._held()
+        with self._cond:
+            held[key] -= 1
+            if held[key] <= 0:
+                del held[key]
+                self._host(key).active -= 1
+                self._cond.notify_all()
+                self._resume(key, held)
+            self._cond.notify_all()
+
+    def observe(self, url, response):
+        """
+        Update host state from a response, honouring Retry-After.
+
+        Returns:
+            float: seconds the host is blocked for, None if not blocked
+        """
+        status = getattr(response, "status_code", None)
+        if status not in RETRY_STATUS_CODES:
+            return None
+        delay = parseRetryAfter(response.headers.get("Retry-After", None))
+        if delay is None:
+            return None
+        delay = min(delay, MAX_RETRY_AFTER)
+        L = logging.getLogger("sonormal.scheduler")
+        L.warning("%s responded %s, waiting %.1f seconds", url, status, delay)
+        key = hostKey(url)
+        with self._cond:
+            hs = self._host(key)
+            hs.retry_after += 1
+            hs.blocked_until = max(hs.blocked_until, time.time() + delay)
+            self._cond.notify_all()
+        return delay
+
+    def _nextItem(self):
+        # Next pending item from a host that can take a request, rotating
+        # across hosts. Blocks until one is available, None when done.
+        held = self._held()
+        with self._cond:
+            while True:
+                if self._n_pending == 0:
+                    return None
+                now = time.time()
+                earliest = None
+                for _ in range(len(self._rotation)):
+                    key = self._rotation[0]
+                    self._rotation.rotate(-1)
+                    hs = self._hosts[key]
+                    if len(hs.pending) == 0:
+                        continue
+                    ready_at = max(hs.next_allowed, hs.blocked_until)
+                    if hs.active < self.max_concurrency and now >= ready_at:
+                        item = hs.pending.popleft()
+                        self._n_pending -= 1
+                        hs.active += 1
+                        held[key] += 1
+                        return key, item
+                    if ready_at > now and (earliest is None or ready_at < earliest):
+                        earliest = ready_at
+                timeout = None
+                if earliest is not None:
+                    timeout = earliest - now
+                self._cond.wait(timeout=timeout)
+
+    def map(self, func, urls, workers=4):
+        """
+        Apply func to each url using a pool of worker threads.
+
+        Work is interleaved across hosts and a worker holds a slot for the
+        host of the url while func runs. Results are yielded as they
+        complete.
+
+        If func raises, urls not yet started are dropped and the exception
+        is raised once the calls already running have finished. The same
+        happens when the generator is closed before it is exhausted, so no
+        work continues in the background. Callers needing a result for
+        every url should handle errors in func.
+
+        Args:
+            func: callable taking a url
+            urls: iterable of URLs
+            workers (int): number of worker threads
+
+        Returns:
+            generator of func results
+        """
+        results = collections.deque()
+        done = threading.Condition()
+        # Identifies the pending items of this call
+        token = object()
+        with self._cond:
+            for url in urls:
+                key = hostKey(url)
+                hs = self._host(key)
+                if key not in self._rotation:
+                    self._rotation.append(key)
+                hs.pending.append((token, url))
+                self._n_pending += 1
+
+        def worker():
+            while True:
+                nxt = self._nextItem()
+                if nxt is None:
+                    break
+                key, (_, url) = nxt
+                try:
+                    res = func(url)
+                except Exception as e:
+                    res = e
+                finally:
+                    self.release(url)
+                with done:
+                    results.append(res)
+                    done.notify()
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                with done:
+                    while len(results) == 0 and any(t.is_alive() for t in threads):
+                        done.wait(timeout=1.0)
+                    if len(results) == 0:
+                        break
+                    res = results.popleft()
+                if isinstance(res, Exception):
+                    raise res
+                yield res
+        finally:
+            self._cancel(token)
+            for t in threads:
+                t.join()
+
+    def _cancel(self, token):
+        # Drop the pending items of a map() call
+        with self._cond:
+            for hs in self._hosts.values():
+                keep = collections.deque(i for i in hs.pending if i[0] is not token)
+                self._n_pending -= len(hs.pending) - len(keep)
+                hs.pending = keep
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        Per host scheduling metrics.
+
+        Returns:
+            dict: {host: {queued, active, requests, retry_after, total_wait, max_wait, mean_wait}}
+        """
+        with self._cond:
+            res = {}
+            for key, hs in self._hosts.items():
+                res[key] = {
+                    "queued": len(hs.pending) + hs.waiting,
+                    "active": hs.active,
+                    "requests": hs.requests,
+                    "retry_after": hs.retry_after,
+                    "total_wait": hs.total_wait,
+                    "max_wait": hs.max_wait,
+                    "mean_wait": hs.total_wait / hs.requests if hs.requests else 0.0,
+                }
+            return res
+
+
+def politeDocumentLoader(loader, scheduler, max_retries=1):
+    """
+    Wrap a pyld document loader so requests go through a HostScheduler.
+
+    A response with status 429 or 503 and a Retry-After header is retried
+    up to max_retries times after the requested delay. The scheduler is
+    passed to loader in the "scheduler" option, so a loader from
+    requests_document_loader_history also schedules the request to a Link
+    header alternate.
+
+    Args:
+        loader: document loader, e.g. requests_document_loader_history()
+        scheduler (HostScheduler): the scheduler
+        max_retries (int): retries after a Retry-After response
+
+    Returns:
+        the document loader function
+    """
+
+    def politeLoader(url, options={}):
+        attempt = 0
+        options = dict(options, scheduler=scheduler)
+        while True:
+            scheduler.acquire(url)
+            try:
+                res = loader(url, options)
+            finally:
+                scheduler.release(url)
+            delay = scheduler.observe(url, res.get("response", None))
+            if delay is None or attempt >= max_retries:
+                return res
+            attempt += 1
+
+    return politeLoader
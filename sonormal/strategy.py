@@ -0,0 +1,143 @@
+"""
+Per-host memory of how JSON-LD was obtained.
+
+Many repositories serve every landing page the same way: either the
+JSON-LD is in the page source, or the page needs to be rendered in a
+browser. FetchStrategies records which method worked for a host so later
+requests can go straight to it, with a periodic full probe in case the
+site changes.
+"""
+import time
+import logging
+import threading
+import requests
+import sonormal
+import sonormal.scheduler
+from sonormal.config import settings
+
+# A recorded strategy is trusted for this long, then the host is probed again
+STRATEGY_REPROBE_INTERVAL = settings.get(
+    "STRATEGY_REPROBE_INTERVAL", 24 * 3600
+)  # seconds
+
+# Prefix of strategy keys in the store
+STRATEGY_KEY_PREFIX = "fetch-strategy:"
+
+# Fetch methods
+METHOD_PLAIN = "plain"
+METHOD_RENDER = "render"
+
+
+def usedLinkAlternate(url, response_doc):
+    """
+    True if response_doc was retrieved from a Link header alternate of url.
+
+    The response chain of a document from an alternate starts at the
+    alternate location rather than at url.
+    """
+    response = response_doc.get("response", None)
+    if response is None:
+        return False
+    try:
+        prepared = requests.models.PreparedRequest()
+        prepared.prepare_url(url, None)
+        requested = prepared.url
+    except Exception:
+        requested = url
+    chain = [getattr(r, "url", None) for r in getattr(response, "history", [])]
+    chain.append(getattr(response, "url", None))
+    request = getattr(response, "request", None)
+    if request is not None:
+        chain.append(getattr(request, "url", None))
+    return requested not in chain and url not in chain
+
+
+class FetchStrategies:
+    """
+    Records the fetch method that produced JSON-LD for each host.
+
+    A record is a dict with:
+        method: "plain" or "render"
+        accept: Accept header of the successful plain request
+        alternate: True if JSON-LD came from a Link header alternate
+        probed: time of the last full probe
+        uses: number of fetches using the record since the last probe
+
+    Records are kept in store, a dict or a diskcache.Cache, so they persist
+    across runs when the store does.
+    """
+
+    def __init__(self, store=None, reprobe_interval=STRATEGY_REPROBE_INTERVAL):
+        if store is None:
+            store = {}
+        self.store = store
+        self.reprobe_interval = reprobe_interval
+        self._lock = threading.Lock()
+
+    def key(self, url):
+        """Key for the strategy record of url, per host"""
+        return STRATEGY_KEY_PREFIX + sonormal.scheduler.hostKey(url)
+
+    def get(self, url):
+        """The strategy record for the host of url, None if not known"""
+        try:
+            return self.store.get(self.key(url), None)
+        except Exception as e:
+            L = logging.getLogger("sonormal.strategy")
+            L.warning("Unable to read fetch strategy for %s: %s", url, e)
+            return None
+
+    def needsProbe(self, record):
+        """True if record is missing or old enough that the host should be probed"""
+        if record is None:
+            return True
+        return time.time() - record.get("probed", 0) > self.reprobe_interval
+
+    def record(self, url, method, accept=None, alternate=False, probed=True):
+        """
+        Record that method produced JSON-LD for the host of url.
+
+        Args:
+            url: the retrieved URL
+            method: METHOD_PLAIN or METHOD_RENDER
+            accept: Accept header used
+            alternate: JSON-LD came from a Link header alternate
+            probed: the method was chosen by a full probe, not from the record
+        """
+        with self._lock:
+            previous = self.get(url)
+            rec = {
+                "method": method,
+                "accept": accept,
+                "alternate": alternate,
+                "probed": time.time(),
+                "uses": 0,
+            }
+            if not probed and previous is not None:
+                rec["probed"] = previous.get("probed", rec["probed"])
+                rec["uses"] = previous.get("uses", 0) + 1
+            self._set(url, rec)
+        return rec
+
+    def forget(self, url):
+        """Remove the strategy record for the host of url"""
+        with self._lock:
+            try:
+                self.store.pop(self.key(url), None)
+            except Exception as e:
+                L = logging.getLogger("sonormal.strategy")
+                L.warning("Unable to remove fetch strategy for %s: %s", url, e)
+
+    def _set(self, url, rec):
+        try:
+            if isinstance(self.store, dict):
+                self.store[self.key(url)] = rec
+            else:
+                self.store.set(self.key(url), rec, expire=self.reprobe_interval * 7)
+        except Exception as e:
+            L = logging.getLogger("sonormal.strategy")
+            L.warning("Unable to save fetch strategy for %s: %s", url, e)
+
+
+# Strategies shared by the process, persisted with the document cache
+FETCH_STRATEGIES = FetchStrategies(sonormal.DOCUMENT_CACHE)
@@ -0,0 +1,249 @@
+"""
+Incremental reading of JSON-LD documents with a large @graph.
+
+Catalogue documents can hold tens of thousands of nodes in a single
+@graph. GraphReader parses the document a piece at a time and yields a
+small JSON-LD document for each top level node of the @graph, carrying
+the shared @context, so each node can be expanded, normalized or framed
+on its own while memory stays bounded by the size of the largest node.
+"""
+import re
+import json
+import logging
+from sonormal.config import settings
+
+# Characters read from the source at a time
+GRAPH_READ_SIZE = settings.get("GRAPH_READ_SIZE", 64 * 1024)
+
+_WS = re.compile(r"[ \t\n\r]*")
+
+
+def nodeDocument(node, context=None):
+    """
+    JSON-LD document for a single @graph node.
+
+    Args:
+        node (dict): a top level node of @graph
+        context: the @context of the document containing the graph
+
+    Returns:
+        dict: JSON-LD document with the node as its only graph entry
+    """
+    if context is None:
+        return {"@graph": [node]}
+    return {"@context": context, "@graph": [node]}
+
+
+def splitGraph(doc):
+    """
+    Yield a JSON-LD document for each top level node of an already parsed doc.
+
+    Same output as GraphReader.documents for a document in memory, such as
+    one retrieved from a URL.
+    """
+    if isinstance(doc, list):
+        yield from doc
+        return
+    graph = doc.get("@graph", None)
+    if not isinstance(graph, list):
+        yield doc
+        return
+    context = doc.get("@context", None)
+    for node in graph:
+        yield nodeDocument(node, context)
+    rest = {k: v for k, v in doc.items() if k not in ("@context", "@graph")}
+    if rest:
+        if context is not None:
+            rest["@context"] = context
+        yield rest
+
+
+class GraphReader:
+    """
+    Reads the top level nodes of a JSON-LD document one at a time.
+
+    The document is read from fp in pieces of read_size characters and each
+    value is decoded once complete, so only the current node is held in
+    memory. A top level array yields each of its entries, an object without
+    @graph yields the object.
+
+    The @context is shared by the nodes of @graph. When the source reaches
+    @graph before any @context and fp can seek, the rest of the document
+    is first read to find a @context that follows, then the nodes are read
+    again and yielded as they are decoded. When fp can not seek, nodes are
+    held until the end of the document since they can not be interpreted
+    before the @context is known. n_held is the number of nodes held.
+
+    Other properties of an object with @graph make it a named graph. These
+    are yielded as a document of their own after the nodes, and the nodes
+    are treated as part of the default graph.
+
+    Example:
+        with open("catalog.jsonld") as fp:
+            for doc in GraphReader(fp).documents():
+                print(pyld.jsonld.expand(doc))
+    """
+
+    def __init__(self, fp, read_size=GRAPH_READ_SIZE):
+        self.fp = fp
+        self.read_size = read_size
+        # @context and other properties of the top level object, once read
+        self.context = None
+        self.properties = {}
+        self.n_nodes = 0
+        self.n_held = 0
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self):
+        # Append the next piece of the source to the buffer, False at EOF.
+        # The piece is at least as long as the pending text, so decoding a
+        # value larger than read_size is retried a logarithmic number of times.
+        if self._eof:
+            return False
+        if self._pos > self.read_size:
+            self._buf = self._buf[self._pos :]
+            self._pos = 0
+        data = self.fp.read(max(self.read_size, len(self._buf) - self._pos))
+        if not data:
+            self._eof = True
+            return False
+        self._buf += data
+        return True
+
+    def _mark(self):
+        # State for reading again from the current position, None if fp
+        # can not seek
+        try:
+            if not self.fp.seekable():
+                return None
+            return (self.fp.tell(), self._buf[self._pos :], self._eof)
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def _reset(self, mark):
+        tell, buf, eof = mark
+        self.fp.seek(tell)
+        self._buf = buf
+        self._pos = 0
+        self._eof = eof
+
+    def _findContext(self):
+        # Read the rest of the top level object from the start of @graph,
+        # True if it has a @context, which is then set. Values are decoded
+        # one at a time and not kept.
+        for _ in self._array():
+            pass
+        while self._expect(",}") == ",":
+            key = self._value()
+            self._expect(":")
+            value = self._value()
+            if key == "@context":
+                self.context = value
+                return True
+        return False
+
+    def _peek(self):
+        # Next non-whitespace character, "" at EOF
+        while True:
+            self._pos = _WS.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf) or not self._fill():
+                return self._buf[self._pos : self._pos + 1]
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c == "" or c not in chars:
+            raise ValueError(
+                f"Expected one of {chars!r} at offset {self._pos} but found {c!r}"
+            )
+        self._pos += 1
+        return c
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next piece
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _array(self):
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._expect(",]") == "]":
+                return
+
+    def documents(self):
+        """
+        Yield a JSON-LD document for each top level node.
+
+        Each node of @graph is yielded as a document with the @context of
+        the source, see nodeDocument. Output is the same as splitGraph on
+        the parsed document.
+        """
+        if self._expect("{[") == "[":
+            for doc in self._array():
+                self.n_nodes += 1
+                yield doc
+            return
+        has_graph = False
+        pending = []
+        if self._peek() == "}":
+            self._pos += 1
+        else:
+            while True:
+                key = self._value()
+                if not isinstance(key, str):
+                    raise ValueError(f"Expected a property name at offset {self._pos}")
+                self._expect(":")
+                if key == "@graph" and self._peek() == "[":
+                    self._pos += 1
+                    has_graph = True
+                    known = "@context" in self.properties
+                    if not known:
+                        mark = self._mark()
+                        if mark is not None:
+                            self._findContext()
+                            self._reset(mark)
+                            known = True
+                    for node in self._array():
+                        self.n_nodes += 1
+                        if known:
+                            yield nodeDocument(node, self.context)
+                        else:
+                            self.n_held += 1
+                            pending.append(node)
+                else:
+                    self.properties[key] = self._value()
+                    if key == "@context":
+                        self.context = self.properties[key]
+                if self._expect(",}") == "}":
+                    break
+        if self._peek() != "":
+            raise ValueError(f"Extra data at offset {self._pos}")
+        if pending:
+            L = logging.getLogger("sonormal.stream")
+            L.debug("Held %s nodes until the end of the document", len(pending))
+        for node in pending:
+            yield nodeDocument(node, self.context)
+        if not has_graph:
+            self.n_nodes += 1
+            yield self.properties
+            return
+        rest = {k: v for k, v in self.properties.items() if k != "@context"}
+        if rest:
+            if self.context is not None:
+                rest["@context"] = self.context
+            yield rest
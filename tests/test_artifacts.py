@@ -0,0 +1,98 @@
+import pytest
+import sonormal.artifacts
+import sonormal.normalize
+
+_DOC = {
+    "@context": {"@vocab": "https://example.net/test/"},
+    "@id": "https://example.net/a",
+    "name": "test",
+    "part": {"name": "blank"},
+}
+
+
+@pytest.fixture
+def artifact_cache(tmp_path):
+    cache = sonormal.artifacts.ArtifactCache(str(tmp_path))
+    yield cache
+    cache.close()
+
+
+def test_normalized(artifact_cache, monkeypatch):
+    calls = []
+    normalizeJsonld = sonormal.normalize.normalizeJsonld
+
+    def counting(jdoc, options={}):
+        calls.append(jdoc)
+        return normalizeJsonld(jdoc, options=options)
+
+    monkeypatch.setattr(sonormal.normalize, "normalizeJsonld", counting)
+    expected = normalizeJsonld(_DOC)
+    for i in range(3):
+        res = sonormal.artifacts.normalized(_DOC, cache=artifact_cache)
+        assert res == expected
+    assert len(calls) == 1
+    # Key order of the source does not matter, options do
+    reordered = dict(reversed(list(_DOC.items())))
+    sonormal.artifacts.normalized(reordered, cache=artifact_cache)
+    assert len(calls) == 1
+    sonormal.artifacts.normalized(
+        _DOC, options={"base": "https://example.org/"}, cache=artifact_cache
+    )
+    assert len(calls) == 2
+    assert artifact_cache.stats["hits"] == 3
+    assert artifact_cache.stats["misses"] == 2
+
+
+def test_eviction(tmp_path):
+    cache = sonormal.artifacts.ArtifactCache(str(tmp_path), size_limit=200000)
+    for i in range(100):
+        cache.get("test", {"n": i}, {}, lambda d, o: "x" * 20000)
+    assert cache.cache.volume() < 400000
+    assert len(cache.cache) < 100
+    # Recently used entries are kept
+    assert cache.cache.get(cache.key("test", {"n": 99})) is not None
+    cache.close()
+
+
+def test_loaderOptions(artifact_cache):
+    calls = []
+
+    def loader(url, options={}):
+        calls.append(url)
+        return {
+            "contextUrl": None,
+            "documentUrl": url,
+            "document": {"@context": {"@vocab": "https://example.net/other/"}},
+        }
+
+    doc = dict(_DOC, **{"@context": "https://example.net/context"})
+    options = {"documentLoader": loader}
+    # Results with an unidentified loader are not cached
+    for i in range(2):
+        res = sonormal.artifacts.expanded(doc, options, cache=artifact_cache)
+        assert "https://example.net/other/name" in res[0]
+    assert len(calls) == 2
+    assert artifact_cache.stats["uncacheable"] == 2
+    # The loader identity is part of the key
+    for i in range(2):
+        sonormal.artifacts.expanded(doc, options, cache=artifact_cache, loader_id="a")
+    assert len(calls) == 3
+    sonormal.artifacts.expanded(doc, options, cache=artifact_cache, loader_id="b")
+    assert len(calls) == 4
+    assert artifact_cache.stats["hits"] == 1
+
+
+def test_remoteContextExpiry(artifact_cache, monkeypatch):
+    assert sonormal.artifacts.remoteContexts(_DOC) == set()
+    doc = {
+        "@context": ["https://schema.org/", "https://example.net/context"],
+        "part": {"@context": {"@vocab": "https://example.net/"}, "n": 1},
+    }
+    assert sonormal.artifacts.remoteContexts(doc) == {"https://example.net/context"}
+    monkeypatch.setattr(sonormal.artifacts, "ARTIFACT_REMOTE_CONTEXT_TIMEOUT", 60)
+    artifact_cache.get("test", _DOC, {}, lambda d, o: "local")
+    artifact_cache.get("test", doc, {}, lambda d, o: "remote")
+    _, expire = artifact_cache.cache.get(artifact_cache.key("test", _DOC), expire_time=True)
+    assert expire is None
+    _, expire = artifact_cache.cache.get(artifact_cache.key("test", doc), expire_time=True)
+    assert expire is not None
@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import pytest
 import tempfile
@@ -149,3 +150,22 @@ def test_jsonldCompareJSON(a, b):
     chk_a, _ = sonormal.checksums.computeChecksumsBytes(a_bytes)
     chk_b, _ = sonormal.checksums.computeChecksumsBytes(b_bytes)
     assert chk_a["sha256"] == chk_b["sha256"]
+
+
+@pytest.mark.parametrize("size", [0, 10, 65536 * 3 + 7])
+@pytest.mark.parametrize("threaded", [False, True])
+def test_computeHashes(size, threaded, monkeypatch):
+    if threaded:
+        monkeypatch.setattr(sonormal.checksums, "HASH_THREAD_MIN_SIZE", 1)
+    data = bytes(i % 251 for i in range(size))
+    res = sonormal.checksums.computeHashes(bytearray(data), sonormal.checksums.HASH_ALGORITHMS)
+    assert list(res.keys()) == list(sonormal.checksums.HASH_ALGORITHMS)
+    for algorithm, digest in res.items():
+        assert digest == hashlib.new(algorithm, data).hexdigest()
+    hashes, b = sonormal.checksums.computeChecksumsBytes(data, sha1=False)
+    assert hashes == {"sha256": res["sha256"], "sha1": None, "md5": res["md5"]}
+    assert b is data
+    hashes, _ = sonormal.checksums.computeChecksumsBytes(data, algorithms=["blake2b"])
+    assert hashes == {"blake2b": res["blake2b"]}
+    with pytest.raises(ValueError):
+        sonormal.checksums.computeHashes(data, ["sha3_256"])
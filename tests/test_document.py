@@ -0,0 +1,140 @@
+import pytest
+import pyld.jsonld
+import sonormal.artifacts
+import sonormal.checksums
+import sonormal.document
+import sonormal.normalize
+
+_DOC = {
+    "@context": {"@vocab": "http://schema.org/"},
+    "@id": "https://example.net/dataset",
+    "@type": "Dataset",
+    "identifier": "doi:10.1234/test",
+    "name": "test",
+}
+
+
+def test_document(tmp_path, monkeypatch):
+    calls = []
+    normalizeJsonld = sonormal.normalize.normalizeJsonld
+
+    def counting(jdoc, options={}):
+        calls.append(jdoc)
+        return normalizeJsonld(jdoc, options=options)
+
+    monkeypatch.setattr(sonormal.normalize, "normalizeJsonld", counting)
+    cache = sonormal.artifacts.ArtifactCache(str(tmp_path))
+    jdoc = sonormal.document.Document(_DOC, cache=cache)
+    checksums, doc_bytes = sonormal.checksums.jsonChecksums(_DOC)
+    assert jdoc.checksums == checksums
+    assert jdoc.canonical_bytes == doc_bytes
+    checksums, doc_bytes = sonormal.checksums.jsonChecksums(_DOC, canonicalize=False)
+    assert jdoc.source_checksums == checksums
+    assert jdoc.identifiers[0]["identifier"] == ["doi:10.1234/test"]
+    assert jdoc.normalized is jdoc.normalized
+    assert len(calls) == 1
+    # A new object for the same document uses the artifact cache
+    jdoc = sonormal.document.Document(_DOC, cache=cache)
+    assert jdoc.identifiers[0]["@id"] == ["https://example.net/dataset"]
+    assert len(calls) == 1
+    cache.close()
+
+
+def test_identifiersNotCanonicalized(tmp_path, monkeypatch):
+    def canonicalize(jdoc):
+        raise AssertionError("canonicalized")
+
+    monkeypatch.setattr(sonormal.checksums.c14n, "canonicalize", canonicalize)
+    monkeypatch.setattr(sonormal.artifacts.c14n, "canonicalize", canonicalize)
+    cache = sonormal.artifacts.ArtifactCache(str(tmp_path))
+    jdoc = sonormal.document.Document(_DOC, cache=cache)
+    assert jdoc.identifiers[0]["identifier"] == ["doi:10.1234/test"]
+    cache.close()
+
+
+def test_documentHashes(monkeypatch):
+    checksums, _ = sonormal.checksums.jsonChecksums(_DOC)
+    computed = []
+    computeHashes = sonormal.checksums.computeHashes
+
+    def counting(b, algorithms):
+        computed.append(list(algorithms))
+        return computeHashes(b, algorithms)
+
+    monkeypatch.setattr(sonormal.checksums, "computeHashes", counting)
+    jdoc = sonormal.document.Document(_DOC)
+    assert jdoc.digest == jdoc.hashes(("sha256",))["sha256"]
+    assert computed == [["sha256"]]
+    assert jdoc.checksums == checksums
+    assert computed == [["sha256"], ["sha1", "md5"]]
+    res = jdoc.hashes(("md5", "sha512"), source=True)
+    assert res["sha512"] == sonormal.checksums.computeHashes(jdoc.source_bytes, ["sha512"])["sha512"]
+
+
+def test_sourceIdentifiers(tmp_path, monkeypatch):
+    doc = dict(_DOC, identifier=["doi:b", "doi:a", 5])
+    canonicalized = []
+    canonicalize = sonormal.checksums.c14n.canonicalize
+
+    def counting(jdoc):
+        canonicalized.append(jdoc)
+        return canonicalize(jdoc)
+
+    monkeypatch.setattr(sonormal.checksums.c14n, "canonicalize", counting)
+    monkeypatch.setattr(sonormal.artifacts.c14n, "canonicalize", counting)
+    cache = sonormal.artifacts.ArtifactCache(str(tmp_path))
+    jdoc = sonormal.document.Document(doc, cache=cache)
+    # Document order and native values, as framing the source
+    expected = sonormal.normalize.getDatasetsIdentifiers(
+        sonormal.normalize.frameSODataset(doc)
+    )
+    assert jdoc.source_identifiers == expected
+    assert expected[0]["identifier"] == ["doi:b", "doi:a", 5]
+    # The digest of the document is the cache key
+    assert jdoc.digest is not None
+    assert len(canonicalized) == 1
+    cache.close()
+
+
+@pytest.fixture(scope="module")
+def soContext(tmp_path_factory):
+    sonormal.prepareSchemaOrgLocalContexts(
+        context_folder=str(tmp_path_factory.mktemp("contexts"))
+    )
+
+
+def test_httpIdentifiers(soContext, tmp_path):
+    doc = dict(_DOC, **{"@context": {"@vocab": "https://schema.org/"}})
+    cache = sonormal.artifacts.ArtifactCache(str(tmp_path))
+    jdoc = sonormal.document.Document(doc, cache=cache)
+    # so info frames the source as is, so publish the http namespace form
+    assert jdoc.source_identifiers == sonormal.normalize.getDatasetsIdentifiers(
+        sonormal.normalize.frameSODataset(doc)
+    )
+    assert jdoc.source_identifiers == []
+    expected = sonormal.normalize.getDatasetsIdentifiers(
+        sonormal.normalize.frameSODataset(sonormal.switchToHttpSchemaOrg(doc))
+    )
+    assert jdoc.http_identifiers == expected
+    assert expected[0]["identifier"] == ["doi:10.1234/test"]
+    cache.close()
+
+
+
+def test_sosoExpanded(tmp_path, monkeypatch):
+    expected = sonormal.sosoNormalize(_DOC)
+    calls = []
+    expand = pyld.jsonld.expand
+
+    def counting(jdoc, options=None):
+        calls.append(jdoc)
+        return expand(jdoc, options)
+
+    monkeypatch.setattr(pyld.jsonld, "expand", counting)
+    cache = sonormal.artifacts.ArtifactCache(str(tmp_path))
+    jdoc = sonormal.document.Document(_DOC, cache=cache)
+    assert jdoc.soso == expected
+    # soso is derived from the expanded form, the document is expanded once
+    assert jdoc.expanded is not None
+    assert len(calls) == 1
+    cache.close()
@@ -0,0 +1,89 @@
+import pytest
+import pyld.jsonld
+import sonormal.extract
+
+_LD = '{"@context": {"@vocab": "https://example.net/test/"}, "TEST": "%s"}'
+
+# HTML that has to give the same result as pyld.jsonld.load_html
+html_tests = [
+    f'<html><head><script type="application/ld+json">{_LD % "a"}</script></head></html>',
+    f'<script type="application/ld+json">{_LD % "a"}</script>'
+    f'<p><script type="application/ld+json">{_LD % "b"}</script>',
+    # uppercase, unquoted attributes, extra type parameters
+    f"<SCRIPT TYPE=application/ld+json>{_LD % 'a'}</SCRIPT >",
+    f'<script type="application/ld+json; charset=utf-8">{_LD % "a"}</script>',
+    # commented out and in raw text elements
+    f'<!-- <script type="application/ld+json">{_LD % "a"}</script> -->'
+    f'<script type="application/ld+json">{_LD % "b"}</script>',
+    f'<textarea><script type="application/ld+json">{_LD % "a"}</script></textarea>'
+    f'<title></title ><script type="application/ld+json">{_LD % "b"}</script>',
+    # script content that looks like markup
+    f'<script type="application/ld+json">{_LD % "</scriptx><!-- a -->"}</script>',
+    f'<script type="application/ld+json"><!--\n{_LD % "a"}\n--></script>',
+    # quoted attribute values with markup
+    f'<div title="<script>"><script type="application/ld+json">{_LD % "a"}</script></div>',
+    f"<a href='x>y'></a><script type=\"application/ld+json\">{_LD % 'a'}</script>",
+    # entities, line ends and CDATA
+    f'<script type="application/ld+json">{_LD % "&amp;"}</script>',
+    f'<script type="application/ld+json">\r\n{_LD % "a"}\r</script>',
+    f'<script type="application/ld+json"><![CDATA[ ]]>{_LD % "a"}</script>',
+    # other scripts and base elements
+    f'<head><base href="/docs/"><script>var a = "<!--";</script>'
+    f'<script type="application/ld+json">{_LD % "a"}</script></head>',
+    f'<base href="https://example.org/x/"><script type="application/ld+json">{_LD % "a"}</script>',
+]
+
+
+def _loadHtml(loader, src, url, profile, options):
+    try:
+        return loader(src, url, profile, options), options
+    except pyld.jsonld.JsonLdError as e:
+        return e.code, options
+
+
+@pytest.mark.parametrize("src", html_tests)
+@pytest.mark.parametrize("extract_all", [True, False])
+def test_loadHtml(src, extract_all):
+    url = "https://example.net/page"
+    expected = _loadHtml(
+        pyld.jsonld.load_html, src, url, None, {"extractAllScripts": extract_all}
+    )
+    res = _loadHtml(
+        sonormal.extract.loadHtml, src, url, None, {"extractAllScripts": extract_all}
+    )
+    assert res == expected
+
+
+def test_loadHtmlSelect():
+    src = (
+        f'<script type="application/ld+json">{_LD % "a"}</script>'
+        f'<script type="application/ld+json;profile=http://example.net/p" id="b">'
+        f'{_LD % "b"}</script><script type="text/plain" id="c">x</script>'
+    )
+    res = sonormal.extract.loadHtml(src, "https://example.net/", None, {})
+    assert res["TEST"] == "a"
+    res = sonormal.extract.loadHtml(src, "https://example.net/", "http://example.net/p", {})
+    assert res["TEST"] == "b"
+    res = sonormal.extract.loadHtml(src, "https://example.net/#b", None, {})
+    assert res["TEST"] == "b"
+    with pytest.raises(pyld.jsonld.JsonLdError):
+        sonormal.extract.loadHtml(src, "https://example.net/#c", None, {})
+    with pytest.raises(pyld.jsonld.JsonLdError):
+        sonormal.extract.loadHtml("<p>no JSON-LD</p>", "https://example.net/", None, {})
+
+
+def test_loadDocument():
+    src = f'<html><head><script type="application/ld+json">{_LD % "a"}</script></head></html>'
+
+    def loader(url, options):
+        return {
+            "contentType": "text/html; charset=utf-8",
+            "contextUrl": None,
+            "documentUrl": url,
+            "document": src,
+        }
+
+    res = sonormal.extract.loadDocument(
+        "https://example.net/", {"documentLoader": loader, "extractAllScripts": True}
+    )
+    assert res["document"][0]["TEST"] == "a"
@@ -0,0 +1,256 @@
+import time
+import datetime
+import json
+import asyncio
+import threading
+import http.server
+import pytest
+import diskcache
+import sonormal.getjsonld
+import sonormal.strategy
+import sonormal.scheduler
+
+blocked_tests = [
+    [["https://example.net/logo.png", "image"], True],
+    [["https://example.net/", "document"], False],
+    [["https://example.net/app.js", "script"], False],
+    [["https://www.google-analytics.com/analytics.js", "script"], True],
+    [["https://googletagmanager.com/gtm.js", "script"], True],
+    [["https://notgoogletagmanager.com/gtm.js", "script"], False],
+    [["data:image/png;base64,AAAA", "other"], False],
+]
+
+
+@pytest.mark.parametrize("inp, expected", blocked_tests)
+def test_isBlockedRequest(inp, expected):
+    res = sonormal.getjsonld.isBlockedRequest(
+        inp[0],
+        inp[1],
+        sonormal.getjsonld.RENDER_BLOCKED_RESOURCE_TYPES,
+        sonormal.getjsonld.RENDER_BLOCKED_DOMAINS,
+    )
+    assert res == expected
+
+
+class _StubPage:
+    # evaluate() with arguments is the JSON-LD watcher, without is the count
+    def __init__(self, n_scripts, stable_after):
+        self.n_scripts = n_scripts
+        self.stable_after = stable_after
+
+    async def evaluate(self, js, *args):
+        if args:
+            await asyncio.sleep(self.stable_after)
+        return self.n_scripts
+
+
+wait_tests = [
+    # no JSON-LD, completes on network idle
+    [[0, 10.0], 0],
+    # JSON-LD stable before network idle
+    [[2, 0.1], 2],
+    # JSON-LD never stable, completes at timeout
+    [[1, 10.0], None],
+]
+
+
+@pytest.mark.parametrize("inp, expected", wait_tests)
+def test_waitForJsonld(inp, expected):
+    page = _StubPage(inp[0], inp[1])
+    inflight = {"n": 0, "last": time.time()}
+    t0 = time.time()
+    res = asyncio.run(
+        sonormal.getjsonld.waitForJsonld(page, inflight, timeout=1500, idle_ms=200)
+    )
+    assert res == expected
+    assert time.time() - t0 < 2.0
+
+
+_HTML_PAGE = """<html><head>
+<script type="application/ld+json">{"@context": {"@vocab": "https://example.net/test/"}, "TEST": "html"}</script>
+</head><body></body></html>"""
+
+
+class _PageHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_GET(self):
+        _PageHandler.requests.append(self.path)
+        headers = {}
+        if self.path.startswith("/spa"):
+            body = "<html><body>Rendered by javascript</body></html>"
+            headers["Content-Type"] = "text/html"
+        elif self.path.startswith("/html"):
+            body = _HTML_PAGE
+            headers["Content-Type"] = "text/html"
+        elif self.path.startswith("/linked"):
+            body = "<html><body>No JSON-LD here</body></html>"
+            headers["Content-Type"] = "text/html"
+            headers["Link"] = '</jsonld>; rel="alternate"; type="application/ld+json"'
+        else:
+            body = json.dumps({"@context": {"@vocab": "https://example.net/test/"}, "TEST": self.path})
+            headers["Content-Type"] = "application/ld+json"
+        body = body.encode()
+        self.send_response(200)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def page_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _PageHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_downloadJsonAsync(page_server):
+    res = asyncio.run(
+        sonormal.getjsonld.downloadJsonAsync(f"{page_server}/html", try_jsrender=False)
+    )
+    assert res["document"][0]["TEST"] == "html"
+    assert res["response"].status_code == 200
+    # Link header alternate is followed
+    res = asyncio.run(
+        sonormal.getjsonld.downloadJsonAsync(f"{page_server}/linked", try_jsrender=False)
+    )
+    assert res["document"]["TEST"] == "/jsonld"
+    assert res["documentUrl"] == f"{page_server}/jsonld"
+    summary = sonormal.getjsonld.responseSummary(res["response"])
+    assert summary["responses"][-1]["status_code"] == 200
+    # json_parse_strict is still accepted
+    res = asyncio.run(
+        sonormal.getjsonld.downloadJsonAsync(
+            f"{page_server}/html", try_jsrender=False, json_parse_strict=False
+        )
+    )
+    assert res["document"][0]["TEST"] == "html"
+
+
+def test_downloadJsonMany(page_server):
+    urls = [f"{page_server}/doc_{i}" for i in range(20)]
+    res = asyncio.run(
+        sonormal.getjsonld.downloadJsonMany(urls, try_jsrender=False, max_concurrency=5)
+    )
+    assert [r["document"]["TEST"] for r in res] == [f"/doc_{i}" for i in range(20)]
+
+
+def test_fetchStrategy(page_server, monkeypatch):
+    rendered = []
+
+    async def fakeRendered(url, **kwargs):
+        rendered.append(url)
+        return {"documentUrl": url, "document": [{"TEST": "rendered"}], "response": None}
+
+    monkeypatch.setattr(sonormal.getjsonld, "downloadJsonRendered", fakeRendered)
+    monkeypatch.setattr(sonormal, "DOCUMENT_CACHE", {})
+    strategies = sonormal.strategy.FetchStrategies({})
+    _PageHandler.requests = []
+    res = sonormal.getjsonld.downloadJson(f"{page_server}/spa/1", strategies=strategies)
+    assert res["document"][0]["TEST"] == "rendered"
+    assert _PageHandler.requests == ["/spa/1"]
+    assert strategies.get(page_server)["method"] == sonormal.strategy.METHOD_RENDER
+    # The page source is not requested once the host is known to need rendering
+    res = sonormal.getjsonld.downloadJson(f"{page_server}/spa/2", strategies=strategies)
+    assert res["document"][0]["TEST"] == "rendered"
+    assert _PageHandler.requests == ["/spa/1"]
+    assert len(rendered) == 2
+    # Plain fetch recorded with the Accept header and Link alternate use
+    strategies = sonormal.strategy.FetchStrategies({})
+    res = sonormal.getjsonld.downloadJson(
+        f"{page_server}/linked",
+        documentLoader=sonormal.requests_document_loader_history(),
+        strategies=strategies,
+    )
+    assert res["document"]["TEST"] == "/jsonld"
+    rec = strategies.get(page_server)
+    assert rec["method"] == sonormal.strategy.METHOD_PLAIN
+    assert rec["alternate"]
+    assert rec["accept"] == sonormal.DEFAULT_REQUEST_ACCEPT_HEADERS
+
+
+class _RecordingScheduler(sonormal.scheduler.HostScheduler):
+    def __init__(self):
+        super().__init__(requests_per_second=0, use_robots=False)
+        self.acquired = []
+
+    def acquire(self, url):
+        self.acquired.append(url)
+        return super().acquire(url)
+
+
+def test_scheduledFetches(page_server, monkeypatch):
+    async def fakeRendered(url, **kwargs):
+        return {"documentUrl": url, "document": [{"TEST": "rendered"}], "response": None}
+
+    monkeypatch.setattr(sonormal.getjsonld, "downloadJsonRendered", fakeRendered)
+    monkeypatch.setattr(sonormal, "DOCUMENT_CACHE", {})
+    scheduler = _RecordingScheduler()
+    loader = sonormal.scheduler.politeDocumentLoader(
+        sonormal.requests_document_loader_history(), scheduler
+    )
+    # The request to the Link alternate is scheduled
+    res = sonormal.getjsonld.downloadJson(
+        f"{page_server}/linked", documentLoader=loader, strategies=None, scheduler=scheduler
+    )
+    assert res["document"]["TEST"] == "/jsonld"
+    assert scheduler.acquired == [f"{page_server}/linked", f"{page_server}/jsonld"]
+    # Rendering is scheduled
+    scheduler.acquired = []
+    res = sonormal.getjsonld.downloadJson(
+        f"{page_server}/spa", documentLoader=loader, strategies=None, scheduler=scheduler
+    )
+    assert res["document"][0]["TEST"] == "rendered"
+    assert scheduler.acquired == [f"{page_server}/spa", f"{page_server}/spa"]
+    assert scheduler.stats()[page_server]["active"] == 0
+
+
+def test_renderCache(tmp_path, monkeypatch):
+    rendered = []
+
+    async def fakeRendered(url, **kwargs):
+        rendered.append(url)
+        response = sonormal.ObjDict(
+            {
+                "url": url,
+                "status_code": 200,
+                "headers": {"content-type": "text/html"},
+                "text": "<html>rendered</html>",
+                "elapsed": datetime.timedelta(seconds=1),
+                "history": [],
+                "request": sonormal.ObjDict({"url": url, "headers": {}}),
+                "resources_loaded": [url],
+            }
+        )
+        return {"documentUrl": url, "document": [{"TEST": "rendered"}], "response": response}
+
+    monkeypatch.setattr(sonormal.getjsonld, "downloadJsonRendered", fakeRendered)
+    cache = diskcache.Cache(str(tmp_path))
+    url = "https://example.net/spa"
+    for i in range(2):
+        res = asyncio.run(
+            sonormal.getjsonld.downloadJsonRenderedCached(
+                url, document_cache=cache, cache_html=True
+            )
+        )
+        assert res["document"][0]["TEST"] == "rendered"
+    assert rendered == [url]
+    summary = sonormal.getjsonld.responseSummary(res["response"])
+    assert summary["resources_loaded"] == [url]
+    assert summary["responses"][0]["elapsed"] == 1.0
+    assert res["response"].text == "<html>rendered</html>"
+    # Expired renders are rendered again
+    asyncio.run(
+        sonormal.getjsonld.downloadJsonRenderedCached(url, document_cache=cache, cache_timeout=0)
+    )
+    assert len(rendered) == 2
+    cache.close()
@@ -6,6 +6,9 @@ import json
 import atexit
 import shutil
 import pyld
+import http.server
+import threading
+import diskcache
 
 
 class LocalContexts:
@@ -88,3 +91,254 @@ def test_remoteContext2(so_doc):
     expanded = pyld.jsonld.expand(so_doc, options)
     v = expanded[0]["http://schema.org/name"][0]["@value"]
     assert v == "Test remote context"
+
+
+def test_contextDocumentCache(example_context):
+    fname = example_context.dest_fname
+    doc_a = sonormal.loadContextDocument(fname)
+    doc_b = sonormal.loadContextDocument(fname)
+    # Parsed documents are shared, not copied
+    assert doc_a is doc_b
+    loader = sonormal.localRequestsDocumentLoader(context_map=example_context.cmap)
+    res = loader("https://example.net/some_random_thing")
+    assert res["document"] is doc_a
+    # Rewriting the file invalidates the cached entry
+    with open(fname, "w") as dest:
+        json.dump({"@context": {"@vocab": "https://example.net/other/"}}, dest)
+    os.utime(fname, ns=(0, 0))
+    doc_c = sonormal.loadContextDocument(fname)
+    assert doc_c is not doc_a
+    assert doc_c["@context"]["@vocab"] == "https://example.net/other/"
+
+
+class _JsonldHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/split"):
+            # Organization in head, Dataset in body
+            body = (
+                '<html><head><script type="application/ld+json">{"@type": "Organization"}</script>'
+                + '</head><body><script type="application/ld+json">{"@type": "Dataset"}</script>'
+                + "</body></html>"
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.path.startswith("/big"):
+            # JSON-LD in head followed by a large body and another script
+            body = (
+                '<html><head><script type="application/ld+json">'
+                + json.dumps({"@context": {"@vocab": "https://example.net/test/"}, "TEST": self.path})
+                + "</script></head><body>"
+                + "x" * 4 * 1024 * 1024
+                + '<script type="application/ld+json" id="last">{"@type": "Dataset"}</script>'
+                + "</body></html>"
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except ConnectionError:
+                pass
+            return
+        body = json.dumps({"@context": {"@vocab": "https://example.net/test/"}, "TEST": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/ld+json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def jsonld_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _JsonldHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_sessionPool(jsonld_server):
+    pool = sonormal.SessionPool(pool_size=2, idle_timeout=60)
+    loader = sonormal.requests_document_loader_history(session_pool=pool)
+    for i in range(3):
+        res = loader(f"{jsonld_server}/doc_{i}")
+        assert json.loads(res["document"])["TEST"] == f"/doc_{i}"
+    stats = pool.stats()[jsonld_server]
+    assert stats["requests"] == 3
+    assert stats["sessions"] == 1
+    # connection is kept alive between requests
+    assert stats["connections"] == 1
+    pool.close()
+
+
+
+def test_sessionPoolEviction(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sonormal.time, "time", lambda: now[0])
+    pool = sonormal.SessionPool(idle_timeout=60, max_hosts=2)
+    a = pool.session("https://a.example.net/x")
+    pool.session("https://b.example.net/x")
+    assert pool.session("https://a.example.net/y") is a
+    # b is the least recently used host
+    pool.session("https://c.example.net/x")
+    assert list(pool._sessions.keys()) == ["https://a.example.net", "https://c.example.net"]
+    # Idle hosts are closed on the next request to any host
+    now[0] += 61
+    pool.session("https://d.example.net/x")
+    assert list(pool._sessions.keys()) == ["https://d.example.net"]
+    assert pool.session("https://a.example.net/z") is not a
+    assert pool.stats()["https://a.example.net"]["sessions"] == 2
+    pool.close()
+
+
+def test_sessionPoolBorrowed(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sonormal.time, "time", lambda: now[0])
+    pool = sonormal.SessionPool(idle_timeout=60, max_hosts=1)
+    closed = []
+    with pool.borrow("https://a.example.net/x") as a:
+        monkeypatch.setattr(a, "close", lambda: closed.append("a"))
+        # Neither idle nor least recently used sessions are closed while in use
+        now[0] += 61
+        pool.session("https://b.example.net/x")
+        assert "https://a.example.net" in pool._sessions
+        assert pool.session("https://a.example.net/y") is a
+        assert closed == []
+    assert list(pool._sessions.keys()) == ["https://a.example.net"]
+    # Returned sessions are evicted as usual
+    pool.session("https://c.example.net/x")
+    assert closed == ["a"]
+    assert list(pool._sessions.keys()) == ["https://c.example.net"]
+    pool.close()
+
+def test_cacheRevalidation(jsonld_server, monkeypatch):
+    cache = {}
+    loader = sonormal.localRequestsDocumentLoader(
+        document_cache=cache,
+        fallback_loader=sonormal.requests_document_loader_history(),
+    )
+    url = f"{jsonld_server}/revalidate"
+    stats = sonormal.DOCUMENT_CACHE_STATS.copy()
+    res = loader(url)
+    assert sonormal.DOCUMENT_CACHE_STATS["fetched"] == stats["fetched"] + 1
+    res = loader(url)
+    assert sonormal.DOCUMENT_CACHE_STATS["hits"] == stats["hits"] + 1
+    # Expire the entry, the server answers 304 and the cached copy is used
+    monkeypatch.setattr(sonormal, "DOCUMENT_CACHE_TIMEOUT", -1)
+    res = loader(url)
+    assert sonormal.DOCUMENT_CACHE_STATS["revalidated"] == stats["revalidated"] + 1
+    assert sonormal.DOCUMENT_CACHE_STATS["fetched"] == stats["fetched"] + 1
+    assert json.loads(res["document"])["TEST"] == "/revalidate"
+
+
+def test_cacheRecord(jsonld_server):
+    loader = sonormal.requests_document_loader_history()
+    res = loader(f"{jsonld_server}/record")
+    entry = {"doc": res, "cached": 1.0, "etag": '"v1"', "last_modified": None}
+    for compression in ("zlib", "lzma"):
+        data = sonormal.encodeCacheEntry(entry, compression=compression)
+        assert isinstance(data, bytes)
+        loaded = sonormal.decodeCacheEntry(data)
+        assert loaded["etag"] == '"v1"'
+        doc = loaded["doc"]
+        assert doc["document"] == res["document"]
+        assert doc["documentUrl"] == res["documentUrl"]
+        assert doc["response"].status_code == 200
+        assert doc["response"].headers["Content-Type"] == "application/ld+json"
+        assert doc["response"].request.url == res["response"].request.url
+        assert doc["response"].history == []
+    assert sonormal.decodeCacheEntry(b"not a record") is None
+
+
+def test_diskCacheRecord(jsonld_server):
+    with tempfile.TemporaryDirectory() as cache_folder:
+        with diskcache.Cache(cache_folder) as cache:
+            loader = sonormal.localRequestsDocumentLoader(
+                document_cache=cache,
+                fallback_loader=sonormal.requests_document_loader_history(),
+            )
+            url = f"{jsonld_server}/disk"
+            res = loader(url)
+            # Stored as a record, not a pickled response
+            assert isinstance(cache.get(url), bytes)
+            cached = loader(url)
+            assert cached["document"] == res["document"]
+            assert cached["response"].status_code == 200
+
+
+scanner_tests = [
+    ['<html><head><script type="application/ld+json">{}</script></head><body>', True, 6, True],
+    ['<html><head><script type="application/ld+json">{}</script></head><body>', False, None, False],
+    ['<html><head><title>t</title></head><body><script type="application/ld+json">{}</script>', True, None, False],
+    ['<html><head><script type="application/ld+json">{"a":"</head>"}</script>', True, None, False],
+    ["<html><head></head><body>no json-ld</body></html>", True, None, False],
+    # JSON-LD in body, stop after the budget
+    ['<html><head></head><body><script type="application/ld+json">{}</script>' + "x" * 1024, False, 1024, True],
+    # Long script with tags in the JSON
+    ['<html><head><script type="application/ld+json">{"a":"' + "<p>x" * 300 + '"}</script >' + "<p>" * 300, False, 900, True],
+]
+
+
+@pytest.mark.parametrize("html, head_only, tail, done", scanner_tests)
+def test_htmlJsonldScanner(html, head_only, tail, done):
+    data = html.encode()
+    # Result does not depend on how the body is split into chunks
+    for size in (1, 3, len(data)):
+        scanner = sonormal.HtmlJsonldScanner(budget=1024, head_only=head_only)
+        finished = False
+        for i in range(0, len(data), size):
+            if scanner.feed(data[i : i + size]):
+                finished = True
+                break
+        assert finished == done
+        if done:
+            assert scanner.end == len(data) - tail
+
+
+def test_streamedHtml(jsonld_server):
+    loader = sonormal.requests_document_loader_history()
+    res = loader(f"{jsonld_server}/big")
+    # Reading stops after the budget, truncated at the end of head
+    assert res["document"].endswith("</head>")
+    assert len(res["document"]) < 1024
+    doc = pyld.jsonld.load_html(res["document"], res["documentUrl"], None, {})
+    assert doc["TEST"] == "/big"
+    # Scripts after the budget are needed
+    res = loader(f"{jsonld_server}/big", {"extractAllScripts": True})
+    assert res["document"].endswith("</html>")
+    res = loader(f"{jsonld_server}/big#last")
+    assert res["document"].endswith("</html>")
+    loader = sonormal.requests_document_loader_history(max_bytes=1024)
+    with pytest.raises(pyld.jsonld.JsonLdError):
+        loader(f"{jsonld_server}/big")
+
+
+def test_streamedHtmlHeadOnly(jsonld_server):
+    url = f"{jsonld_server}/split"
+    res = sonormal.requests_document_loader_history()(url)
+    assert "Dataset" in res["document"]
+    loader = sonormal.requests_document_loader_history(stream_head_only=True)
+    res = loader(url)
+    assert res["document"].endswith("</head>")
+    assert "Dataset" not in res["document"]
+    # All scripts are wanted, read past the head
+    res = loader(url, {"extractAllScripts": True})
+    assert "Dataset" in res["document"]
@@ -0,0 +1,221 @@
+import copy
+import json
+import tracemalloc
+import pytest
+import sonormal
+import pyld.jsonld
+import sonormal.normalize
+
+_CONTEXT = {"@vocab": "https://example.net/test/"}
+
+
+def _docs(n):
+    for i in range(n):
+        yield {
+            "@context": _CONTEXT,
+            "@id": f"https://example.net/doc/{i}",
+            "value": i,
+            "part": {"name": f"part {i}", "other": {"name": "blank"}},
+        }
+    # not valid JSON-LD, @id must be a string
+    yield {"@context": _CONTEXT, "@id": 1}
+
+
+@pytest.mark.parametrize("output", sonormal.normalize.NORMALIZE_OUTPUTS)
+def test_normalizeMany(output):
+    serial = list(sonormal.normalize.normalizeMany(_docs(12), output=output, workers=1))
+    parallel = list(
+        sonormal.normalize.normalizeMany(_docs(12), output=output, workers=2, max_tasks=3)
+    )
+    assert isinstance(serial[-1], ValueError)
+    assert isinstance(parallel[-1], ValueError)
+    assert serial[:-1] == parallel[:-1]
+    if output == "json":
+        expected = [sonormal.normalize.normalizeJsonld(doc) for doc in list(_docs(12))[:-1]]
+        assert parallel[:-1] == expected
+
+
+_V = {"@vocab": "https://example.net/test/"}
+
+normalize_tests = [
+    {"@context": _V, "a": [{"b": 1}, {"b": 1}, {"b": "x"}], "d": ["y", "y"]},
+    {"@context": _V, "c": {"@value": "hi", "@language": "en"}, "e": {"@value": "", "@language": "de"}},
+    {"@context": _V, "@id": "_:g", "@graph": [{"a": {"b": {"c": 1.5}}}, {"@id": "https://example.net/q", "a": True}]},
+    {"@context": _V, "@id": "https://example.net/g", "@graph": [{"a": {"@list": [1, 2, {"x": "y"}]}}]},
+    {"@context": _V, "a": "line\nbreak \"q\" \\ \t", "b": {"@value": "2020", "@type": "https://example.net/T"}},
+    {"@context": _V, "n": {"@id": "_:x", "self": {"@id": "_:x"}}, "m": {"self": {"@id": "_:x"}}},
+]
+
+
+@pytest.mark.parametrize("doc", normalize_tests)
+def test_normalizeJsonld(doc):
+    # Same result as parsing the N-Quads of pyld.jsonld.normalize
+    opts = {"algorithm": "URDNA2015", "base": "https://example.net/", "format": "application/n-quads"}
+    expected = pyld.jsonld.from_rdf(pyld.jsonld.normalize(doc, options=opts), options=opts)
+    res = sonormal.normalize.normalizeJsonld(doc, options={"base": "https://example.net/"})
+    assert json.dumps(res) == json.dumps(expected)
+
+
+_SO = {"@vocab": "http://schema.org/"}
+
+identifiers_tests = [
+    {"@context": _SO, "@id": "https://example.net/d", "@type": "Dataset", "identifier": "doi:10.1/x", "url": {"@id": "https://example.net/l"}},
+    {"@context": _SO, "@type": "Dataset", "identifier": ["b", "a", "doi:c", 5, True, 1.5, {"@value": "x", "@language": "en"}, "a"]},
+    {"@context": _SO, "@type": "Dataset", "identifier": {"@list": ["b", "a", {"@type": "PropertyValue", "value": "v", "url": {"@id": "https://u/"}}]}},
+    {
+        "@context": _SO,
+        "@id": "https://example.net/d",
+        "@type": "Dataset",
+        "identifier": {"@id": "https://example.net/pv"},
+        "isPartOf": {"@id": "https://example.net/pv", "value": ["v2", "v1"], "url": [{"@id": "https://b/"}, {"@id": "https://a/"}]},
+    },
+    {
+        "@context": _SO,
+        "@graph": [
+            {"@id": "https://example.net/z", "@type": "Dataset", "identifier": "z"},
+            {"@id": "https://example.net/a", "@type": ["Thing", "Dataset"], "identifier": "a1", "url": "https://literal/", "value": "doi:v"},
+            {"@id": "https://example.net/a", "identifier": "a0"},
+        ],
+    },
+    {"@context": _SO, "@type": "DataCatalog", "dataset": [{"@type": "Dataset", "@id": "rel", "identifier": "1"}, {"@type": "Dataset", "identifier": "2"}]},
+    {"@context": _SO, "@id": "https://example.net/g", "@graph": [{"@id": "https://example.net/n", "@type": "Dataset", "identifier": "named"}]},
+    {"@context": _SO, "@id": "https://example.net/p", "@reverse": {"creator": {"@id": "https://example.net/r", "@type": "Dataset", "identifier": "r"}}},
+    {"@context": _SO, "@type": "Person", "identifier": "not a dataset"},
+    # Framing embeds a node once, later references are bare {"@id"}
+    {
+        "@context": _SO,
+        "@id": "https://example.net/d",
+        "@type": "Dataset",
+        "about": {"@id": "https://example.net/pv", "@type": "PropertyValue", "value": "doi:10.1/x"},
+        "identifier": {"@id": "https://example.net/pv"},
+    },
+    {
+        "@context": _SO,
+        "@id": "https://example.net/d",
+        "@type": "Dataset",
+        "identifier": [{"@id": "https://example.net/d"}, "a"],
+        "url": {"@id": "https://example.net/l"},
+        "value": "v",
+    },
+    {
+        "@context": _SO,
+        "@id": "https://example.net/d",
+        "@type": "Dataset",
+        "identifier": {"@list": [
+            {"@id": "https://example.net/pv", "value": "1", "about": {"@id": "https://example.net/pv2", "value": "2"}},
+            {"@id": "https://example.net/pv2"},
+            {"@id": "https://example.net/pv3", "value": "3", "isPartOf": {"@id": "https://example.net/d"}},
+        ]},
+    },
+    {
+        "@context": _SO,
+        "@type": "Dataset",
+        "identifier": {"@id": "https://example.net/pv", "value": "1", "about": {"url": {"@id": "https://example.net/pv"}}},
+    },
+]
+
+
+@pytest.mark.parametrize("doc", identifiers_tests)
+def test_extractDatasetsIdentifiers(doc):
+    ndoc = sonormal.normalize.normalizeJsonld(doc)
+    expected = sonormal.normalize.getDatasetsIdentifiers(sonormal.normalize.frameSODataset(ndoc))
+    assert sonormal.normalize.extractDatasetsIdentifiers(doc) == expected
+
+
+_PV = {"@type": "PropertyValue", "value": "v"}
+
+blank_node_tests = [
+    # Canonical order of blank node identifiers
+    {"@context": _SO, "@type": "Dataset", "identifier": [dict(_PV, value=f"v{i}") for i in range(4)] + ["s"]},
+    # Blank node Datasets, and their labels
+    {"@context": _SO, "@type": "DataCatalog", "dataset": [{"@type": "Dataset", "identifier": "2"}, {"@type": "Dataset", "url": {"@id": "_:u"}}]},
+    {"@context": _SO, "@id": "https://example.net/d", "@type": "Dataset", "url": {"name": "u"}, "identifier": dict(_PV, url={"name": "v"})},
+    # The first blank node in canonical order embeds the shared node
+    {
+        "@context": _SO,
+        "@id": "https://example.net/d",
+        "@type": "Dataset",
+        "about": [{"name": "b", "about": {"@id": "https://example.net/pv"}}, {"name": "a", "about": {"@id": "https://example.net/pv"}}],
+        "identifier": {"@id": "https://example.net/pv", "value": "doi:10.1/x"},
+    },
+]
+
+
+@pytest.mark.parametrize("doc", blank_node_tests)
+def test_extractDatasetsIdentifiersBlankNodes(doc):
+    ndoc = sonormal.normalize.normalizeJsonld(doc)
+    expected = sonormal.normalize.getDatasetsIdentifiers(sonormal.normalize.frameSODataset(ndoc))
+    assert sonormal.normalize.extractDatasetsIdentifiers(doc) == expected
+    expanded = pyld.jsonld.expand(doc, options=sonormal.ACTIVE_CONTEXTS.options("so", {"base": sonormal.DEFAULT_BASE}))
+    assert sonormal.normalize.extractDatasetsIdentifiers(doc, expanded=expanded) == expected
+
+
+def _peakAllocated(f, *args):
+    tracemalloc.start()
+    try:
+        f(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_forceSODatasetListsAllocations():
+    doc = {
+        "@context": "https://schema.org/",
+        "@type": "Dataset",
+        "creator": [{"@type": "Person", "name": f"p{i}", "affiliation": {"name": f"o{i}"}} for i in range(1000)],
+    }
+    res = sonormal.normalize.forceSODatasetLists(doc)
+    assert res["@context"][0] == "https://schema.org/"
+    assert res["@context"][1:] == [{"creator": {"@container": "@list"}}, {"identifier": {"@container": "@list"}}]
+    assert res["creator"] is doc["creator"]
+    assert doc["@context"] == "https://schema.org/"
+    # Only the top level and @context are copied, not the document
+    copied = _peakAllocated(copy.deepcopy, doc)
+    forced = _peakAllocated(sonormal.normalize.forceSODatasetLists, doc)
+    assert forced * 50 < copied
+
+
+def test_sharedFrame():
+    frame = copy.deepcopy(sonormal.SO_DATASET_FRAME)
+    frame["identifier"] = {"@embed": "@always"}
+    with pytest.raises(TypeError):
+        sonormal.SO_DATASET_FRAME["identifier"] = {}
+    with pytest.raises(TypeError):
+        sonormal.SO_COMPACT_CONTEXT["@context"].append({"@base": "https://example.net/"})
+    doc = {"@context": _SO, "@type": "Dataset", "identifier": "a"}
+    assert sonormal.normalize.frameSODataset(doc)[0]["@type"] == ["http://schema.org/Dataset"]
+    cdoc = sonormal.normalize.compactSODataset(doc, options={"base": "https://example.net/"})
+    assert cdoc["@context"][-1] == {"@base": "https://example.net/"}
+    assert len(sonormal.SO_COMPACT_CONTEXT["@context"]) == 2
+    assert "@embed" not in sonormal.SO_DATASET_FRAME["identifier"]
+
+
+def _frozen(obj):
+    # True if obj or any object in it is shared and immutable
+    if isinstance(obj, (sonormal._FrozenDict, sonormal._FrozenList)):
+        return True
+    if isinstance(obj, dict):
+        return any(_frozen(v) for v in obj.values())
+    if isinstance(obj, list):
+        return any(_frozen(v) for v in obj)
+    return False
+
+
+def test_sharedFrameNotReturned():
+    doc = {"@context": _SO, "@type": "Dataset", "identifier": "a", "creator": {"name": "c"}}
+    framed = sonormal.sosoDatasetFrame(sonormal.sosoNormalize(doc))
+    compacted = sonormal.normalize.compactSODataset(doc)
+    forced = sonormal.normalize.forceSODatasetLists(doc)
+    forced_list = sonormal.normalize.forceSODatasetLists(dict(doc, **{"@context": [_SO]}))
+    for res in (framed, compacted, forced, forced_list):
+        assert not _frozen(res)
+    # Callers may edit the results
+    framed["@context"]["distribution"]["@container"] = "@list"
+    framed["@context"]["@base"] = "https://example.net/"
+    compacted["@context"].append({"@base": "https://example.net/"})
+    forced["@context"]["identifier"]["@container"] = "@set"
+    forced_list["@context"][-1]["identifier"]["@container"] = "@set"
+    assert sonormal.SO_DATASET_FRAME["@context"]["distribution"]["@container"] == "@set"
+    assert len(sonormal.SO_COMPACT_CONTEXT["@context"]) == 2
+    assert sonormal.normalize.forceSODatasetLists(doc)["@context"]["identifier"] == {"@container": "@list"}
@@ -239,3 +239,89 @@ def test_dryad(soContext):
     edoc = pyld.jsonld.expand(tdoc, options)
     v = edoc[0].get("http://schema.org/name", [{}])[0].get("@value")
     assert v == "Dissecting the basis of novel trait evolution in a radiation with widespread phylogenetic discordance"
+
+
+def test_activeContextReuse(soContext):
+    doc = {"@context": "https://schema.org/", "@type": "Dataset", "name": "test value"}
+    sonormal.switchToHttpSchemaOrg(doc)
+    before = sonormal.ACTIVE_CONTEXTS.stats()["so"]
+    tdoc = sonormal.switchToHttpSchemaOrg(doc)
+    after = sonormal.ACTIVE_CONTEXTS.stats()["so"]
+    # The schema.org context is not loaded and processed again
+    assert after["hits"] > before["hits"]
+    assert after["misses"] == before["misses"]
+    edoc = sonormal.addSchemaOrgListContainer(tdoc)
+    v = edoc[0].get("http://schema.org/name", [{}])[0].get("@value")
+    assert v == "test value"
+
+
+soso_tests = []
+for _ctx in (
+    {"@vocab": "https://schema.org/"},
+    {"@vocab": "http://schema.org/"},
+    "https://schema.org/",
+    "http://schema.org/",
+):
+    soso_tests += [
+        {
+            "@context": _ctx,
+            "@type": "Dataset",
+            "@id": "https://schema.org/thing",
+            "creator": [],
+            "identifier": {"@list": ["a", "b"]},
+            "description": [{"@value": "x", "@language": "en"}, "y"],
+            "sameAs": ["https://schema.org/s", "https://example.net/s"],
+            "startDate": {"@value": "2020", "@type": "https://schema.org/Date"},
+            "about": {"@type": ["https://schema.org/Thing", "https://example.net/T"], "name": "n"},
+        },
+        {
+            "@context": _ctx,
+            "@graph": [
+                {"@type": "Dataset", "creator": [{"@list": ["a"]}, "b"]},
+                {"@id": "https://example.net/g", "@graph": {"@type": "Person", "identifier": ["z", "y"]}},
+            ],
+        },
+        {"@context": _ctx, "@type": "Dataset", "http://schema.org/creator": "h", "https://schema.org/name": "s"},
+    ]
+
+
+@pytest.mark.parametrize("doc", soso_tests + [dryad_test_doc_1])
+def test_sosoNormalize(soContext, doc):
+    # Same as expanding the http namespace document with the list context
+    expected = sonormal.addSchemaOrgListContainer(sonormal.switchToHttpSchemaOrg(doc))
+    assert sonormal.sosoNormalize(doc) == expected
+
+
+def test_schemaOrgNamespaces(soContext):
+    doc = {"@context": "https://schema.org/", "@type": "Dataset", "name": "test"}
+    namespaces, expanded = sonormal.schemaOrgNamespaces(doc)
+    assert namespaces == {sonormal.SO_}
+    assert expanded is None
+    # A https string that is not an IRI of the document
+    doc = {"@context": {"@vocab": "http://schema.org/"}, "description": "https://schema.org/"}
+    namespaces, expanded = sonormal.schemaOrgNamespaces(doc)
+    assert namespaces == {sonormal.SO_}
+    assert expanded is not None
+    tdoc = sonormal.switchToHttpSchemaOrg(doc)
+    assert tdoc == {"@context": "https://schema.org/", "description": "https://schema.org/"}
+    doc = {"@context": {"@vocab": "https://schema.org/"}, "name": "test"}
+    assert sonormal.schemaOrgNamespaces(doc)[0] == {sonormal.SOS_}
+
+
+def test_mixedNamespaces(soContext):
+    # https is only used after the first node
+    doc = {
+        "@context": {"@vocab": "http://schema.org/", "sos": "https://schema.org/"},
+        "@type": "Dataset",
+        "about": {"@type": "Thing", "name": "a"},
+        "creator": {"@type": "sos:Person", "sos:name": "b"},
+    }
+    namespaces, expanded = sonormal.schemaOrgNamespaces(doc)
+    assert namespaces == {sonormal.SO_, sonormal.SOS_}
+    assert sonormal.isHttpsSchemaOrg(expanded)
+    tdoc = sonormal.switchToHttpSchemaOrg(doc)
+    edoc = pyld.jsonld.expand(tdoc, sonormal.ACTIVE_CONTEXTS.options("so"))
+    assert sonormal.expandedSchemaOrgNamespaces(edoc) == {sonormal.SO_}
+    creator = edoc[0]["http://schema.org/creator"][0]
+    assert creator["@type"] == ["http://schema.org/Person"]
+    assert creator["http://schema.org/name"] == [{"@value": "b"}]
@@ -0,0 +1,121 @@
+import time
+import threading
+import pytest
+import sonormal.scheduler
+
+retry_after_tests = [
+    ["5", 5.0],
+    [" 0 ", 0.0],
+    ["Thu, 01 Jan 1970 00:00:10 GMT", 10.0],
+    ["not a date", None],
+    [None, None],
+]
+
+
+@pytest.mark.parametrize("value, expected", retry_after_tests)
+def test_parseRetryAfter(value, expected):
+    assert sonormal.scheduler.parseRetryAfter(value, now=0.0) == expected
+
+
+def test_rateLimit():
+    scheduler = sonormal.scheduler.HostScheduler(
+        max_concurrency=1, requests_per_second=20, use_robots=False
+    )
+    url = "https://example.net/a"
+    t0 = time.time()
+    for i in range(3):
+        scheduler.acquire(url)
+        scheduler.release(url)
+    # three requests spaced at least 0.05 seconds apart
+    assert time.time() - t0 >= 0.1
+    stats = scheduler.stats()["https://example.net"]
+    assert stats["requests"] == 3
+    assert stats["active"] == 0
+
+
+def test_reentrant():
+    scheduler = sonormal.scheduler.HostScheduler(
+        max_concurrency=1, requests_per_second=0, use_robots=False
+    )
+    url = "https://example.net/a"
+    scheduler.acquire(url)
+    # Same thread may make another request to the host without deadlock
+    scheduler.acquire(url)
+    scheduler.release(url)
+    scheduler.release(url)
+    assert scheduler.stats()["https://example.net"]["active"] == 0
+
+
+def test_mapInterleaves():
+    scheduler = sonormal.scheduler.HostScheduler(
+        max_concurrency=1, requests_per_second=0, use_robots=False
+    )
+    urls = [f"https://slow.example.net/{i}" for i in range(4)]
+    urls += [f"https://fast.example.net/{i}" for i in range(4)]
+    order = []
+
+    def work(url):
+        if url.startswith("https://slow"):
+            time.sleep(0.05)
+        order.append(url)
+        return url
+
+    results = list(scheduler.map(work, urls, workers=2))
+    assert sorted(results) == sorted(urls)
+    # The fast host is not held up behind the slow host
+    assert order[:4] == [f"https://fast.example.net/{i}" for i in range(4)]
+
+
+def test_crossHostNoDeadlock():
+    scheduler = sonormal.scheduler.HostScheduler(
+        max_concurrency=1, requests_per_second=0, use_robots=False
+    )
+    barrier = threading.Barrier(2)
+    other = {"https://a.example.net/doc": "https://b.example.net/context",
+             "https://b.example.net/doc": "https://a.example.net/context"}
+
+    def work(url):
+        # Both workers hold their host, then request the other host
+        barrier.wait(timeout=5)
+        scheduler.acquire(other[url])
+        scheduler.release(other[url])
+        return url
+
+    urls = list(other.keys())
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.extend(scheduler.map(work, urls, workers=2)),
+        daemon=True,
+    )
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert sorted(results) == urls
+    for stats in scheduler.stats().values():
+        assert stats["active"] == 0
+
+
+def test_mapError():
+    scheduler = sonormal.scheduler.HostScheduler(
+        max_concurrency=1, requests_per_second=0, use_robots=False
+    )
+    urls = [f"https://example.net/{i}" for i in range(10)]
+    started = []
+
+    def work(url):
+        started.append(url)
+        time.sleep(0.01)
+        if url.endswith("/1"):
+            raise ValueError(url)
+        return url
+
+    with pytest.raises(ValueError):
+        list(scheduler.map(work, urls, workers=2))
+    # Remaining urls are dropped, no work continues after the error
+    n = len(started)
+    assert n < len(urls)
+    time.sleep(0.05)
+    assert len(started) == n
+    stats = scheduler.stats()["https://example.net"]
+    assert stats["queued"] == 0
+    assert stats["active"] == 0
@@ -0,0 +1,37 @@
+import time
+import sonormal
+import sonormal.strategy
+
+
+def test_record():
+    strategies = sonormal.strategy.FetchStrategies({}, reprobe_interval=60)
+    url = "https://example.net/dataset/1"
+    assert strategies.get(url) is None
+    assert strategies.needsProbe(None)
+    strategies.record(url, sonormal.strategy.METHOD_RENDER)
+    # Recorded per host
+    rec = strategies.get("https://example.net/dataset/2")
+    assert rec["method"] == sonormal.strategy.METHOD_RENDER
+    assert not strategies.needsProbe(rec)
+    rec = strategies.record(url, sonormal.strategy.METHOD_RENDER, probed=False)
+    assert rec["uses"] == 1
+    rec["probed"] = time.time() - 120
+    assert strategies.needsProbe(rec)
+    strategies.forget(url)
+    assert strategies.get(url) is None
+
+
+def test_usedLinkAlternate():
+    response = sonormal.ObjDict(
+        {
+            "url": "https://example.net/data.jsonld",
+            "history": [],
+            "request": sonormal.ObjDict({"url": "https://example.net/data.jsonld"}),
+        }
+    )
+    doc = {"response": response}
+    assert sonormal.strategy.usedLinkAlternate("https://example.net/page", doc)
+    assert not sonormal.strategy.usedLinkAlternate("https://example.net/data.jsonld", doc)
+    # A redirect is not an alternate
+    response["history"] = [sonormal.ObjDict({"url": "https://example.net/"})]
+    assert not sonormal.strategy.usedLinkAlternate("https://example.net", doc)
@@ -0,0 +1,73 @@
+import io
+import json
+import pytest
+import pyld.jsonld
+import sonormal.stream
+
+_CONTEXT = {"@vocab": "https://example.net/test/"}
+
+graph_tests = [
+    {
+        "@context": _CONTEXT,
+        "@graph": [{"@id": f"https://example.net/n/{i}", "value": i * 1.5} for i in range(50)],
+    },
+    # @context after @graph
+    {"@graph": [{"@id": "https://example.net/a", "n": 12345}], "@context": _CONTEXT},
+    # named graph
+    {"@context": _CONTEXT, "@id": "https://example.net/g", "@graph": [{"n": "x"}, {"n": "y"}]},
+    # no @graph
+    {"@context": _CONTEXT, "@id": "https://example.net/a", "n": [1, 2, {"m": "]}"}]},
+    # top level array
+    [{"@context": _CONTEXT, "n": 1}, {"@context": _CONTEXT, "n": 2}],
+    {"@context": _CONTEXT, "@graph": []},
+]
+
+
+@pytest.mark.parametrize("doc", graph_tests)
+@pytest.mark.parametrize("read_size", [1, 7, 4096])
+def test_graphReader(doc, read_size):
+    expected = list(sonormal.stream.splitGraph(doc))
+    src = io.StringIO(json.dumps(doc, indent=2))
+    res = list(sonormal.stream.GraphReader(src, read_size=read_size).documents())
+    assert res == expected
+
+
+def test_graphReaderNodes():
+    doc = graph_tests[0]
+    reader = sonormal.stream.GraphReader(io.StringIO(json.dumps(doc)), read_size=64)
+    expanded = []
+    for ndoc in reader.documents():
+        # The buffer only holds about a node at a time
+        assert len(reader._buf) < 256
+        expanded += pyld.jsonld.expand(ndoc)
+    assert reader.n_nodes == 50
+    assert expanded == pyld.jsonld.expand(doc)
+
+
+@pytest.mark.parametrize("src", ['{"@graph": [{"a": 1}', '{"@graph": [{"a": 1}]} x', "1"])
+def test_graphReaderInvalid(src):
+    with pytest.raises(ValueError):
+        list(sonormal.stream.GraphReader(io.StringIO(src), read_size=4).documents())
+
+
+class _Pipe(io.StringIO):
+    def seekable(self):
+        return False
+
+
+def test_graphReaderContextLast():
+    nodes = [{"@id": f"https://example.net/n/{i}", "n": i} for i in range(20)]
+    doc = {"@graph": nodes, "@id": "https://example.net/g", "@context": _CONTEXT}
+    expected = list(sonormal.stream.splitGraph(doc))
+    # Nodes are not held when the source can be read again
+    reader = sonormal.stream.GraphReader(io.StringIO(json.dumps(doc)), read_size=16)
+    assert list(reader.documents()) == expected
+    assert reader.n_held == 0
+    reader = sonormal.stream.GraphReader(_Pipe(json.dumps(doc)), read_size=16)
+    assert list(reader.documents()) == expected
+    assert reader.n_held == 20
+    # Without a @context nodes are not held either
+    del doc["@context"]
+    reader = sonormal.stream.GraphReader(io.StringIO(json.dumps(doc)), read_size=16)
+    assert list(reader.documents()) == list(sonormal.stream.splitGraph(doc))
+    assert reader.n_held == 0